@@ -1,5 +1,16 @@
 from django.contrib import admin
+
+from core.changelist import KeysetChangeList
+from core.forms import (
+    AutocompleteSelect,
+    AutocompleteSelectMultiple,
+    LookupChoiceField,
+    LookupMultipleChoiceField,
+    VersionedModelForm,
+    area_path,
+    )
 from core.models import (
+    LOOKUP_MODELS,
     Area,
     AreaFlag,
     AreaHelp,
@@ -66,62 +77,237 @@ from core.models import (
     DoorType,
     Door,
     )
+from core.vnums import VNUM_MODELS, allocate, next_area_vnum
+
+
+class CoreAdmin(admin.ModelAdmin):
+    """
+    Serves the choices for lookup-table fields from the registry, and turns
+    the fields for items, mobs, rooms and doors into autocompletes that only
+    offer rows from the edited row's own area. A new area, room, mob or item
+    whose vnum is left blank gets the next free one (see core.vnums).
+    """
+    # Path from the edited row to its area, e.g. 'room__area'. When adding
+    # a row the area comes from an ?area=<pk> parameter instead.
+    area_path = None
+    # Relations offered from every area rather than the row's own.
+    world_fields = ()
+    list_select_related = True
+    # Relations to join for the changelist instead, when select_related()
+    # wouldn't follow them (it skips nullable ones).
+    select_related = ()
+    # Unique fields to page the changelist by (see core.changelist), or None
+    # for numbered pages.
+    keyset = None
+    # Checks row_version on save, for the models that have one.
+    form = VersionedModelForm
+
+    def __init__(self, model, admin_site):
+        super(CoreAdmin, self).__init__(model, admin_site)
+        if self.keyset and not self.change_list_template:
+            self.change_list_template = 'admin/core/keyset_change_list.html'
+
+    def queryset(self, request):
+        queryset = super(CoreAdmin, self).queryset(request)
+        if self.select_related:
+            queryset = queryset.select_related(*self.select_related)
+        return queryset
+
+    def get_changelist(self, request, **kwargs):
+        if self.keyset:
+            return KeysetChangeList
+        return super(CoreAdmin, self).get_changelist(request, **kwargs)
+
+    def get_form(self, request, obj=None, **kwargs):
+        # ModelAdmins are shared between requests, so the area rides on the
+        # request to the formfield_for_* methods.
+        request.admin_area = self.area_of(request, obj)
+        form = super(CoreAdmin, self).get_form(request, obj, **kwargs)
+        if obj is None and 'vnum' in form.base_fields and issubclass(self.model, (Area,) + VNUM_MODELS):
+            form.base_fields['vnum'].required = False
+            form.base_fields['vnum'].help_text = 'Leave blank for the next free vnum.'
+        return form
+
+    def save_model(self, request, obj, form, change):
+        # The add view's transaction keeps the vnum until the row exists.
+        if not change and 'vnum' in form.base_fields and obj.vnum is None:
+            if isinstance(obj, Area):
+                obj.vnum = next_area_vnum()
+            else:
+                obj.vnum = allocate(obj.area, type(obj))
+        super(CoreAdmin, self).save_model(request, obj, form, change)
+
+    def area_of(self, request, obj):
+        if obj is None:
+            area = request.GET.get('area', '')
+            return int(area) if area.isdigit() else None
+        if self.area_path is None:
+            return None
+        names = self.area_path.split('__')
+        for name in names[:-1]:
+            obj = getattr(obj, name)
+        return getattr(obj, '%s_id' % (names[-1]))
+
+    def area_scope(self, db_field, request, kwargs, widget):
+        """
+        Sets the widget, and the queryset if the area is known, for a
+        relation to an area-owned model.
+        """
+        model = db_field.rel.to
+        area = None
+        if db_field.name not in self.world_fields:
+            area = getattr(request, 'admin_area', None)
+        kwargs['widget'] = widget(model, area)
+        if area is not None:
+            kwargs['queryset'] = model._default_manager.filter(**{area_path(model)[0]: area})
+
+    def formfield_for_foreignkey(self, db_field, request=None, **kwargs):
+        if db_field.rel.to in LOOKUP_MODELS:
+            kwargs['form_class'] = LookupChoiceField
+        elif area_path(db_field.rel.to) is not None:
+            self.area_scope(db_field, request, kwargs, AutocompleteSelect)
+        return super(CoreAdmin, self).formfield_for_foreignkey(db_field, request, **kwargs)
+
+    def formfield_for_manytomany(self, db_field, request=None, **kwargs):
+        if db_field.rel.to in LOOKUP_MODELS:
+            kwargs['form_class'] = LookupMultipleChoiceField
+        elif area_path(db_field.rel.to) is not None:
+            self.area_scope(db_field, request, kwargs, AutocompleteSelectMultiple)
+        return super(CoreAdmin, self).formfield_for_manytomany(db_field, request, **kwargs)
+
+
+class AreaHelpAdmin(CoreAdmin):
+    area_path = 'area'
+    list_display = ('keywords', 'area')
+
+
+class ExtraDescriptionAdmin(CoreAdmin):
+    area_path = 'item__area'
+    list_display = ('keywords', 'item')
+
+
+class ItemAdmin(CoreAdmin):
+    area_path = 'area'
+    list_display = ('vnum', 'short_desc', 'area')
+    list_filter = ('area',)
+    search_fields = ('names', 'short_desc')
+    keyset = ('area', 'vnum')
+
+
+class ItemContainerResetAdmin(CoreAdmin):
+    area_path = 'container__area'
+    list_display = ('container', 'item')
+    keyset = ('container', 'item')
+
+
+class MobileAdmin(CoreAdmin):
+    area_path = 'area'
+    list_display = ('vnum', 'short_desc', 'area')
+    list_filter = ('area',)
+    search_fields = ('names', 'short_desc')
+    keyset = ('area', 'vnum')
+
+
+class ShopkeeperAdmin(CoreAdmin):
+    area_path = 'mobile__area'
+    list_display = ('mobile', 'race', 'opens', 'closes')
+
+
+class MobRoomResetAdmin(CoreAdmin):
+    area_path = 'mobile__area'
+    list_display = ('mobile', 'room', 'reset_every_cycle')
+    keyset = ('mobile', 'room')
+
+
+class MobItemResetAdmin(CoreAdmin):
+    area_path = 'mobile__area'
+    list_display = ('mobile', 'item', 'wear_location', 'reset_every_cycle')
+    keyset = ('item', 'mobile')
+
+
+class RoomAdmin(CoreAdmin):
+    area_path = 'area'
+    list_display = ('vnum', 'area')
+    list_filter = ('area',)
+    keyset = ('area', 'vnum')
+
+
+class ItemRoomResetAdmin(CoreAdmin):
+    area_path = 'room__area'
+    list_display = ('room', 'item', 'reset_every_cycle')
+    keyset = ('room', 'item')
+
+
+class DoorTriggerAdmin(CoreAdmin):
+    area_path = 'door__room__area'
+    list_display = ('door', 'trigger_type', 'TFC_id')
+
+
+class DoorAdmin(CoreAdmin):
+    area_path = 'room__area'
+    # Exits may lead into other areas.
+    world_fields = ('room_to',)
+    list_display = ('room', 'direction', 'room_to')
+    select_related = ('room', 'room_to')
+    list_filter = ('room__area',)
+    keyset = ('room', 'direction')
+
 
-admin.site.register(Area)
+admin.site.register(Area, CoreAdmin)
 admin.site.register(AreaFlag)
-admin.site.register(AreaHelp)
+admin.site.register(AreaHelp, AreaHelpAdmin)
 admin.site.register(Spell)
 admin.site.register(WeaponDamageType)
 admin.site.register(DrinkType)
 admin.site.register(ContainerFlag)
 admin.site.register(ItemType)
-admin.site.register(ExtraDescription)
+admin.site.register(ExtraDescription, ExtraDescriptionAdmin)
 admin.site.register(WearFlag)
 admin.site.register(ResetWearFlag)
 admin.site.register(ItemExtraFlag)
 admin.site.register(ItemModifier)
-admin.site.register(Light)
-admin.site.register(Fountain)
-admin.site.register(Weapon)
-admin.site.register(AnimalWeapon)
-admin.site.register(Armor)
-admin.site.register(AnimalArmor)
-admin.site.register(Food)
-admin.site.register(PetFood)
-admin.site.register(Scroll)
-admin.site.register(Potion)
-admin.site.register(Pill)
-admin.site.register(Wand)
-admin.site.register(Staff)
-admin.site.register(Fetish)
-admin.site.register(Ring)
-admin.site.register(Relic)
-admin.site.register(Treasure)
-admin.site.register(Furniture)
-admin.site.register(Trash)
-admin.site.register(Key)
-admin.site.register(Boat)
-admin.site.register(Decoration)
-admin.site.register(Jewelry)
-admin.site.register(DrinkContainer)
-admin.site.register(Container)
-admin.site.register(ItemContainerReset)
-admin.site.register(Money)
+admin.site.register(Light, ItemAdmin)
+admin.site.register(Fountain, ItemAdmin)
+admin.site.register(Weapon, ItemAdmin)
+admin.site.register(AnimalWeapon, ItemAdmin)
+admin.site.register(Armor, ItemAdmin)
+admin.site.register(AnimalArmor, ItemAdmin)
+admin.site.register(Food, ItemAdmin)
+admin.site.register(PetFood, ItemAdmin)
+admin.site.register(Scroll, ItemAdmin)
+admin.site.register(Potion, ItemAdmin)
+admin.site.register(Pill, ItemAdmin)
+admin.site.register(Wand, ItemAdmin)
+admin.site.register(Staff, ItemAdmin)
+admin.site.register(Fetish, ItemAdmin)
+admin.site.register(Ring, ItemAdmin)
+admin.site.register(Relic, ItemAdmin)
+admin.site.register(Treasure, ItemAdmin)
+admin.site.register(Furniture, ItemAdmin)
+admin.site.register(Trash, ItemAdmin)
+admin.site.register(Key, ItemAdmin)
+admin.site.register(Boat, ItemAdmin)
+admin.site.register(Decoration, ItemAdmin)
+admin.site.register(Jewelry, ItemAdmin)
+admin.site.register(DrinkContainer, ItemAdmin)
+admin.site.register(Container, ItemAdmin)
+admin.site.register(ItemContainerReset, ItemContainerResetAdmin)
+admin.site.register(Money, ItemAdmin)
 admin.site.register(Race)
 admin.site.register(KnownLanguage)
 admin.site.register(PreferredLanguage)
 admin.site.register(ActionFlag)
 admin.site.register(AffectFlag)
 admin.site.register(SpecialFunction)
-admin.site.register(Mobile)
-admin.site.register(Shopkeeper)
-admin.site.register(MobRoomReset)
-admin.site.register(MobItemReset)
+admin.site.register(Mobile, MobileAdmin)
+admin.site.register(Shopkeeper, ShopkeeperAdmin)
+admin.site.register(MobRoomReset, MobRoomResetAdmin)
+admin.site.register(MobItemReset, MobItemResetAdmin)
 admin.site.register(RoomType)
 admin.site.register(RoomFlag)
 admin.site.register(RoomSpecialFunction)
-admin.site.register(Room)
-admin.site.register(ItemRoomReset)
-admin.site.register(DoorTrigger)
+admin.site.register(Room, RoomAdmin)
+admin.site.register(ItemRoomReset, ItemRoomResetAdmin)
+admin.site.register(DoorTrigger, DoorTriggerAdmin)
 admin.site.register(DoorType)
-admin.site.register(Door)
+admin.site.register(Door, DoorAdmin)
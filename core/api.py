@@ -0,0 +1,294 @@
+"""
+Read-only JSON for the editor front end.
+
+An area is served as lists of rows for each kind in RESOURCES, read with
+one values() query per kind, so no model instances are built. Every area
+has a revision number (AreaRevision) that the signal handlers below raise
+whenever one of those rows is saved or deleted, noting the row in
+AreaChange. The revision, with the area's pk, makes the version token that
+serves as the response's ETag, and a client holding a token can ask for
+just the rows changed since. A row moved to another area is noted in both,
+and counts as deleted in the one it left. Rows core.models rewrites with
+update() (packed values lines and flag vectors) are noted too, see
+core.signals.rows_updated.
+
+Changes that can't be sent as a delta are marked with touch_area(), which
+makes older tokens fetch the whole area again: bulk inserts into an
+existing area, changes to the area's own row, and more than NOTE_LIMIT
+rows of an area rewritten at once.
+"""
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+
+from core.bulk import IN_SIZE, chunked
+from core.models import (
+    Area,
+    AreaChange,
+    AreaRevision,
+    Door,
+    Item,
+    ItemContainerReset,
+    ItemRoomReset,
+    MobItemReset,
+    MobRoomReset,
+    Mobile,
+    Room,
+    flag_owners,
+    )
+from core.signals import area_touched, change_noted
+
+
+class Resource(object):
+    """
+    One kind of row in an area's JSON: its model and the path from it to
+    the area.
+    """
+    def __init__(self, kind, model, area):
+        self.kind = kind
+        self.model = model
+        self.area = area
+        self.fields = [field.attname for field in model._meta.fields]
+        # The foreign key that leads to the area.
+        self.key = model._meta.get_field(area.split('__')[0]).attname
+
+    def rows(self, **filters):
+        return list(self.model._default_manager.filter(**filters).order_by('pk').values(*self.fields))
+
+    def area_pk(self, instance, key=None):
+        """
+        The pk of the instance's area, or of the area it would be in with
+        ``key`` as its foreign key.
+        """
+        if key is None:
+            key = getattr(instance, self.key)
+        if self.area == 'area' or key is None:
+            return key
+        field = self.model._meta.get_field(self.area.split('__')[0])
+        areas = field.rel.to._default_manager.filter(pk=key).values_list('area', flat=True)
+        return areas[0] if areas else None
+
+
+RESOURCES = (
+    Resource('rooms', Room, 'area'),
+    Resource('exits', Door, 'room__area'),
+    Resource('mobiles', Mobile, 'area'),
+    Resource('items', Item, 'area'),
+    Resource('mob_room_resets', MobRoomReset, 'mobile__area'),
+    Resource('mob_item_resets', MobItemReset, 'mobile__area'),
+    Resource('item_room_resets', ItemRoomReset, 'room__area'),
+    Resource('item_container_resets', ItemContainerReset, 'container__area'),
+    )
+
+KINDS = dict((resource.kind, resource) for resource in RESOURCES)
+
+# Concrete item types inherit the Item's.
+for resource in RESOURCES:
+    resource.model._api_resource = resource
+
+AREA_FIELDS = ('id', 'vnum', 'name', 'author', 'level_low', 'level_high', 'flags_vector', 'notes')
+
+# Most rows of one area rewritten at once that are logged one by one.
+NOTE_LIMIT = 100
+
+
+class TokenError(ValueError):
+    pass
+
+
+### Revisions ###
+def revision(area_pk):
+    """
+    Returns (number, floor) for an area.
+    """
+    rows = AreaRevision.objects.filter(area=area_pk).values_list('number', 'floor')
+    return rows[0] if rows else (0, 0)
+
+
+def version_token(area_pk, number):
+    return '%d-%d' % (area_pk, number)
+
+
+def parse_token(token):
+    try:
+        area_pk, number = [int(part) for part in token.split('-')]
+    except ValueError:
+        raise TokenError('Bad version %r.' % (token))
+    return area_pk, number
+
+
+def bump(area_pk):
+    """
+    Raises an area's revision by one and returns the new number.
+    """
+    if not AreaRevision.objects.filter(area=area_pk).update(number=F('number') + 1):
+        AreaRevision.objects.create(area_id=area_pk, number=1)
+        return 1
+    return AreaRevision.objects.filter(area=area_pk).values_list('number', flat=True)[0]
+
+
+def touch_area(area_pk):
+    """
+    Marks an area as changed in ways that weren't logged, such as bulk
+    inserts. Clients holding an older version fetch the whole area again.
+    """
+    number = bump(area_pk)
+    AreaRevision.objects.filter(area=area_pk).update(floor=number)
+    area_touched.send(sender=AreaRevision, area_pk=area_pk, number=number)
+
+
+def note_change(resource, area_pk, object_pk):
+    """
+    Logs a change to a row and returns the area's new revision number.
+    """
+    number = bump(area_pk)
+    if not AreaChange.objects.filter(area=area_pk, kind=resource.kind, object_pk=object_pk).update(revision=number):
+        AreaChange.objects.create(area_id=area_pk, kind=resource.kind, object_pk=object_pk, revision=number)
+    return number
+
+
+def log_change(instance, resource, area_pk, created=False, deleted=False, fields=None):
+    number = note_change(resource, area_pk, instance.pk)
+    change_noted.send(sender=resource.model, instance=instance, resource=resource, area_pk=area_pk,
+                      number=number, created=created, deleted=deleted, fields=fields)
+
+
+def resource_of(instance):
+    for resource in RESOURCES:
+        if isinstance(instance, resource.model):
+            return resource
+    return None
+
+
+def remember_area(sender, instance, **kwargs):
+    # The foreign key leading to the row's area when loaded, to tell when a
+    # save moves it to another.
+    resource = getattr(sender, '_api_resource', None)
+    if resource is not None:
+        instance._api_area_key = getattr(instance, resource.key)
+
+
+def row_deleting(sender, instance, **kwargs):
+    # By post_delete the room or mob that leads to the area may be gone too.
+    resource = resource_of(instance)
+    if resource is not None:
+        instance._api_area_pk = resource.area_pk(instance)
+
+
+def row_changed(sender, instance, **kwargs):
+    resource = resource_of(instance)
+    if resource is None or kwargs.get('raw'):
+        return
+    area_pk = getattr(instance, '_api_area_pk', None) or resource.area_pk(instance)
+    if area_pk is not None:
+        log_change(instance, resource, area_pk, created=kwargs.get('created', False),
+                   deleted=kwargs.get('signal') is post_delete, fields=kwargs.get('fields'))
+    if kwargs.get('signal') is not post_save:
+        return
+    key = getattr(instance, resource.key)
+    if not kwargs.get('created') and getattr(instance, '_api_area_key', key) != key:
+        # Moved: the area it left sees it deleted.
+        left = resource.area_pk(instance, instance._api_area_key)
+        if left is not None and left != area_pk:
+            log_change(instance, resource, left, deleted=True)
+    instance._api_area_key = key
+
+
+def rows_changed(sender, pks, fields, **kwargs):
+    """
+    Logs rows rewritten with update(), by core.models or after a clear().
+    """
+    if issubclass(sender, Area):
+        for area_pk in sorted(pks):
+            touch_area(area_pk)
+        return
+    resource = getattr(sender, '_api_resource', None)
+    if resource is None:
+        return
+    by_area = {}
+    for chunk in chunked(sorted(pks), IN_SIZE):
+        for pk, area_pk in sender._default_manager.filter(pk__in=chunk).values_list('pk', resource.area):
+            by_area.setdefault(area_pk, []).append(pk)
+    for area_pk, area_pks in sorted(by_area.items()):
+        if len(area_pks) > NOTE_LIMIT:
+            touch_area(area_pk)
+            continue
+        for instance in sender._default_manager.filter(pk__in=area_pks).order_by('pk'):
+            log_change(instance, resource, area_pk, fields=fields)
+
+
+def area_changed(sender, instance, created, raw=False, **kwargs):
+    # The area's own row isn't sent in deltas.
+    if not created and not raw:
+        touch_area(instance.pk)
+
+
+def m2m_row_changed(sender, instance, action, reverse, model, pk_set, **kwargs):
+    # Flag vectors are among a row's fields.
+    if reverse and action == 'pre_clear':
+        # Once cleared, the rows that lost ``instance`` can't be found.
+        instance._api_cleared = flag_owners(model, m2m_fields(model, sender)[0], instance.pk)
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear') or (action != 'post_clear' and not pk_set):
+        return
+    if not reverse:
+        if isinstance(instance, Area):
+            touch_area(instance.pk)
+        else:
+            row_changed(sender, instance, fields=m2m_fields(type(instance), sender))
+        return
+    if action == 'post_clear':
+        pk_set, instance._api_cleared = instance._api_cleared, ()
+    if pk_set:
+        rows_changed(model, pk_set, m2m_fields(model, sender))
+
+
+def m2m_fields(model, through):
+    return [field.name for field in model._meta.many_to_many if field.rel.through is through]
+
+
+def area_deleted(sender, instance, **kwargs):
+    # Rows deleted along with the area were logged on their way out.
+    AreaChange.objects.filter(area=instance.pk).delete()
+    AreaRevision.objects.filter(area=instance.pk).delete()
+
+
+### Serializing ###
+def area_data(area):
+    """
+    The whole area, as a dict ready for json.dumps().
+    """
+    number, floor = revision(area.pk)
+    data = {
+        'version': version_token(area.pk, number),
+        'area': Area.objects.filter(pk=area.pk).values(*AREA_FIELDS)[0],
+        }
+    for resource in RESOURCES:
+        data[resource.kind] = resource.rows(**{resource.area: area.pk})
+    return data
+
+
+def area_delta(area, token):
+    """
+    The rows of an area changed since the version ``token``, as
+    {"version", "since", "changed": {kind: [rows]}, "deleted": {kind: [pks]}},
+    or the whole area (with "full": true) if the token is from another
+    area or from before changes that weren't logged.
+    """
+    area_pk, since = parse_token(token)
+    number, floor = revision(area.pk)
+    if area_pk != area.pk or since < floor or since > number:
+        return dict(area_data(area), full=True)
+    changed = {}
+    for kind, object_pk in AreaChange.objects.filter(area=area, revision__gt=since).values_list('kind', 'object_pk'):
+        changed.setdefault(kind, []).append(object_pk)
+    data = {'version': version_token(area.pk, number), 'since': token, 'changed': {}, 'deleted': {}}
+    for kind, pks in changed.items():
+        resource = KINDS[kind]
+        rows = []
+        for chunk in chunked(sorted(pks), IN_SIZE):
+            # Rows that moved to another area count as deleted from this one.
+            rows.extend(resource.rows(**{'pk__in': chunk, resource.area: area.pk}))
+        found = set(row['id'] for row in rows)
+        data['changed'][kind] = rows
+        data['deleted'][kind] = sorted(set(pks) - found)
+    return data
@@ -0,0 +1,64 @@
+"""
+Cached responses and fragments for each area.
+
+Everything cached for an area is keyed by the area's revision number (see
+core.api), which goes up whenever one of its rows is saved or deleted, or
+the area is touched after changes made without signals. Entries cached
+under an older revision are never read again but left to expire. Any cache
+backend will do, including the local-memory and file-based ones;
+deployments with more than one process need one they share.
+
+Area exports aren't cached here: core.export_cache keeps their blocks and
+fragments, and the export is streamed from those.
+"""
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+
+from core.api import revision
+from core.models import Area
+
+
+AREA_CACHE_TIMEOUT = getattr(settings, 'AREA_CACHE_TIMEOUT', 60 * 60 * 24)
+
+
+def entry_key(area_pk, number, name):
+    return 'area:%d:%d:%s' % (area_pk, number, name)
+
+
+def cached(area_pk, name, build, timeout=None):
+    """
+    Returns the value cached as ``name`` for the area's current revision,
+    calling ``build()`` and caching what it returns if there's none.
+    """
+    key = entry_key(area_pk, revision(area_pk)[0], name)
+    value = cache.get(key)
+    if value is None:
+        value = build()
+        cache.set(key, value, AREA_CACHE_TIMEOUT if timeout is None else timeout)
+    return value
+
+
+def cache_area_view(view):
+    """
+    Caches a view of one area, called with the area's ``vnum``, by the
+    area's revision and the request's path and query string. Only
+    successful GETs are cached; a vnum with no area is left to the view.
+    Views that stream their content shouldn't be wrapped.
+    """
+    @wraps(view)
+    def wrapper(request, vnum, *args, **kwargs):
+        areas = Area.objects.filter(vnum=vnum).values_list('pk', 'revision__number')
+        if request.method not in ('GET', 'HEAD') or not areas:
+            return view(request, vnum, *args, **kwargs)
+        area_pk, number = areas[0]
+        key = entry_key(area_pk, number or 0, 'response:%s' % (hashlib.md5(request.get_full_path()).hexdigest()))
+        response = cache.get(key)
+        if response is None:
+            response = view(request, vnum, *args, **kwargs)
+            if response.status_code == 200:
+                cache.set(key, response, AREA_CACHE_TIMEOUT)
+        return response
+    return wrapper
@@ -0,0 +1,340 @@
+"""
+Batches of edits from the map editor.
+
+A batch is an ordered list of operations:
+
+    {"op": "create", "model": "room", "ref": "r1", "fields": {"area": 3, "vnum": 1005}}
+    {"op": "create", "model": "door", "fields": {"room": {"ref": "r1"}, "room_to": 12, ...}}
+    {"op": "update", "model": "mobile", "pk": 40, "fields": {"level": 12}}
+    {"op": "delete", "model": "itemroomreset", "pk": 7}
+
+A relation may name a row created earlier in the batch as {"ref": name}.
+Every operation is checked before anything is written, with one query per
+model for the rows being changed and one per related model for the rows
+referred to, so a batch either applies completely or not at all. It's then
+applied in one transaction. Runs of creates of one model are written with
+bulk_insert() and their pks read back by the rows' unique_together keys;
+post_save is sent for them as if they had been saved one at a time.
+Concrete item types span several tables and pack their values line from
+related rows, so they're saved one at a time.
+
+A room, mob or item created without a vnum gets the next free one in its
+area; a run of them is given a block of vnums at once (see core.vnums).
+
+An update may give the row_version it last read among its fields, and is
+refused if the row has been saved since. Given a user, a batch is refused
+unless the user has the admin's add, change or delete permission for the
+model of each operation.
+"""
+from django.core.exceptions import NON_FIELD_ERRORS, ValidationError
+from django.db import IntegrityError, router
+from django.db.models import Q
+from django.db.models.signals import post_save
+
+from core.bulk import IN_SIZE, bulk_insert, chunked
+from core.commits import commit_on_success
+from core.models import (
+    ITEM_CLASSES,
+    Area,
+    ConflictError,
+    Door,
+    Item,
+    ItemContainerReset,
+    ItemRoomReset,
+    MobItemReset,
+    MobRoomReset,
+    Mobile,
+    Room,
+    )
+from core.vnums import VNUM_MODELS, allocate
+
+
+# Models a batch may change, by lowercased name.
+BATCH_MODELS = dict((model._meta.object_name.lower(), model) for model in (
+    Room, Door, Mobile, Item, MobRoomReset, MobItemReset, ItemRoomReset, ItemContainerReset,
+    ) + tuple(ITEM_CLASSES.values()))
+
+OPERATIONS = ('create', 'update', 'delete')
+
+# The permission each operation needs, as named by Options.get_*_permission().
+PERMISSIONS = {'create': 'add', 'update': 'change', 'delete': 'delete'}
+
+
+class BatchError(Exception):
+    """
+    Raised with {operation index: {field: [messages]}} for a batch that
+    can't be applied. Errors of the whole batch are under NON_FIELD_ERRORS.
+    """
+    def __init__(self, errors):
+        super(BatchError, self).__init__(errors)
+        self.errors = errors
+
+
+class Operation(object):
+    def __init__(self, index, op, model, pk=None, ref=None, fields=None):
+        self.index = index
+        self.op = op
+        self.model = model
+        self.pk = pk
+        self.ref = ref
+        self.fields = fields or {}
+        self.instance = None
+        # {field name: ref} for relations to rows created in the batch.
+        self.refs = {}
+        # Whether it's given the next free vnum when written.
+        self.numbered = op == 'create' and issubclass(model, VNUM_MODELS) and 'vnum' not in self.fields
+
+
+def ref_name(value):
+    if isinstance(value, dict) and value.keys() == ['ref']:
+        return value['ref']
+    return None
+
+
+class Batch(object):
+    """
+    Checks and applies a list of operations (dicts decoded from JSON).
+    """
+    def __init__(self, operations, user=None):
+        self.user = user
+        self.errors = {}
+        self.operations = []
+        # {ref: the Operation creating it}
+        self.created = {}
+        for index, data in enumerate(operations):
+            operation = self.parse(index, data)
+            if operation is not None:
+                self.operations.append(operation)
+
+    def error(self, index, field, message):
+        self.errors.setdefault(index, {}).setdefault(field, []).append(message)
+
+    ### Checking ###
+    def parse(self, index, data):
+        if not isinstance(data, dict):
+            return self.error(index, NON_FIELD_ERRORS, 'An operation must be an object.')
+        op, model = data.get('op'), BATCH_MODELS.get(data.get('model'))
+        if op not in OPERATIONS:
+            return self.error(index, 'op', 'Unknown operation %r.' % (op))
+        if model is None:
+            return self.error(index, 'model', 'Unknown model %r.' % (data.get('model')))
+        opts = model._meta
+        permission = getattr(opts, 'get_%s_permission' % (PERMISSIONS[op]))()
+        if self.user is not None and not self.user.has_perm('%s.%s' % (opts.app_label, permission)):
+            return self.error(index, 'op', 'You may not %s %s rows.' % (op, opts.verbose_name))
+        fields = data.get('fields') or {}
+        if not isinstance(fields, dict):
+            return self.error(index, 'fields', 'Fields must be an object.')
+        if op == 'create':
+            if model is Item:
+                return self.error(index, 'model', 'Items are created as one of the item types.')
+            ref = data.get('ref')
+            if ref is not None and ref in self.created:
+                return self.error(index, 'ref', 'Ref %r is already used.' % (ref))
+            operation = Operation(index, op, model, ref=ref, fields=fields)
+            if ref is not None:
+                self.created[ref] = operation
+            return operation
+        if not isinstance(data.get('pk'), (int, long)):
+            return self.error(index, 'pk', 'A pk is required.')
+        if op == 'delete' and fields:
+            return self.error(index, 'fields', 'Deletes take no fields.')
+        return Operation(index, op, model, pk=data['pk'], fields=fields)
+
+    def check(self):
+        """
+        Loads the rows to update or delete and checks every operation's
+        fields, raising BatchError if any are wrong.
+        """
+        self.load()
+        related = {}
+        for operation in self.operations:
+            if operation.op != 'delete':
+                self.set_fields(operation, related)
+        self.check_related(related)
+        if self.errors:
+            raise BatchError(self.errors)
+
+    def load(self):
+        pks = {}
+        for operation in self.operations:
+            if operation.op != 'create':
+                pks.setdefault(operation.model, set()).add(operation.pk)
+        found = {}
+        for model, model_pks in pks.items():
+            found[model] = {}
+            for chunk in chunked(sorted(model_pks), IN_SIZE):
+                found[model].update(model._default_manager.in_bulk(chunk))
+        for operation in self.operations:
+            if operation.op == 'create':
+                operation.instance = operation.model()
+            elif operation.pk in found[operation.model]:
+                operation.instance = found[operation.model][operation.pk]
+            else:
+                self.error(operation.index, 'pk', 'No %s with pk %d.' % (operation.model._meta.verbose_name, operation.pk))
+
+    def set_fields(self, operation, related):
+        """
+        Sets the operation's fields on its instance and checks them, adding
+        {model: {pk: [(operation, field)]}} to ``related`` for relations to
+        existing rows, which are checked together afterwards.
+        """
+        instance = operation.instance
+        if instance is None:
+            return
+        opts = operation.model._meta
+        names = [field.name for field in opts.fields]
+        relations = [field for field in opts.fields if field.rel and not field.rel.parent_link]
+        for name, value in operation.fields.items():
+            if name not in names:
+                self.error(operation.index, name, 'Unknown field.')
+                continue
+            if name == 'row_version' and operation.op == 'update':
+                # Checked rather than set; saving claims the next version.
+                if value != instance.row_version:
+                    self.error(operation.index, name, 'Changed by someone else since version %s.' % (value))
+                continue
+            field = opts.get_field(name)
+            if field.primary_key or not field.editable:
+                self.error(operation.index, name, 'This field can\'t be set.')
+            elif field.rel:
+                ref = ref_name(value)
+                if ref is None:
+                    setattr(instance, field.attname, value)
+                elif ref not in self.created or self.created[ref].index > operation.index:
+                    self.error(operation.index, name, 'Unknown ref %r.' % (ref))
+                elif not issubclass(self.created[ref].model, field.rel.to):
+                    self.error(operation.index, name, 'Ref %r isn\'t a %s.' % (ref, field.rel.to._meta.verbose_name))
+                else:
+                    operation.refs[name] = ref
+            else:
+                try:
+                    setattr(instance, field.attname, field.to_python(value))
+                except ValidationError as e:
+                    self.error(operation.index, name, u' '.join(e.messages))
+        for field in relations:
+            if field.name in operation.refs:
+                continue
+            value = getattr(instance, field.attname)
+            if value is None:
+                if not field.null:
+                    self.error(operation.index, field.name, 'This field is required.')
+            elif not isinstance(value, (int, long)):
+                self.error(operation.index, field.name, 'Expected a pk or a ref.')
+            else:
+                related.setdefault(field.rel.to, {}).setdefault(value, []).append((operation, field))
+        exclude = [field.name for field in relations]
+        if operation.numbered:
+            exclude.append('vnum')
+        try:
+            # Relations are checked in bulk, and uniqueness by the database.
+            instance.clean_fields(exclude=exclude)
+        except ValidationError as e:
+            for name, messages in e.message_dict.items():
+                self.errors.setdefault(operation.index, {}).setdefault(name, []).extend(messages)
+
+    def check_related(self, related):
+        for model, uses in related.items():
+            found = set()
+            for chunk in chunked(sorted(uses), IN_SIZE):
+                found.update(model._default_manager.filter(pk__in=chunk).values_list('pk', flat=True))
+            for pk in set(uses) - found:
+                for operation, field in uses[pk]:
+                    self.error(operation.index, field.name, 'No %s with pk %d.' % (model._meta.verbose_name, pk))
+
+    ### Applying ###
+    @commit_on_success
+    def apply(self):
+        """
+        Checks and applies the batch in one transaction, returning the
+        {ref: pk} of the rows it created.
+        """
+        self.check()
+        try:
+            run = []
+            for operation in self.operations:
+                if run and not self.joins(run, operation):
+                    self.flush(run)
+                    run = []
+                run.append(operation)
+            if run:
+                self.flush(run)
+        except (ConflictError, IntegrityError) as e:
+            raise BatchError({NON_FIELD_ERRORS: {NON_FIELD_ERRORS: [unicode(e)]}})
+        return dict((ref, operation.instance.pk) for ref, operation in self.created.items())
+
+    def joins(self, run, operation):
+        """
+        Whether ``operation`` can be written along with the ``run`` before it.
+        """
+        first = run[0]
+        if operation.op != first.op or operation.model is not first.model or operation.op == 'update':
+            return False
+        if operation.op == 'create':
+            if issubclass(operation.model, Item):
+                return False
+            # It may refer to a row the run hasn't written yet.
+            return not any(self.created[ref] in run for ref in operation.refs.values())
+        return True
+
+    def flush(self, run):
+        for operation in run:
+            for name, ref in operation.refs.items():
+                setattr(operation.instance, name, self.created[ref].instance)
+        first = run[0]
+        if first.op == 'create':
+            self.number([operation.instance for operation in run if operation.numbered])
+        if first.op == 'delete':
+            first.model._default_manager.filter(pk__in=[operation.pk for operation in run]).delete()
+        elif first.op == 'update' or issubclass(first.model, Item):
+            for operation in run:
+                operation.instance.save()
+        else:
+            self.insert(first.model, [operation.instance for operation in run])
+
+    def number(self, instances):
+        """
+        Gives ``instances`` the next free vnums of their areas, allocating
+        one block per area.
+        """
+        by_area = {}
+        for instance in instances:
+            by_area.setdefault(instance.area_id, []).append(instance)
+        areas = Area.objects.in_bulk(by_area.keys()) if by_area else {}
+        for area_pk, numbered in by_area.items():
+            start = allocate(areas[area_pk], type(numbered[0]), count=len(numbered))
+            for offset, instance in enumerate(numbered):
+                instance.vnum = start + offset
+
+    def insert(self, model, instances):
+        """
+        Bulk inserts ``instances``, then reads their pks back by their
+        unique keys and sends post_save for each.
+        """
+        bulk_insert(model, instances)
+        key = [model._meta.get_field(name) for name in model._meta.unique_together[0]]
+        keys = dict((tuple(getattr(obj, field.attname) for field in key), obj) for obj in instances)
+        # Each row's key takes one parameter per field.
+        for chunk in chunked(sorted(keys), IN_SIZE // len(key)):
+            match = Q()
+            for values in chunk:
+                match |= Q(**dict(zip([field.attname for field in key], values)))
+            rows = model._default_manager.filter(match).values_list(*([field.attname for field in key] + ['pk']))
+            for row in rows:
+                keys[tuple(row[:-1])].pk = row[-1]
+        using = router.db_for_write(model)
+        for obj in instances:
+            obj._state.adding = False
+            obj._state.db = using
+            post_save.send(sender=model, instance=obj, created=True, raw=False, using=using)
+
+
+def apply_batch(operations, user=None):
+    """
+    Applies a list of operations, as ``user`` if given, returning {ref: pk}
+    for the rows created. Raises BatchError with the errors by operation
+    index if the batch is wrong, in which case nothing is written.
+    """
+    if not isinstance(operations, list):
+        raise BatchError({NON_FIELD_ERRORS: {NON_FIELD_ERRORS: ['Expected a list of operations.']}})
+    return Batch(operations, user).apply()
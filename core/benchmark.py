@@ -0,0 +1,147 @@
+"""
+Timed scenarios over a world, for comparing runs.
+
+Each scenario is a method of the Benchmark that does one unit of work;
+run() repeats it and records the fastest, mean and slowest wall-clock time
+and the number of queries of the last run. The per-area scenarios work
+through a fixed sample of areas, so their times stay comparable as the
+world grows. Results are plain dicts, ready for json.dump().
+"""
+import platform
+import time
+
+from django.contrib.auth.models import User
+from django.core.signals import request_started
+from django.db import DEFAULT_DB_ALIAS, connections, reset_queries
+from django.test.client import Client
+
+from core.export import AreaExporter
+from core.graph import RoomGraph
+from core.importer import AreaImporter, AreaReader
+from core.lint import lint_area
+from core.models import Area, Door, Item, Mobile, Room
+from core.simulate import ResetSimulator
+from core.vnums import next_area_vnum
+
+
+SCENARIOS = ('export', 'import', 'lint', 'changelist', 'graph', 'simulate')
+
+BENCHMARK_USER = 'benchmark'
+
+
+class Benchmark(object):
+    def __init__(self, sample=5, repeat=3, cycles=1000):
+        self.sample = list(Area.objects.order_by('vnum')[:sample])
+        self.repeat = repeat
+        self.cycles = cycles
+
+    def counts(self):
+        return {
+            'areas': Area.objects.count(),
+            'rooms': Room.objects.count(),
+            'doors': Door.objects.count(),
+            'mobiles': Mobile.objects.count(),
+            'items': Item.objects.count(),
+            }
+
+    def run(self, scenarios=SCENARIOS):
+        """
+        Runs the named scenarios and returns the results.
+        """
+        results = {
+            'python': platform.python_version(),
+            'database': connections[DEFAULT_DB_ALIAS].vendor,
+            'counts': self.counts(),
+            'sample': [area.vnum for area in self.sample],
+            'repeat': self.repeat,
+            'scenarios': {},
+            }
+        for name in scenarios:
+            setup = getattr(self, 'setup_%s' % (name), None)
+            if setup is not None:
+                setup()
+            results['scenarios'][name] = self.time(name)
+        return results
+
+    def time(self, name):
+        """
+        Runs a scenario ``repeat`` times. Its teardown, if any, runs after
+        each run and isn't timed.
+        """
+        scenario = getattr(self, 'scenario_%s' % (name))
+        teardown = getattr(self, 'teardown_%s' % (name), None)
+        connection = connections[DEFAULT_DB_ALIAS]
+        old_debug_cursor = connection.use_debug_cursor
+        times = []
+        # Count the queries of every request a scenario makes, not just the last.
+        request_started.disconnect(reset_queries)
+        try:
+            for n in range(self.repeat):
+                connection.use_debug_cursor = n == self.repeat - 1
+                connection.queries = []
+                start = time.time()
+                scenario()
+                times.append(time.time() - start)
+                queries = len(connection.queries)
+                if teardown is not None:
+                    teardown()
+        finally:
+            connection.use_debug_cursor = old_debug_cursor
+            connection.queries = []
+            request_started.connect(reset_queries)
+        return {
+            'min': min(times),
+            'mean': sum(times) / len(times),
+            'max': max(times),
+            'queries': queries,
+            }
+
+    ### Scenarios ###
+    def scenario_export(self):
+        for area in self.sample:
+            u''.join(AreaExporter(area))
+
+    def setup_import(self):
+        self.records = [AreaReader(u''.join(AreaExporter(area)).splitlines(True)).read() for area in self.sample]
+
+    def scenario_import(self):
+        # Each area is imported as a new one, and deleted again afterwards.
+        importer = AreaImporter()
+        self.imported = []
+        for record in self.records:
+            record = dict(record, vnum=next_area_vnum(), name=u'%s (benchmark)' % (record['name']),
+                          author=u'%s-%s' % (BENCHMARK_USER, record['author']))
+            self.imported.append(importer.create(record))
+
+    def teardown_import(self):
+        for area in self.imported:
+            author = area.author
+            area.delete()
+            author.delete()
+
+    def scenario_lint(self):
+        for area in self.sample:
+            lint_area(area)
+
+    def setup_changelist(self):
+        if not User.objects.filter(username=BENCHMARK_USER).exists():
+            User.objects.create_superuser(BENCHMARK_USER, '', BENCHMARK_USER)
+        self.client = Client()
+        self.client.login(username=BENCHMARK_USER, password=BENCHMARK_USER)
+
+    def scenario_changelist(self):
+        for name in ('room', 'door', 'mobile', 'light', 'mobroomreset', 'itemroomreset'):
+            response = self.client.get('/admin/core/%s/' % (name))
+            if response.status_code != 200:
+                raise AssertionError('%s changelist returned %d' % (name, response.status_code))
+
+    def scenario_graph(self):
+        graph = RoomGraph.for_world()
+        graph.unreachable()
+        graph.dead_ends()
+        graph.one_way_exits()
+        graph.mismatched_exits()
+
+    def scenario_simulate(self):
+        for area in self.sample:
+            ResetSimulator(area).run(self.cycles, occupied=range(0, self.cycles, 3), attrition=0.2, seed=0)
@@ -0,0 +1,51 @@
+"""
+Bulk insert helpers.
+
+Django's bulk_create() refuses multi-table children (every concrete item
+type) and sends each call as a single statement, which SQLite rejects once
+it passes 999 parameters or 500 rows. bulk_insert() handles both.
+"""
+from itertools import islice
+
+from django.db import router, transaction
+
+
+# SQLite's SQLITE_MAX_VARIABLE_NUMBER and SQLITE_MAX_COMPOUND_SELECT.
+MAX_PARAMETERS = 999
+MAX_ROWS = 500
+
+# Longest pk__in list per query, leaving room for its other parameters.
+IN_SIZE = MAX_PARAMETERS - 10
+
+
+def chunked(iterable, size):
+    """
+    Yields lists of up to ``size`` items from ``iterable``.
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def bulk_insert(model, objs):
+    """
+    Inserts ``objs`` in as few statements as SQLite allows. Like
+    bulk_create(), this neither calls save() nor sets autoincrement pks.
+
+    For a multi-table child only the child's own table is written; the
+    parent rows must already exist and each object's parent link (e.g.
+    item_ptr_id) must be set.
+    """
+    fields = model._meta.local_fields
+    if model._meta.parents:
+        using = router.db_for_write(model)
+        insert = lambda chunk: model._base_manager._insert(chunk, fields=fields, using=using)
+    else:
+        insert = model.objects.bulk_create
+    size = max(1, min(MAX_ROWS, MAX_PARAMETERS // len(fields)))
+    for chunk in chunked(objs, size):
+        insert(chunk)
+    transaction.commit_unless_managed()
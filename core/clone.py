@@ -0,0 +1,311 @@
+"""
+Copying an area, or a cluster of its rooms, with everything in it.
+
+AreaCopier copies rooms, mobs and items into a target area, adding an
+offset to every vnum, along with what hangs off them: item type rows,
+extra descriptions, shopkeepers and their stock, doors and their triggers,
+resets, and many-to-many rows. References between copied rows are pointed
+at the copies; references to rows that weren't copied (such as an exit into
+another area) are kept. Each table is read with one values query and written
+with bulk_insert(), so the number of queries depends on the number of
+tables, not rows. Only lists of pks longer than SQLite's parameter limit
+are split.
+"""
+from core.api import touch_area
+from core.bulk import IN_SIZE, bulk_insert, chunked
+from core.commits import commit_on_success
+from core.export_cache import invalidate_area
+from core.importer import m2m_rows
+from core.layout import drop_layout
+from core.models import (
+    ITEM_CLASSES,
+    Area,
+    AreaHelp,
+    Container,
+    Door,
+    DoorTrigger,
+    ExtraDescription,
+    Item,
+    ItemContainerReset,
+    ItemRoomReset,
+    MobItemReset,
+    MobRoomReset,
+    Mobile,
+    Room,
+    Shopkeeper,
+    )
+from core.search import index_area
+from core.vnums import forget_indexes
+
+
+
+class CloneError(Exception):
+    pass
+
+
+def read(model, field, pks):
+    """
+    Returns the columns of ``model``'s own table for the rows whose
+    ``field`` is in ``pks``, as dicts keyed by attname.
+    """
+    fields = model._meta.local_fields
+    names = [f.name for f in fields]
+    rows = []
+    for chunk in chunked(sorted(pks), IN_SIZE):
+        for values in model._base_manager.filter(**{'%s__in' % (field): chunk}).values_list(*names):
+            rows.append(dict((f.attname, value) for f, value in zip(fields, values)))
+    return rows
+
+
+def copy(model, row, **changes):
+    """
+    A new, unsaved ``model`` with the columns of ``row`` and ``changes``.
+    """
+    values = dict(row, **changes)
+    if model._meta.pk.attname in values and not model._meta.parents:
+        values[model._meta.pk.attname] = None
+    return model(**values)
+
+
+def item_tables(item_class):
+    """
+    The tables below Item that ``item_class``'s rows span, from the top.
+    """
+    tables = []
+    while item_class is not Item:
+        tables.insert(0, item_class)
+        item_class = item_class._meta.parents.keys()[0]
+    return tables
+
+
+class AreaCopier(object):
+    """
+    Copies rows from ``source`` into ``target``, adding ``offset`` to vnums.
+    """
+    def __init__(self, source, target, offset):
+        self.source = source
+        self.target = target
+        self.offset = offset
+        # {model: {old pk: new pk}} for every copied row that others refer to.
+        self.pks = {}
+
+    def new_pk(self, model, pk):
+        return self.pks.get(model, {}).get(pk, pk)
+
+    def cluster(self, rooms):
+        """
+        Returns the (mobile pks, item pks) belonging with ``rooms``: the mobs
+        reset into them, the items reset into them or given to those mobs,
+        and whatever is reset into those items, as far as they belong to the
+        source area.
+        """
+        mobiles = set(pk for chunk in chunked(sorted(rooms), IN_SIZE)
+                      for pk in MobRoomReset.objects.filter(room__in=chunk, mobile__area=self.source)
+                                                    .values_list('mobile', flat=True))
+        items = set()
+        for chunk in chunked(sorted(rooms), IN_SIZE):
+            items.update(ItemRoomReset.objects.filter(room__in=chunk, item__area=self.source)
+                         .values_list('item', flat=True))
+        for chunk in chunked(sorted(mobiles), IN_SIZE):
+            items.update(MobItemReset.objects.filter(mobile__in=chunk, item__area=self.source)
+                         .values_list('item', flat=True))
+            items.update(Shopkeeper.reset_items.through.objects
+                         .filter(shopkeeper__mobile__in=chunk, item__area=self.source)
+                         .values_list('item', flat=True))
+        containers = items
+        while containers:
+            contents = set(pk for chunk in chunked(sorted(containers), IN_SIZE)
+                           for pk in ItemContainerReset.objects.filter(container__in=chunk, item__area=self.source)
+                                                               .values_list('item', flat=True))
+            containers = contents - items
+            items |= contents
+        return mobiles, items
+
+    def copy(self, rooms, mobiles, items):
+        """
+        Copies the given rooms, mobs and items (pks), and the rows that go
+        with them.
+        """
+        item_rows = read(Item, 'pk', items)
+        mobile_rows = read(Mobile, 'pk', mobiles)
+        room_rows = read(Room, 'pk', rooms)
+        for model, rows in ((Item, item_rows), (Mobile, mobile_rows), (Room, room_rows)):
+            self.check_vnums(model, rows)
+        self.copy_items(item_rows)
+        self.copy_mobiles(mobile_rows)
+        self.copy_rooms(room_rows)
+        self.copy_resets()
+        # The copies were inserted without signals. Exits out of them are
+        # new entrances to the rooms they lead to.
+        invalidate_area(self.target.pk)
+        index_area(self.target.pk)
+        touch_area(self.target.pk)
+        rooms = sorted(self.pks[Room].values())
+        drop_layout(self.target.pk, rooms)
+        areas = set()
+        for chunk in chunked(rooms, IN_SIZE):
+            areas.update(Room.objects.filter(entrances__room__in=chunk).exclude(area=self.target)
+                         .values_list('area', flat=True))
+        for area_pk in areas:
+            drop_layout(area_pk)
+        forget_indexes()
+
+    def check_vnums(self, model, rows):
+        if not rows:
+            return
+        low, high = self.target.vnum_range()
+        vnums = set(row['vnum'] + self.offset for row in rows)
+        outside = [vnum for vnum in vnums if not low <= vnum <= high]
+        if outside:
+            raise CloneError('%s vnum %d is outside area %d' % (model._meta.verbose_name, min(outside), self.target.vnum))
+        used = vnums.intersection(model._base_manager.filter(area=self.target, vnum__range=(min(vnums), max(vnums)))
+                                  .values_list('vnum', flat=True))
+        if used:
+            raise CloneError('%s vnum %d is already used in area %d' % (model._meta.verbose_name, min(used), self.target.vnum))
+
+    def insert_vnums(self, model, rows):
+        """
+        Inserts copies of vnum-numbered ``rows`` and records their new pks.
+        """
+        bulk_insert(model, [copy(model, row, area_id=self.target.pk, vnum=row['vnum'] + self.offset) for row in rows])
+        pks = {}
+        if rows:
+            vnums = [row['vnum'] + self.offset for row in rows]
+            pks = dict(model._base_manager.filter(area=self.target, vnum__range=(min(vnums), max(vnums)))
+                       .values_list('vnum', 'pk'))
+        self.pks[model] = dict((row['id'], pks[row['vnum'] + self.offset]) for row in rows)
+
+    def copy_m2m(self, model):
+        """
+        Copies the many-to-many rows of ``model``'s copied rows.
+        """
+        for field in model._meta.local_many_to_many:
+            through = field.rel.through
+            owner, related = field.m2m_field_name(), field.m2m_reverse_field_name()
+            pairs = []
+            for chunk in chunked(sorted(self.pks[model]), IN_SIZE):
+                pairs.extend((self.pks[model][old], self.new_pk(field.rel.to, pk)) for old, pk in
+                             through.objects.filter(**{'%s__in' % (owner): chunk}).values_list(owner, related))
+            bulk_insert(through, m2m_rows(field, pairs))
+
+    def copy_items(self, rows):
+        self.pks[Item] = {}
+        if not rows:
+            return
+        vnums = dict((row['id'], row['vnum']) for row in rows)
+        # Every table between Item and each concrete type, parents first.
+        tables = {}
+        for row in rows:
+            for model in item_tables(ITEM_CLASSES[row['item_type']]):
+                tables.setdefault(model, []).append(row['id'])
+        tables = sorted(tables.items(), key=lambda (model, pks): len(item_tables(model)))
+        table_rows = [(model, read(model, 'pk', pks)) for model, pks in tables]
+        # A container's values line holds its key's vnum.
+        by_pk = dict((row['id'], row) for row in rows)
+        for model, children in table_rows:
+            if model is not Container:
+                continue
+            for child in children:
+                if child['key_id'] in vnums:
+                    item = by_pk[child['item_ptr_id']]
+                    values = item['type_values'].split(' ')
+                    values[2] = unicode(vnums[child['key_id']] + self.offset)
+                    item['type_values'] = u' '.join(values)
+
+        self.insert_vnums(Item, rows)
+        for model, children in table_rows:
+            self.pks[model] = self.pks[Item]
+            # The parent link and any other references to items.
+            related = [field for field in model._meta.local_fields if field.rel and issubclass(field.rel.to, Item)]
+            bulk_insert(model, [
+                copy(model, row, **dict((field.attname, self.new_pk(Item, row[field.attname])) for field in related))
+                for row in children])
+            self.copy_m2m(model)
+        bulk_insert(ExtraDescription, [copy(ExtraDescription, row, item_id=self.pks[Item][row['item_id']])
+                                       for row in read(ExtraDescription, 'item', self.pks[Item])])
+
+    def copy_mobiles(self, rows):
+        self.insert_vnums(Mobile, rows)
+        self.copy_m2m(Mobile)
+        shops = read(Shopkeeper, 'mobile', self.pks[Mobile])
+        bulk_insert(Shopkeeper, [copy(Shopkeeper, row, mobile_id=self.pks[Mobile][row['mobile_id']]) for row in shops])
+        new = {}
+        for chunk in chunked(sorted(self.pks[Mobile].values()), IN_SIZE):
+            new.update(Shopkeeper.objects.filter(mobile__in=chunk).values_list('mobile', 'pk'))
+        self.pks[Shopkeeper] = dict((row['id'], new[self.pks[Mobile][row['mobile_id']]]) for row in shops)
+        self.copy_m2m(Shopkeeper)
+
+    def copy_rooms(self, rows):
+        self.insert_vnums(Room, rows)
+        self.copy_m2m(Room)
+        doors = read(Door, 'room', self.pks[Room])
+        bulk_insert(Door, [copy(Door, row, room_id=self.pks[Room][row['room_id']],
+                                room_to_id=self.new_pk(Room, row['room_to_id']))
+                           for row in doors])
+        new = {}
+        for chunk in chunked(sorted(self.pks[Room].values()), IN_SIZE):
+            new.update(((room, direction), pk) for room, direction, pk in
+                       Door.objects.filter(room__in=chunk).values_list('room', 'direction', 'pk'))
+        self.pks[Door] = dict((row['id'], new[self.pks[Room][row['room_id']], row['direction']]) for row in doors)
+        bulk_insert(DoorTrigger, [copy(DoorTrigger, row, door_id=self.pks[Door][row['door_id']])
+                                  for row in read(DoorTrigger, 'door', self.pks[Door])])
+
+    def copy_resets(self):
+        """
+        Copies the resets of copied mobs, rooms and containers.
+        """
+        for model, owner, other, other_model in (
+                (MobRoomReset, 'room', 'mobile', Mobile),
+                (MobItemReset, 'mobile', 'item', Item),
+                (ItemRoomReset, 'room', 'item', Item),
+                (ItemContainerReset, 'container', 'item', Item)):
+            owner_field = model._meta.get_field(owner)
+            owner_model = owner_field.rel.to
+            owners = self.pks.get(owner_model, {})
+            rows = read(model, owner, owners)
+            if model is MobRoomReset:
+                # Only mobs that were copied along with the room.
+                rows = [row for row in rows if row['mobile_id'] in self.pks[Mobile]]
+            bulk_insert(model, [copy(model, row, **{
+                owner_field.attname: owners[row[owner_field.attname]],
+                '%s_id' % (other): self.new_pk(other_model, row['%s_id' % (other)]),
+                }) for row in rows])
+
+
+@commit_on_success
+def clone_area(area, vnum, name, author):
+    """
+    Copies ``area`` and everything in it to a new area numbered ``vnum``.
+    """
+    clone = Area.objects.create(author=author, vnum=vnum, name=name, forum=area.forum,
+                                level_low=area.level_low, level_high=area.level_high,
+                                flags_vector=area.flags_vector, notes=area.notes)
+    # Without m2m signals, like the rest of the copy; the copier touches the area.
+    flags = Area._meta.get_field('flags')
+    bulk_insert(flags.rel.through, m2m_rows(flags, [(clone.pk, pk) for pk in area.flags.values_list('pk', flat=True)]))
+    for help in AreaHelp.objects.filter(area=area):
+        help.pk = None
+        help.area = clone
+        help.save()
+    copier = AreaCopier(area, clone, vnum - area.vnum)
+    copier.copy(Room.objects.filter(area=area).values_list('pk', flat=True),
+                Mobile.objects.filter(area=area).values_list('pk', flat=True),
+                Item.objects.filter(area=area).values_list('pk', flat=True))
+    return clone
+
+
+@commit_on_success
+def copy_rooms(rooms, target, offset):
+    """
+    Copies ``rooms`` (a queryset of one area's rooms) into ``target``,
+    along with their doors, the mobs and items reset into them, and those
+    mobs' and items' own resets.
+    """
+    areas = list(rooms.values_list('area', flat=True).distinct())
+    if len(areas) != 1:
+        raise CloneError('rooms must all come from one area')
+    copier = AreaCopier(Area.objects.get(pk=areas[0]), target, offset)
+    rooms = list(rooms.values_list('pk', flat=True))
+    mobiles, items = copier.cluster(rooms)
+    copier.copy(rooms, mobiles, items)
+    return copier
@@ -0,0 +1,78 @@
+"""
+Work put off until the current transaction commits.
+
+Django 1.4 has no hook for the end of a transaction, so on_commit() keeps
+callbacks for each thread while a transaction is managed, and whatever
+ends the transaction runs or drops them: commit_on_success() below, and
+CommitMiddleware for transactions opened by the admin's views. Outside a
+managed transaction each save has already committed, so the callback is
+run at once, after any left over from transactions that committed without
+running theirs.
+"""
+import threading
+from functools import wraps
+
+from django.db import transaction
+
+
+_local = threading.local()
+
+
+def callbacks():
+    if not hasattr(_local, 'callbacks'):
+        _local.callbacks = []
+    return _local.callbacks
+
+
+def on_commit(function):
+    """
+    Calls ``function()`` once the current transaction has committed, or
+    never if it's rolled back.
+    """
+    callbacks().append(function)
+    if not transaction.is_managed():
+        run_callbacks()
+
+
+def run_callbacks():
+    pending, _local.callbacks = callbacks(), []
+    for function in pending:
+        function()
+
+
+def drop_callbacks():
+    _local.callbacks = []
+
+
+def commit_on_success(function):
+    """
+    Like transaction.commit_on_success, also running the callbacks of the
+    transaction once it commits, or dropping them if it's rolled back.
+    """
+    function = transaction.commit_on_success(function)
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        try:
+            result = function(*args, **kwargs)
+        except Exception:
+            drop_callbacks()
+            raise
+        if not transaction.is_managed():
+            run_callbacks()
+        return result
+    return wrapper
+
+
+class CommitMiddleware(object):
+    """
+    Runs the callbacks of transactions a view committed itself, and drops
+    them if it raised.
+    """
+    def process_response(self, request, response):
+        if not transaction.is_managed():
+            run_callbacks()
+        return response
+
+    def process_exception(self, request, exception):
+        drop_callbacks()
@@ -0,0 +1,193 @@
+"""
+Differences between two versions of an area.
+
+A Snapshot splits an area, as read from its .are text by AreaReader, into
+objects: the area header, its help, each room, door, mob, item and shop,
+and each reset (with the items a mob is given folded into its M reset).
+Every object gets a hash of its content, so two snapshots are compared by
+their {key: hash} maps alone and only objects whose hashes differ are
+compared field by field. A snapshot can be taken of an area in the
+database (through the export cache, so unchanged rows aren't rendered
+again) or of any .are file, such as the last version pushed to the game.
+"""
+import difflib
+import hashlib
+import json
+
+from core.export_cache import CachedAreaExporter
+from core.importer import AreaReader
+from core.lists import DIRECTION_CHOICES
+
+
+DIRECTIONS = dict((unicode(n), label) for n, label in DIRECTION_CHOICES)
+
+# Kinds of object in the order they're listed in a diff.
+KINDS = ('area', 'help', 'room', 'door', 'mobile', 'item', 'reset', 'shop')
+
+
+def canonical(content):
+    """
+    A string for ``content`` that doesn't depend on dict order. Text must
+    be unicode throughout, as AreaReader gives it for decoded lines.
+    """
+    if isinstance(content, dict):
+        return repr(sorted((key, canonical(value)) for key, value in content.iteritems()))
+    return repr(content)
+
+
+def content_hash(content):
+    # repr() is several times quicker than json.dumps(sort_keys=True).
+    return hashlib.sha1(canonical(content)).hexdigest()
+
+
+def key_label(key):
+    """
+    How an object is named in a diff: "room 1001", "door 1001 east",
+    "reset M 1000 1002" and so on.
+    """
+    if key[0] == 'door':
+        return u'door %d %s' % (key[1], DIRECTIONS.get(key[2], key[2]).lower())
+    return u' '.join(unicode(part) for part in key)
+
+
+def area_objects(record):
+    """
+    Yields (key, content) for each object in an AreaReader record. Special
+    functions, triggers and door resets are folded into the mob, room or
+    door they belong to.
+    """
+    specials, rspecs, triggers, door_resets = {}, {}, {}, {}
+    for vnum, function in record.get('specials', []):
+        specials.setdefault(vnum, []).append(function)
+    for vnum, function in record.get('rspecs', []):
+        rspecs.setdefault(vnum, []).append(function)
+    for trigger_type, vnum, direction, function in record.get('triggers', []):
+        triggers.setdefault((vnum, direction), []).append([trigger_type, function])
+
+    yield ('area',), dict((field, record[field]) for field in
+                          ('name', 'author', 'vnum', 'level_low', 'level_high', 'flags'))
+    if record.get('helps'):
+        yield ('help',), record['helps']
+
+    # Resets, keyed by what they put where. The same reset may appear more
+    # than once, so repeats are numbered.
+    resets = []
+    for reset in record.get('resets', []):
+        command = reset[0]
+        if command in (u'G', u'E'):
+            if resets and resets[-1][0][1] == u'M':
+                resets[-1][1].append(reset)
+        elif command == u'D':
+            door_resets[(reset[2], reset[3])] = reset
+        else:
+            resets.append((('reset', command, reset[2], reset[4]), [reset]))
+    seen = {}
+    for key, content in resets:
+        seen[key] = seen.get(key, 0) + 1
+        yield key + ((seen[key],) if seen[key] > 1 else ()), content
+
+    for room in record.get('rooms', []):
+        vnum = room['vnum']
+        yield ('room', vnum), {'rspecs': sorted(rspecs.get(vnum, []))}
+        for door in room['doors']:
+            direction = door['direction']
+            yield ('door', vnum, direction), dict(door, triggers=triggers.get((vnum, direction), []),
+                                                  reset=door_resets.get((vnum, direction)))
+    for mob in record.get('mobiles', []):
+        yield ('mobile', mob['vnum']), dict(mob, specials=sorted(specials.get(mob['vnum'], [])))
+    for item in record.get('objects', []):
+        yield ('item', item['vnum']), item
+    for shop in record.get('shops', []):
+        yield ('shop', shop[0]), shop
+
+
+class Snapshot(object):
+    """
+    The objects of one version of an area, by key, with their hashes.
+    """
+    def __init__(self, record):
+        self.contents = {}
+        self.hashes = {}
+        for key, content in area_objects(record):
+            self.contents[key] = content
+            self.hashes[key] = content_hash(content)
+
+    @classmethod
+    def from_lines(cls, lines, name='<area>'):
+        """
+        A snapshot of the .are text in ``lines``.
+        """
+        return cls(AreaReader(lines, name).read())
+
+    @classmethod
+    def from_area(cls, area):
+        """
+        A snapshot of an area as it is in the database.
+        """
+        return cls.from_lines(u''.join(CachedAreaExporter(area)).splitlines(True), area.name)
+
+
+def field_changes(old, new):
+    """
+    {field: (old value, new value)} for the fields that differ between two
+    versions of an object. Objects that aren't dicts count as one field.
+    """
+    if not isinstance(old, dict) or not isinstance(new, dict):
+        return {'': (old, new)}
+    return dict((field, (old.get(field), new.get(field)))
+                for field in set(old) | set(new) if old.get(field) != new.get(field))
+
+
+def sort_key(key):
+    return (KINDS.index(key[0]),) + key[1:]
+
+
+class AreaDiff(object):
+    """
+    What was added, removed and changed between two snapshots. ``changed``
+    holds (key, {field: (old value, new value)}) in list order.
+    """
+    def __init__(self, old, new):
+        self.added = sorted(set(new.hashes) - set(old.hashes), key=sort_key)
+        self.removed = sorted(set(old.hashes) - set(new.hashes), key=sort_key)
+        self.changed = [(key, field_changes(old.contents[key], new.contents[key]))
+                        for key in sorted(set(old.hashes) & set(new.hashes), key=sort_key)
+                        if old.hashes[key] != new.hashes[key]]
+        self.new = new
+
+    def __nonzero__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    def as_dict(self):
+        """
+        The diff as JSON-ready data.
+        """
+        return {
+            'added': [{'object': key_label(key), 'content': self.new.contents[key]} for key in self.added],
+            'removed': [key_label(key) for key in self.removed],
+            'changed': [{'object': key_label(key),
+                         'fields': dict((field, {'old': old, 'new': new}) for field, (old, new) in changes.items())}
+                        for key, changes in self.changed],
+            }
+
+    def lines(self):
+        """
+        Yields the diff as text, a line at a time: one line for each object
+        added or removed, and for each changed object its changed fields.
+        Text fields of more than one line are shown as a line diff.
+        """
+        for key in self.added:
+            yield u'+ %s\n' % (key_label(key))
+        for key in self.removed:
+            yield u'- %s\n' % (key_label(key))
+        for key, changes in self.changed:
+            yield u'~ %s\n' % (key_label(key))
+            for field in sorted(changes):
+                old, new = changes[field]
+                if isinstance(old, basestring) and isinstance(new, basestring) and (u'\n' in old or u'\n' in new):
+                    yield u'    %s:\n' % (field)
+                    for line in difflib.ndiff(old.splitlines(), new.splitlines()):
+                        if not line.startswith(u'?'):
+                            yield u'      %s\n' % (line)
+                else:
+                    yield u'    %s: %s -> %s\n' % (field or u'value', json.dumps(old), json.dumps(new))
@@ -0,0 +1,288 @@
+"""
+Whole-area export to the TFC .are format.
+
+AreaExporter walks every row belonging to an Area with a fixed number of
+bulk queries (independent of how many rooms, mobs or items the area has)
+and yields the file as a series of text chunks, so neither the caller nor
+the exporter ever has to hold the whole file in memory.
+"""
+from itertools import groupby
+
+from core.models import (
+    AreaHelp,
+    DoorType,
+    Door,
+    DoorTrigger,
+    ExtraDescription,
+    Item,
+    ItemContainerReset,
+    ItemRoomReset,
+    MobItemReset,
+    MobRoomReset,
+    Mobile,
+    PreferredLanguage,
+    Race,
+    ResetWearFlag,
+    Room,
+    RoomSpecialFunction,
+    Shopkeeper,
+    SpecialFunction,
+    Spell,
+    WearFlag,
+    flag_vector,
+    )
+from core.registry import registry
+
+
+def tilde(text):
+    """
+    Terminates a string field. Tildes are the field separator in area files,
+    so any inside the text itself are dropped.
+    """
+    return u'%s~\n' % (text or u'').replace(u'~', u'')
+
+
+def attach(rows, related, key):
+    """
+    Pairs each row with the list of related rows that belong to it.
+
+    Both iterables must be ordered the same way, and ``key(related_row)``
+    must equal the pk of the row it belongs to. Neither side is loaded into
+    memory as a whole.
+    """
+    groups = groupby(related, key)
+    group_key, group = next(groups, (None, iter(())))
+    for row in rows:
+        if group_key == row.pk:
+            yield row, list(group)
+            group_key, group = next(groups, (None, iter(())))
+        else:
+            yield row, []
+
+
+class AreaExporter(object):
+    """
+    Iterating over an AreaExporter yields the complete .are file for an area.
+    """
+    # Blocks in file order, by name.
+    BLOCKS = (
+        'area',
+        'help',
+        'mobile',
+        'object',
+        'room',
+        'reset',
+        'shop',
+        'special',
+        'room_special',
+        'trigger',
+        )
+
+    def __init__(self, area):
+        self.area = area
+        self.registry = registry()
+
+    def TFC_id(self, model, pk):
+        """
+        The TFC_id of a lookup row, from the registry rather than a join.
+        """
+        return self.registry[model].get(pk).TFC_id
+
+    def __iter__(self):
+        for name in self.BLOCKS:
+            for chunk in getattr(self, '%s_block' % (name))():
+                yield chunk
+        yield u'#$\n'
+
+    def area_block(self):
+        area = self.area
+        yield u'#AREA\n'
+        yield tilde(area.name)
+        yield tilde(area.author.username)
+        yield u'%d %d %d %d\n\n' % (area.level_low, area.level_high, area.vnum, area.flags_vector)
+
+    def help_block(self):
+        yield u'#HELPS\n'
+        for help in AreaHelp.objects.filter(area=self.area):
+            text = help.text
+            if help.blank_line:
+                text = u'.\n' + text
+            yield u'%d %s' % (help.level, tilde(help.keywords))
+            yield tilde(text)
+        yield u'0 $~\n\n'
+
+    # Mobiles, objects and rooms are rendered one fragment per row, so that
+    # subclasses can render (or reuse) them individually.
+    def mobile_block(self):
+        yield u'#MOBILES\n'
+        for pk, fragment in self.mobiles():
+            yield fragment
+        yield u'#0\n\n'
+
+    def object_block(self):
+        yield u'#OBJECTS\n'
+        for pk, fragment in self.objects():
+            yield fragment
+        yield u'#0\n\n'
+
+    def room_block(self):
+        yield u'#ROOMS\n'
+        for pk, fragment in self.rooms():
+            yield fragment
+        yield u'#0\n\n'
+
+    def mobiles(self, pks=None):
+        """
+        Yields (pk, fragment) for each mob in the area, or just those in pks.
+        """
+        mobiles = Mobile.objects.filter(area=self.area)
+        if pks is not None:
+            mobiles = mobiles.filter(pk__in=pks)
+        mobiles = mobiles.order_by('vnum').prefetch_related('known_languages')
+        for mob in mobiles:
+            yield mob.pk, u''.join([
+                u'#%d\n' % (mob.vnum),
+                tilde(mob.names.lower()),
+                tilde(mob.short_desc.lower()),
+                tilde(mob.long_desc),
+                tilde(mob.look_desc),
+                u'%d %d %d %d %d %d\n' % (mob.level, mob.alignment, mob.sex, mob.is_animal, mob.no_wear, mob.total_in_game),
+                u'%d %d %d\n' % (mob.action_flags_vector, mob.affect_flags_vector,
+                                  self.TFC_id(Spell, mob.spell_id) if mob.spell_id else -1),
+                u'%d %d\n' % (self.TFC_id(PreferredLanguage, mob.preferred_language_id), flag_vector(mob.known_languages.all())),
+                ])
+
+    def objects(self, pks=None):
+        """
+        Yields (pk, fragment) for each item in the area, or just those in pks.
+        """
+        # item_type and type_values are packed onto the Item row, so the
+        # concrete item tables don't need to be touched.
+        items = Item.objects.filter(area=self.area)
+        extras = ExtraDescription.objects.filter(item__area=self.area)
+        if pks is not None:
+            items = items.filter(pk__in=pks)
+            extras = extras.filter(item__in=pks)
+        items = items.order_by('vnum').iterator()
+        extras = extras.order_by('item__vnum', 'TFC_id').iterator()
+        for item, extras in attach(items, extras, lambda extra: extra.item_id):
+            lines = [
+                u'#%d\n' % (item.vnum),
+                tilde(item.names.lower()),
+                tilde(item.short_desc.lower()),
+                tilde(item.long_desc),
+                u'%d %d %d %d %d %d %d\n' % (item.item_type, self.TFC_id(WearFlag, item.wear_flags_id), item.takeable, item.flammable,
+                                             item.metallic, item.two_handed, item.underwater_breath),
+                u'%s\n' % (item.type_values),
+                u'%d %d %d\n' % (item.weight, item.cost, item.total_in_game),
+                ]
+            for extra in extras:
+                lines.extend([u'E\n', tilde(extra.keywords), tilde(extra.description)])
+            yield item.pk, u''.join(lines)
+
+    def rooms(self, pks=None):
+        """
+        Yields (pk, fragment) for each room in the area, or just those in pks.
+        A room's fragment includes its exits.
+        """
+        rooms = Room.objects.filter(area=self.area)
+        doors = Door.objects.filter(room__area=self.area)
+        if pks is not None:
+            rooms = rooms.filter(pk__in=pks)
+            doors = doors.filter(room__in=pks)
+        rooms = rooms.order_by('vnum').iterator()
+        doors = doors.order_by('room__vnum', 'direction').select_related('room_to').iterator()
+        for room, exits in attach(rooms, doors, lambda door: door.room_id):
+            lines = [u'#%d\n' % (room.vnum)]
+            for door in exits:
+                lines.extend([
+                    u'D%s\n' % (door.direction),
+                    tilde(door.description),
+                    tilde(door.name),
+                    tilde(door.keywords),
+                    u'%d %d\n' % (self.TFC_id(DoorType, door.door_type_id), door.room_to.vnum if door.room_to_id else -1),
+                    ])
+            lines.append(u'S\n')
+            yield room.pk, u''.join(lines)
+
+    # The remaining blocks are one short line per row.
+    def reset_block(self):
+        area = self.area
+        # Items handed to a mob are listed after every M reset of that mob,
+        # so they are the only reset rows gathered up front.
+        gives = {}
+        mob_items = (MobItemReset.objects.filter(mobile__area=area)
+                     .order_by('item__vnum')
+                     .values_list('mobile', 'reset_every_cycle', 'item__vnum', 'item__total_in_game', 'wear_location'))
+        for mobile, every_cycle, vnum, limit, wear in mob_items:
+            if wear is None:
+                line = u'G %d %d %d\n' % (every_cycle, vnum, limit)
+            else:
+                line = u'E %d %d %d %d\n' % (every_cycle, vnum, limit, self.TFC_id(ResetWearFlag, wear))
+            gives.setdefault(mobile, []).append(line)
+        stock = (Shopkeeper.reset_items.through.objects.filter(shopkeeper__mobile__area=area)
+                 .order_by('item__vnum')
+                 .values_list('shopkeeper__mobile', 'item__vnum', 'item__total_in_game'))
+        for mobile, vnum, limit in stock:
+            gives.setdefault(mobile, []).append(u'G 0 %d %d\n' % (vnum, limit))
+
+        yield u'#RESETS\n'
+        mob_resets = (MobRoomReset.objects.filter(mobile__area=area)
+                      .order_by('room__vnum', 'mobile__vnum')
+                      .values_list('mobile', 'reset_every_cycle', 'mobile__vnum', 'mobile__total_in_game', 'room__vnum'))
+        for mobile, every_cycle, vnum, limit, room in mob_resets.iterator():
+            yield u'M %d %d %d %d\n' % (every_cycle, vnum, limit, room) + u''.join(gives.get(mobile, []))
+        room_items = (ItemRoomReset.objects.filter(room__area=area)
+                      .order_by('room__vnum', 'item__vnum')
+                      .values_list('reset_every_cycle', 'item__vnum', 'item__total_in_game', 'room__vnum'))
+        for reset in room_items.iterator():
+            yield u'O %d %d %d %d\n' % reset
+        contents = (ItemContainerReset.objects.filter(container__area=area)
+                    .order_by('container__vnum', 'item__vnum')
+                    .values_list('reset_every_cycle', 'item__vnum', 'item__total_in_game', 'container__vnum'))
+        for reset in contents.iterator():
+            yield u'P %d %d %d %d\n' % reset
+        doors = (Door.objects.filter(room__area=area, reset=True)
+                 .order_by('room__vnum', 'direction')
+                 .values_list('reset_every_cycle', 'room__vnum', 'direction', 'reset_value'))
+        for every_cycle, room, direction, state in doors.iterator():
+            yield u'D %d %d %s %d\n' % (every_cycle, room, direction, state or 0)
+        yield u'S\n\n'
+
+    def shop_block(self):
+        shops = (Shopkeeper.objects.filter(mobile__area=self.area)
+                 .order_by('mobile__vnum')
+                 .values_list('mobile__vnum', 'will_buy', 'race', 'opens', 'closes'))
+        yield u'#SHOPS\n'
+        for vnum, will_buy, race, opens, closes in shops.iterator():
+            buy_types = [int(item_type) for item_type in will_buy.split(',') if item_type.strip()][:5]
+            buy_types += [0] * (5 - len(buy_types))
+            yield u'%d %s %d %d %d\n' % (vnum, u' '.join([unicode(t) for t in buy_types]), self.TFC_id(Race, race), opens, closes)
+        yield u'0\n\n'
+
+    def special_block(self):
+        specials = (Mobile.special_functions.through.objects.filter(mobile__area=self.area)
+                    .order_by('mobile__vnum', 'specialfunction')
+                    .values_list('mobile__vnum', 'specialfunction'))
+        yield u'#SPECIALS\n'
+        for vnum, function in specials.iterator():
+            yield u'M %d %s\n' % (vnum, self.TFC_id(SpecialFunction, function))
+        yield u'S\n\n'
+
+    def room_special_block(self):
+        specials = (Room.special_functions.through.objects.filter(room__area=self.area)
+                    .order_by('room__vnum', 'roomspecialfunction')
+                    .values_list('room__vnum', 'roomspecialfunction'))
+        yield u'#RSPECS\n'
+        for vnum, function in specials.iterator():
+            yield u'R %d %s\n' % (vnum, self.TFC_id(RoomSpecialFunction, function))
+        yield u'S\n\n'
+
+    def trigger_block(self):
+        triggers = (DoorTrigger.objects.filter(door__room__area=self.area)
+                    .order_by('door__room__vnum', 'door__direction', 'pk')
+                    .values_list('trigger_type', 'door__room__vnum', 'door__direction', 'TFC_id'))
+        yield u'#TRIGGERS\n'
+        for trigger in triggers.iterator():
+            yield u'%s %d %s %s\n' % trigger
+        yield u'S\n\n'
@@ -0,0 +1,200 @@
+"""
+Incremental area export.
+
+CachedAreaExporter keeps every block of an area's export in Django's cache,
+and every mob, object and room fragment within those blocks. The signal
+handlers below drop a fragment whenever its row (or anything printed in it)
+changes, along with the cached blocks it appears in, so re-exporting an area
+only re-renders what was edited since the last export.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from core.bulk import IN_SIZE, chunked
+from core.export import AreaExporter
+from core.models import (
+    Area,
+    AreaHelp,
+    Door,
+    DoorTrigger,
+    ExtraDescription,
+    Item,
+    ItemContainerReset,
+    ItemRoomReset,
+    MobItemReset,
+    MobRoomReset,
+    Mobile,
+    Room,
+    Shopkeeper,
+    )
+from core.registry import current_version
+
+
+EXPORT_CACHE_TIMEOUT = getattr(settings, 'EXPORT_CACHE_TIMEOUT', 60 * 60 * 24)
+
+# Above this many dirty fragments a block is simply re-rendered in full,
+# which also keeps pk__in lists inside SQLite's parameter limit.
+DIRTY_LIMIT = 500
+
+
+# Keys carry the registry version, since exports print lookup rows' TFC_ids.
+def fragment_key(version, kind, pk):
+    return 'export:%s:%s:%d' % (version, kind, pk)
+
+
+def block_key(version, area_pk, name):
+    return 'export:%s:%d:%s' % (version, area_pk, name)
+
+
+class CachedAreaExporter(AreaExporter):
+    """
+    An AreaExporter that reuses cached blocks and fragments.
+    """
+    def __iter__(self):
+        for name in self.BLOCKS:
+            key = block_key(self.registry.version, self.area.pk, name)
+            text = cache.get(key)
+            if text is None:
+                text = u''.join(getattr(self, '%s_block' % (name))())
+                cache.set(key, text, EXPORT_CACHE_TIMEOUT)
+            yield text
+        yield u'#$\n'
+
+    def mobiles(self, pks=None):
+        return self.cached_fragments('mobile', Mobile, super(CachedAreaExporter, self).mobiles)
+
+    def objects(self, pks=None):
+        return self.cached_fragments('item', Item, super(CachedAreaExporter, self).objects)
+
+    def rooms(self, pks=None):
+        return self.cached_fragments('room', Room, super(CachedAreaExporter, self).rooms)
+
+    def cached_fragments(self, kind, model, render):
+        """
+        Yields (pk, fragment) for every row of ``model`` in the area, taking
+        fragments from the cache and rendering only the missing ones.
+        """
+        pks = list(model.objects.filter(area=self.area).order_by('vnum').values_list('pk', flat=True))
+        keys = dict((pk, fragment_key(self.registry.version, kind, pk)) for pk in pks)
+        fragments = cache.get_many(keys.values())
+        dirty = [pk for pk in pks if keys[pk] not in fragments]
+        if dirty:
+            rendered = dict(render(None if len(dirty) > DIRTY_LIMIT else dirty))
+            cache.set_many(dict((keys[pk], rendered[pk]) for pk in dirty), EXPORT_CACHE_TIMEOUT)
+            fragments.update((keys[pk], rendered[pk]) for pk in dirty)
+        for pk in pks:
+            yield pk, fragments[keys[pk]]
+
+
+### Invalidation ###
+def area_of(model, pk, path):
+    """
+    Looks up the area pk of a related row, or None if it's gone.
+    """
+    areas = model.objects.filter(pk=pk).values_list(path, flat=True)
+    return areas[0] if areas else None
+
+
+def area_blocks(area_pk, *names):
+    # area_of() finds no area for a row whose parent is gone.
+    return [(area_pk, name) for name in names] if area_pk is not None else []
+
+
+def stale_exports(instance):
+    """
+    Returns (blocks, fragments) for the parts of exports that show
+    ``instance``. Blocks are (area pk, name) pairs and fragments are
+    (kind, pk) pairs.
+    """
+    if isinstance(instance, Area):
+        return area_blocks(instance.pk, 'area'), []
+    if isinstance(instance, AreaHelp):
+        return area_blocks(instance.area_id, 'help'), []
+    if isinstance(instance, Mobile):
+        return area_blocks(instance.area_id, 'mobile', 'reset', 'shop', 'special'), [('mobile', instance.pk)]
+    if isinstance(instance, Item):
+        return area_blocks(instance.area_id, 'object', 'reset'), [('item', instance.pk)]
+    if isinstance(instance, ExtraDescription):
+        return area_blocks(area_of(Item, instance.item_id, 'area'), 'object'), [('item', instance.item_id)]
+    if isinstance(instance, Room):
+        # Exits into this room print its vnum, in other areas' exports too.
+        entrances = list(Door.objects.filter(room_to=instance.pk).values_list('room', 'room__area'))
+        blocks = area_blocks(instance.area_id, 'room', 'reset', 'room_special', 'trigger')
+        for room, area_pk in entrances:
+            blocks.extend(area_blocks(area_pk, 'room'))
+        return blocks, [('room', pk) for pk in [instance.pk] + [room for room, area_pk in entrances]]
+    if isinstance(instance, Door):
+        return (area_blocks(area_of(Room, instance.room_id, 'area'), 'room', 'reset', 'trigger'),
+                [('room', instance.room_id)])
+    if isinstance(instance, DoorTrigger):
+        return area_blocks(area_of(Door, instance.door_id, 'room__area'), 'trigger'), []
+    if isinstance(instance, Shopkeeper):
+        return area_blocks(area_of(Mobile, instance.mobile_id, 'area'), 'reset', 'shop'), []
+    if isinstance(instance, (MobRoomReset, MobItemReset)):
+        return area_blocks(area_of(Mobile, instance.mobile_id, 'area'), 'reset'), []
+    if isinstance(instance, ItemRoomReset):
+        return area_blocks(area_of(Room, instance.room_id, 'area'), 'reset'), []
+    if isinstance(instance, ItemContainerReset):
+        return area_blocks(area_of(Item, instance.container_id, 'area'), 'reset'), []
+    return [], []
+
+
+def invalidate_area(area_pk):
+    """
+    Drops every cached block of an area's export, for changes made without
+    signals (such as bulk inserts). Fragments are kept, being per row.
+    """
+    version = current_version()
+    cache.delete_many([block_key(version, area_pk, name) for name in CachedAreaExporter.BLOCKS])
+
+
+def invalidate_rows(kind, pks):
+    """
+    Drops the cached fragments of rows deleted without signals.
+    """
+    version = current_version()
+    cache.delete_many([fragment_key(version, kind, pk) for pk in pks])
+
+
+def invalidate_export(instance):
+    blocks, fragments = stale_exports(instance)
+    if not blocks and not fragments:
+        return
+    version = current_version()
+    keys = [fragment_key(version, kind, pk) for kind, pk in fragments]
+    keys.extend(block_key(version, area_pk, name) for area_pk, name in blocks)
+    cache.delete_many(keys)
+
+
+def invalidate_saved(sender, instance, **kwargs):
+    invalidate_export(instance)
+
+
+def invalidate_updated(sender, pks, **kwargs):
+    # Rows rewritten with update(), such as the containers a renumbered key
+    # opens, which print its vnum.
+    for chunk in chunked(list(pks), IN_SIZE):
+        for instance in sender._base_manager.filter(pk__in=chunk):
+            invalidate_export(instance)
+
+
+def invalidate_left(sender, instance, area_pk, deleted, **kwargs):
+    # core.api notes a row moved to another area as deleted from the one it
+    # left, whose blocks still show it.
+    if not deleted:
+        return
+    blocks, fragments = stale_exports(instance)
+    if blocks and area_pk not in [pk for pk, name in blocks]:
+        version = current_version()
+        cache.delete_many([block_key(version, area_pk, name) for name in set(name for pk, name in blocks)])
+
+
+def invalidate_m2m(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        invalidate_export(instance)
+    elif pk_set:
+        # A flag, spell or function was added to or removed from these rows.
+        for owner in model.objects.filter(pk__in=pk_set):
+            invalidate_export(owner)
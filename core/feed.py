@@ -0,0 +1,248 @@
+"""
+A live feed of changes to an area, for builders editing it together.
+
+Each change the API logs (see core.signals.change_noted) becomes a small
+event: the row's kind, model and pk, the fields that changed (none for a
+row just created) and its row_version, or that it was deleted, and the
+area's new version token, which is also the event's id. Changes that
+weren't logged (see core.api.touch_area) become "resync" events. Events go
+to a backend, which holds each area's recent events and hands them to the
+clients waiting on it, once the transaction that made the change commits
+(see core.commits): a change rolled back gives its revision number back,
+for the next change to use.
+
+The default LocalBackend keeps events in this process's memory, and its
+waiting clients block on a condition without polling, woken by a new event
+or by a ticker thread every FEED_TICK seconds, so idle clients cost next to
+nothing. CacheBackend keeps them in Django's cache instead, for
+deployments with more than one process; any class with publish() and
+events() can be named in the CHANGE_FEED_BACKEND setting.
+
+The feed view serves events as server-sent events. Each response waits up
+to FEED_TIMEOUT seconds for changes and then ends, and the browser's
+EventSource reconnects with the last event's id. A client whose id is too
+old for the backend to fill in, or who would miss an event that was never
+published, is sent a "resync" event, and should fetch the changes since
+its version from the API.
+"""
+import json
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.importlib import import_module
+
+from core.api import RESOURCES, parse_token, version_token
+from core.commits import on_commit
+from core.models import ITEM_CLASSES
+
+
+FEED_TIMEOUT = getattr(settings, 'CHANGE_FEED_TIMEOUT', 30)
+FEED_TICK = 5
+
+# Events kept for each area, for clients catching up after reconnecting.
+FEED_HISTORY = getattr(settings, 'CHANGE_FEED_HISTORY', 500)
+
+
+class FeedBackend(object):
+    """
+    Holds events for areas. Event ids are an area's revision numbers, and
+    the events of an area are published in order.
+    """
+    def publish(self, area_pk, number, event):
+        raise NotImplementedError
+
+    def events(self, area_pk, after, timeout):
+        """
+        Returns the events of the area numbered after ``after``, waiting up
+        to ``timeout`` seconds for one if there are none yet.
+        """
+        raise NotImplementedError
+
+
+class LocalBackend(FeedBackend):
+    """
+    Events kept in this process's memory.
+    """
+    def __init__(self, history=FEED_HISTORY, tick=FEED_TICK):
+        self.history = history
+        self.tick = tick
+        self.areas = {}
+        self.lock = threading.Lock()
+        self.ticker = None
+
+    def area(self, area_pk):
+        with self.lock:
+            if area_pk not in self.areas:
+                self.areas[area_pk] = (threading.Condition(), deque(maxlen=self.history))
+            if self.ticker is None:
+                self.ticker = threading.Thread(target=self.run_ticker)
+                self.ticker.daemon = True
+                self.ticker.start()
+            return self.areas[area_pk]
+
+    def run_ticker(self):
+        # Wakes waiting clients so they notice their time is up. A wait()
+        # with a timeout would poll instead.
+        while True:
+            time.sleep(self.tick)
+            with self.lock:
+                conditions = [condition for condition, events in self.areas.values()]
+            for condition in conditions:
+                with condition:
+                    condition.notify_all()
+
+    def publish(self, area_pk, number, event):
+        condition, events = self.area(area_pk)
+        with condition:
+            events.append((number, event))
+            condition.notify_all()
+
+    def events(self, area_pk, after, timeout):
+        condition, events = self.area(area_pk)
+        deadline = time.time() + timeout
+        with condition:
+            while True:
+                # Transactions may commit, and publish, out of order.
+                found = [event for number, event in sorted(events, key=lambda (number, event): number)
+                         if number > after]
+                if found or time.time() >= deadline:
+                    return found
+                condition.wait()
+
+
+class CacheBackend(FeedBackend):
+    """
+    Events kept in Django's cache, one key per event, for processes that
+    share a cache. Waiting clients poll every ``interval`` seconds, and
+    events are kept for ``timeout`` seconds.
+    """
+    def __init__(self, history=FEED_HISTORY, interval=1, timeout=60 * 60):
+        self.history = history
+        self.interval = interval
+        self.timeout = timeout
+
+    def key(self, area_pk, number):
+        return 'feed:%d:%d' % (area_pk, number)
+
+    def publish(self, area_pk, number, event):
+        cache.set(self.key(area_pk, number), event, self.timeout)
+
+    def events(self, area_pk, after, timeout):
+        deadline = time.time() + timeout
+        while True:
+            keys = [self.key(area_pk, number) for number in range(after + 1, after + 1 + self.history)]
+            found = cache.get_many(keys)
+            # Events after a missing one are left for the next call.
+            events = []
+            for key in keys:
+                if key not in found:
+                    break
+                events.append(found[key])
+            if events or time.time() >= deadline:
+                return events
+            time.sleep(self.interval)
+
+
+_backend = None
+
+
+def backend():
+    global _backend
+    if _backend is None:
+        path = getattr(settings, 'CHANGE_FEED_BACKEND', 'core.feed.LocalBackend')
+        module, name = path.rsplit('.', 1)
+        _backend = getattr(import_module(module), name)()
+    return _backend
+
+
+### Events ###
+def publish(area_pk, number, event):
+    on_commit(lambda: backend().publish(area_pk, number, event))
+
+
+def remember_fields(sender, instance, **kwargs):
+    # What the row held when loaded, to tell which fields a save changed.
+    # Reading a deferred field would load another instance.
+    if hasattr(sender, '_feed_fields') and not sender._deferred:
+        instance._feed_initial = [getattr(instance, name, None) for name in sender._feed_fields]
+
+
+def changed_fields(instance):
+    initial = getattr(instance, '_feed_initial', None)
+    if initial is None:
+        return None
+    return [name for name, value in zip(instance._feed_fields, initial) if getattr(instance, name, None) != value]
+
+
+def publish_change(sender, instance, resource, area_pk, number, created, deleted, fields, **kwargs):
+    event = {
+        'id': version_token(area_pk, number),
+        'kind': resource.kind,
+        'model': instance._meta.object_name.lower(),
+        'pk': instance.pk,
+        }
+    if deleted:
+        event['deleted'] = True
+    else:
+        if not created:
+            event['fields'] = fields if fields is not None else changed_fields(instance)
+        if hasattr(instance, 'row_version'):
+            event['row_version'] = instance.row_version
+    publish(area_pk, number, event)
+    if not deleted:
+        remember_fields(type(instance), instance)
+
+
+def publish_touch(sender, area_pk, number, **kwargs):
+    publish(area_pk, number, {'id': version_token(area_pk, number), 'resync': True})
+
+for model in [resource.model for resource in RESOURCES] + ITEM_CLASSES.values():
+    # row_version changes with every save, and is sent on its own.
+    model._feed_fields = [field.attname for field in model._meta.fields if field.name != 'row_version']
+
+
+def event_text(event):
+    if event.get('resync'):
+        return 'id: %s\nevent: resync\ndata: %s\n\n' % (event['id'], json.dumps({'id': event['id']}))
+    return 'id: %s\nevent: change\ndata: %s\n\n' % (event['id'], json.dumps(event))
+
+
+def resync_text(area_pk, number):
+    return event_text({'id': version_token(area_pk, number), 'resync': True})
+
+
+def stream(area_pk, after, number, floor, timeout=None):
+    """
+    Yields the feed of an area for one response, as server-sent event
+    text, from revision ``after`` when the area is at revision ``number``.
+    """
+    yield 'retry: 1000\n\n'
+    if after is None:
+        after = number
+    elif after < floor or after > number:
+        after = number
+        yield resync_text(area_pk, after)
+    feed = backend()
+    deadline = time.time() + (FEED_TIMEOUT if timeout is None else timeout)
+    while True:
+        events = feed.events(area_pk, after, 0 if after < number else max(deadline - time.time(), 0))
+        if after < number and not events:
+            # Missed while the client was away, and no longer held.
+            after = number
+            yield resync_text(area_pk, after)
+            continue
+        for event in events:
+            event_number = parse_token(event['id'])[1]
+            if event_number != after + 1:
+                # Missed, or never published.
+                after = max(number, parse_token(events[-1]['id'])[1])
+                yield resync_text(area_pk, after)
+                break
+            yield event_text(event)
+            after = event_number
+        number = max(number, after)
+        if time.time() >= deadline:
+            return
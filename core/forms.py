@@ -0,0 +1,176 @@
+from django import forms
+from django.core.exceptions import ValidationError
+from django.core.urlresolvers import reverse
+from django.core.validators import EMPTY_VALUES
+from django.forms.util import flatatt
+from django.utils.encoding import force_unicode
+from django.utils.safestring import mark_safe
+
+from core.models import Door, Item, Mobile, Room
+from core.registry import registry
+
+
+# How rows of each area-owned model reach their area, and the fields the
+# autocomplete searches by number and by text.
+AREA_PATHS = (
+    (Item, 'area', 'vnum', 'names'),
+    (Mobile, 'area', 'vnum', 'names'),
+    (Room, 'area', 'vnum', None),
+    (Door, 'room__area', 'room__vnum', 'keywords'),
+    )
+
+# Most rows an autocomplete request returns.
+AUTOCOMPLETE_LIMIT = 20
+
+
+class VersionedModelForm(forms.ModelForm):
+    """
+    For models with a row_version (see core.models.VersionedModel), refuses
+    to save over changes made since the form was rendered. The version the
+    form was rendered with comes back in a hidden row_version input, which
+    the admin's change form template adds.
+    """
+    def rendered_version(self):
+        """
+        The version to put in the form's row_version input. A form sent
+        back with errors keeps the version it was submitted with, so after
+        a conflict it's refused again until it's reloaded.
+        """
+        if self.is_bound and self.add_prefix('row_version') in self.data:
+            return self.data[self.add_prefix('row_version')]
+        return getattr(self.instance, 'row_version', None)
+
+    def clean(self):
+        cleaned_data = super(VersionedModelForm, self).clean()
+        version = self.data.get(self.add_prefix('row_version'))
+        if version is not None and self.instance.pk is not None and hasattr(self.instance, 'row_version'):
+            if not version.isdigit() or int(version) != self.instance.row_version:
+                raise ValidationError(u'This %s was changed by someone else after you opened it. '
+                                      u'Open it again to see their changes.' % (self.instance._meta.verbose_name))
+        return cleaned_data
+
+
+class LookupChoiceField(forms.ModelChoiceField):
+    """
+    A ModelChoiceField for a lookup table that takes its choices, and cleans
+    its value, from the registry instead of querying.
+    """
+    def _get_choices(self):
+        choices = [(obj.pk, self.label_from_instance(obj)) for obj in registry()[self.queryset.model]]
+        if self.empty_label is not None:
+            choices.insert(0, (u'', self.empty_label))
+        return choices
+
+    choices = property(_get_choices, forms.ChoiceField._set_choices)
+
+    def to_python(self, value):
+        if value in EMPTY_VALUES:
+            return None
+        try:
+            return registry()[self.queryset.model].get(int(value))
+        except (KeyError, TypeError, ValueError):
+            raise ValidationError(self.error_messages['invalid_choice'])
+
+
+class LookupMultipleChoiceField(forms.ModelMultipleChoiceField):
+    """
+    The many-to-many counterpart of LookupChoiceField.
+    """
+    def _get_choices(self):
+        return [(obj.pk, self.label_from_instance(obj)) for obj in registry()[self.queryset.model]]
+
+    choices = property(_get_choices, forms.ChoiceField._set_choices)
+
+    def clean(self, value):
+        if self.required and not value:
+            raise ValidationError(self.error_messages['required'])
+        if not value:
+            return []
+        if not isinstance(value, (list, tuple)):
+            raise ValidationError(self.error_messages['list'])
+        table = registry()[self.queryset.model]
+        objects = []
+        for pk in value:
+            try:
+                objects.append(table.get(int(pk)))
+            except (KeyError, TypeError, ValueError):
+                raise ValidationError(self.error_messages['invalid_choice'] % (pk))
+        self.run_validators(value)
+        return objects
+
+
+def area_path(model):
+    """
+    Returns (area path, number field, text field) for an area-owned model,
+    or None.
+    """
+    for base, path, number, text in AREA_PATHS:
+        if issubclass(model, base):
+            return path, number, text
+    return None
+
+
+def autocomplete(model, query, area=None):
+    """
+    Returns up to AUTOCOMPLETE_LIMIT rows of ``model`` matching ``query``,
+    in ``area`` if given.
+    """
+    path, number, text = area_path(model)
+    objects = model._default_manager.order_by(number)
+    if '__' in path:
+        # Door labels name their room.
+        objects = objects.select_related(path.split('__')[0])
+    if area is not None:
+        objects = objects.filter(**{path: area})
+    query = query.strip()
+    if query.isdigit():
+        objects = objects.filter(**{number: int(query)})
+    elif query and text:
+        objects = objects.filter(**{'%s__icontains' % (text): query})
+    elif query:
+        return []
+    return objects[:AUTOCOMPLETE_LIMIT]
+
+
+class AutocompleteSelect(forms.Select):
+    """
+    A select box holding only its current value. A search box next to it
+    fills in matching rows from the autocomplete view, limited to ``area``
+    if given, so the page never lists a whole table.
+    """
+    class Media:
+        js = ('core/js/autocomplete.js',)
+
+    def __init__(self, model, area=None, attrs=None):
+        super(AutocompleteSelect, self).__init__(attrs)
+        self.model = model
+        self.area = area
+
+    def url(self):
+        url = reverse('autocomplete', args=[self.model._meta.object_name.lower()])
+        if self.area is not None:
+            url += '?area=%d' % (self.area)
+        return url
+
+    def render(self, name, value, attrs=None, choices=()):
+        if not self.allow_multiple_selected:
+            value = [value]
+        values = [force_unicode(v) for v in value or () if v not in EMPTY_VALUES]
+        final_attrs = self.build_attrs(attrs, name=name)
+        final_attrs['data-autocomplete'] = self.url()
+        if self.allow_multiple_selected:
+            final_attrs['multiple'] = 'multiple'
+        output = [u'<select%s>' % (flatatt(final_attrs))]
+        if not self.allow_multiple_selected:
+            output.append(u'<option value="">---------</option>')
+        if values:
+            for obj in self.model._default_manager.filter(pk__in=values):
+                output.append(self.render_option(set(values), obj.pk, unicode(obj)))
+        output.append(u'</select>')
+        output.append(u'<input type="text" class="autocomplete-search" data-for="%s" placeholder="vnum or name" />'
+                      % (final_attrs.get('id', '')))
+        return mark_safe(u'\n'.join(output))
+
+
+class AutocompleteSelectMultiple(AutocompleteSelect, forms.SelectMultiple):
+    allow_multiple_selected = True
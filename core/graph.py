@@ -0,0 +1,151 @@
+"""
+The room graph formed by Door exits.
+
+RoomGraph loads every room and exit of an area (or of the whole world) with
+one values_list query into flat arrays: each room gets an index, and its six
+exits live in slots index * 6 + direction of a single array. All the
+connectivity checks then run in memory without touching the ORM.
+"""
+from array import array
+from collections import deque
+
+from core.models import Door, Room
+
+
+DIRECTIONS = 6
+
+# Reverse of each direction in DIRECTION_CHOICES: N/S, E/W, Up/Down.
+REVERSE = (2, 3, 0, 1, 5, 4)
+
+# Exit slot values other than a room index.
+NOWHERE = -1
+OUTSIDE = -2
+
+
+class RoomGraph(object):
+    """
+    Rooms and exits, as arrays indexed by room.
+
+    ``pks`` and ``vnums`` give each room index's pk and vnum; ``exits``
+    holds the index of the room each exit leads to, NOWHERE for a slot with
+    no exit (or an exit without a destination), or OUTSIDE for an exit to a
+    room that isn't in the graph.
+    """
+    def __init__(self, rows, entrances=()):
+        """
+        ``rows`` are (room pk, vnum, direction, destination pk), with None
+        for the last two in rooms without exits; ``entrances`` are the pks
+        of rooms entered from outside the graph.
+        """
+        self.pks = array('l')
+        self.vnums = array('l')
+        self.index = {}
+        exits = []
+        for pk, vnum, direction, to in rows:
+            if pk not in self.index:
+                self.index[pk] = len(self.pks)
+                self.pks.append(pk)
+                self.vnums.append(vnum)
+            if direction is not None:
+                exits.append((self.index[pk] * DIRECTIONS + int(direction), to))
+        self.exits = array('l', [NOWHERE]) * (len(self.pks) * DIRECTIONS)
+        for slot, to in exits:
+            self.exits[slot] = NOWHERE if to is None else self.index.get(to, OUTSIDE)
+        self.entrances = sorted(set(self.index[pk] for pk in entrances if pk in self.index))
+
+    @staticmethod
+    def rows(rooms):
+        return rooms.values_list('pk', 'vnum', 'exits__direction', 'exits__room_to')
+
+    @classmethod
+    def for_area(cls, area):
+        rows = cls.rows(Room.objects.filter(area=area).order_by('vnum'))
+        entrances = (Door.objects.filter(room_to__area=area).exclude(room__area=area)
+                     .values_list('room_to', flat=True))
+        return cls(rows, entrances)
+
+    @classmethod
+    def for_world(cls):
+        return cls(cls.rows(Room.objects.order_by('area__vnum', 'vnum')))
+
+    def __len__(self):
+        return len(self.pks)
+
+    def neighbours(self, room):
+        """
+        Yields (direction, room index) for each exit from a room that leads
+        to a room in the graph.
+        """
+        base = room * DIRECTIONS
+        for direction in range(DIRECTIONS):
+            to = self.exits[base + direction]
+            if to >= 0:
+                yield direction, to
+
+    def reachable(self, starts):
+        """
+        Returns a bytearray marking every room reachable from ``starts``.
+        """
+        seen = bytearray(len(self))
+        queue = deque(starts)
+        for start in starts:
+            seen[start] = 1
+        exits = self.exits
+        while queue:
+            base = queue.popleft() * DIRECTIONS
+            for to in exits[base:base + DIRECTIONS]:
+                if to >= 0 and not seen[to]:
+                    seen[to] = 1
+                    queue.append(to)
+        return seen
+
+    ### Checks. These return room pks. ###
+    def unreachable(self, starts=None):
+        """
+        Rooms that can't be reached from ``starts`` (room pks). By default
+        those are the rooms entered from other areas or, failing that, the
+        room with the lowest vnum.
+        """
+        if starts is None:
+            starts = self.entrances or [0]
+        else:
+            starts = [self.index[pk] for pk in starts]
+        if not len(self):
+            return []
+        seen = self.reachable(starts)
+        return [self.pks[room] for room in range(len(self)) if not seen[room]]
+
+    def dead_ends(self):
+        """
+        Rooms with no exit leading out of them. An exit to another area
+        leads out.
+        """
+        exits = self.exits
+        return [self.pks[room] for room in range(len(self))
+                if all(to == NOWHERE for to in exits[room * DIRECTIONS:(room + 1) * DIRECTIONS])]
+
+    def one_way_exits(self):
+        """
+        (room pk, direction, destination pk) for each exit whose destination
+        has no exit at all back to the room it came from.
+        """
+        found = []
+        for room in range(len(self)):
+            for direction, to in self.neighbours(room):
+                if room not in self.exits[to * DIRECTIONS:(to + 1) * DIRECTIONS]:
+                    found.append((self.pks[room], direction, self.pks[to]))
+        return found
+
+    def mismatched_exits(self):
+        """
+        (room pk, direction, destination pk, pk or None) for each exit whose
+        reverse direction in its destination doesn't lead back to the room
+        (the last item is where it leads instead).
+        """
+        found = []
+        for room in range(len(self)):
+            for direction, to in self.neighbours(room):
+                back = self.exits[to * DIRECTIONS + REVERSE[direction]]
+                if back != room:
+                    found.append((self.pks[room], direction, self.pks[to], self.pks[back] if back >= 0 else None))
+        return found
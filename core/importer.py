@@ -0,0 +1,649 @@
+"""
+Bulk import of TFC .are files.
+
+AreaReader parses an area file line by line, one block at a time, into
+plain records. AreaImporter then creates the area's rows with a fixed number
+of bulk inserts per model inside one transaction, resolving TFC_ids from
+in-memory maps loaded once per run. Only one area is held in memory at a
+time, however many files are imported.
+"""
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import F
+
+from core.api import touch_area
+from core.bulk import IN_SIZE, bulk_insert, chunked
+from core.commits import commit_on_success
+from core.export_cache import invalidate_area, invalidate_export, invalidate_rows
+from core.layout import drop_layout
+from core.models import (
+    ActionFlag,
+    AffectFlag,
+    Area,
+    AreaFlag,
+    AreaHelp,
+    Container,
+    Door,
+    DoorTrigger,
+    DoorType,
+    ExtraDescription,
+    ITEM_CLASSES,
+    Item,
+    ItemContainerReset,
+    ItemRoomReset,
+    KnownLanguage,
+    MobItemReset,
+    MobRoomReset,
+    Mobile,
+    PreferredLanguage,
+    Race,
+    ResetWearFlag,
+    Room,
+    RoomSpecialFunction,
+    Shopkeeper,
+    SpecialFunction,
+    Spell,
+    WearFlag,
+    flag_bits,
+    )
+from core.registry import registry
+from core.search import index_area, unindex_area
+from core.vnums import forget_indexes
+
+
+class AreaFileError(Exception):
+    """
+    An area file that can't be read or imported.
+    """
+    pass
+
+
+### Parsing ###
+class AreaReader(object):
+    """
+    Reads one area file into a dict of records, keyed by block.
+    """
+    BLOCKS = ('area', 'helps', 'mobiles', 'objects', 'rooms', 'resets', 'shops', 'specials', 'rspecs', 'triggers')
+
+    def __init__(self, lines, name='<area>'):
+        self.lines = iter(lines)
+        self.name = name
+        self.line_number = 0
+
+    def error(self, message):
+        return AreaFileError('%s:%d: %s' % (self.name, self.line_number, message))
+
+    def read_line(self):
+        for line in self.lines:
+            self.line_number += 1
+            if isinstance(line, str):
+                line = line.decode('utf-8')
+            return line.rstrip(u'\r\n')
+        raise self.error('unexpected end of file')
+
+    def read_string(self):
+        """
+        Reads a (possibly multi-line) string field up to its closing tilde.
+        """
+        lines = [self.read_line()]
+        while not lines[-1].endswith(u'~'):
+            lines.append(self.read_line())
+        return u'\n'.join(lines)[:-1]
+
+    def read_ints(self, count):
+        line = self.read_line()
+        try:
+            values = [int(value) for value in line.split()]
+        except ValueError:
+            raise self.error('expected numbers, got "%s"' % (line))
+        if len(values) != count:
+            raise self.error('expected %d numbers, got %d' % (count, len(values)))
+        return values
+
+    def read_vnum(self, line):
+        if not line.startswith(u'#'):
+            raise self.error('expected a vnum, got "%s"' % (line))
+        try:
+            return int(line[1:])
+        except ValueError:
+            raise self.error('bad vnum "%s"' % (line))
+
+    def read_tokens(self, line, ints):
+        """
+        Splits a one-line record, converting the fields at the ``ints``
+        positions to numbers.
+        """
+        tokens = line.split()
+        try:
+            for position in ints:
+                tokens[position] = int(tokens[position])
+        except (IndexError, ValueError):
+            raise self.error('bad record "%s"' % (line))
+        return tokens
+
+    def read(self):
+        """
+        Returns the whole area as a dict of block records.
+        """
+        area = {}
+        while True:
+            line = self.read_line().strip()
+            if not line:
+                continue
+            if line == u'#$':
+                break
+            block = line[1:].lower()
+            if not line.startswith(u'#') or block not in self.BLOCKS:
+                raise self.error('unknown block "%s"' % (line))
+            getattr(self, 'read_%s' % (block))(area)
+        if 'name' not in area:
+            raise self.error('no #AREA block')
+        return area
+
+    def read_area(self, area):
+        area['name'] = self.read_string()
+        area['author'] = self.read_string()
+        area['level_low'], area['level_high'], area['vnum'], area['flags'] = self.read_ints(4)
+
+    def read_helps(self, area):
+        helps = area.setdefault('helps', [])
+        while True:
+            level, keywords = self.read_string().split(u' ', 1)
+            if keywords == u'$':
+                return
+            text = self.read_string()
+            helps.append({
+                'level': int(level),
+                'keywords': keywords,
+                'blank_line': text.startswith(u'.\n'),
+                'text': text[2:] if text.startswith(u'.\n') else text,
+                })
+
+    def read_mobiles(self, area):
+        mobiles = area.setdefault('mobiles', [])
+        while True:
+            vnum = self.read_vnum(self.read_line())
+            if vnum == 0:
+                return
+            mob = {'vnum': vnum}
+            for field in ('names', 'short_desc', 'long_desc', 'look_desc'):
+                mob[field] = self.read_string()
+            (mob['level'], mob['alignment'], mob['sex'], mob['is_animal'], mob['no_wear'],
+             mob['total_in_game']) = self.read_ints(6)
+            mob['action_flags'], mob['affect_flags'], mob['spell'] = self.read_ints(3)
+            mob['preferred_language'], mob['known_languages'] = self.read_ints(2)
+            mobiles.append(mob)
+
+    def read_objects(self, area):
+        objects = area.setdefault('objects', [])
+        line = self.read_line()
+        while True:
+            vnum = self.read_vnum(line)
+            if vnum == 0:
+                return
+            item = {'vnum': vnum, 'extras': []}
+            for field in ('names', 'short_desc', 'long_desc'):
+                item[field] = self.read_string()
+            (item['item_type'], item['wear_flags'], item['takeable'], item['flammable'], item['metallic'],
+             item['two_handed'], item['underwater_breath']) = self.read_ints(7)
+            item['values'] = self.read_ints(4)
+            item['weight'], item['cost'], item['total_in_game'] = self.read_ints(3)
+            line = self.read_line()
+            while line == u'E':
+                item['extras'].append((self.read_string(), self.read_string()))
+                line = self.read_line()
+            objects.append(item)
+
+    def read_rooms(self, area):
+        rooms = area.setdefault('rooms', [])
+        while True:
+            vnum = self.read_vnum(self.read_line())
+            if vnum == 0:
+                return
+            room = {'vnum': vnum, 'doors': []}
+            line = self.read_line()
+            while line.startswith(u'D'):
+                door = {'direction': line[1:]}
+                for field in ('description', 'name', 'keywords'):
+                    door[field] = self.read_string()
+                door['door_type'], door['room_to'] = self.read_ints(2)
+                room['doors'].append(door)
+                line = self.read_line()
+            if line != u'S':
+                raise self.error('expected "S" to end room %d, got "%s"' % (vnum, line))
+            rooms.append(room)
+
+    def read_resets(self, area):
+        resets = area.setdefault('resets', [])
+        ints = {
+            u'M': (1, 2, 3, 4),
+            u'G': (1, 2, 3),
+            u'E': (1, 2, 3, 4),
+            u'O': (1, 2, 3, 4),
+            u'P': (1, 2, 3, 4),
+            u'D': (1, 2, 4),
+            }
+        while True:
+            line = self.read_line().strip()
+            if line == u'S':
+                return
+            if not line or line[0] not in ints:
+                raise self.error('unknown reset "%s"' % (line))
+            resets.append(self.read_tokens(line, ints[line[0]]))
+
+    def read_shops(self, area):
+        shops = area.setdefault('shops', [])
+        while True:
+            line = self.read_line().strip()
+            if line == u'0':
+                return
+            shops.append(self.read_tokens(line, range(9)))
+
+    def read_specials(self, area):
+        self.read_functions(area.setdefault('specials', []), u'M')
+
+    def read_rspecs(self, area):
+        self.read_functions(area.setdefault('rspecs', []), u'R')
+
+    def read_functions(self, functions, command):
+        while True:
+            line = self.read_line().strip()
+            if line == u'S':
+                return
+            tokens = self.read_tokens(line, (1,))
+            if tokens[0] != command or len(tokens) != 3:
+                raise self.error('bad special function "%s"' % (line))
+            functions.append(tokens[1:])
+
+    def read_triggers(self, area):
+        triggers = area.setdefault('triggers', [])
+        while True:
+            line = self.read_line().strip()
+            if line == u'S':
+                return
+            tokens = self.read_tokens(line, (1,))
+            if tokens[0] not in (u'P', u'A') or len(tokens) != 4:
+                raise self.error('bad trigger "%s"' % (line))
+            triggers.append(tokens)
+
+
+### Importing ###
+class Lookups(object):
+    """
+    Resolves TFC_ids through the registry, and item vnums through the map
+    for the area being imported.
+    """
+    def __init__(self):
+        self.registry = registry()
+        self.items = {}
+
+    def pk(self, model, TFC_id):
+        try:
+            return self.registry[model].by_TFC_id(TFC_id).pk
+        except KeyError:
+            raise AreaFileError('unknown %s %s' % (model._meta.verbose_name, TFC_id))
+
+    def flags(self, model, vector):
+        return [self.pk(model, bit) for bit in flag_bits(vector)]
+
+    def item_pk(self, vnum):
+        try:
+            return self.items[vnum]
+        except KeyError:
+            raise AreaFileError('unknown object %d' % (vnum))
+
+
+def m2m_rows(field, pairs):
+    """
+    Through-table rows for a many-to-many field from (owner pk, related pk) pairs.
+    """
+    through = field.rel.through
+    source, target = '%s_id' % (field.m2m_field_name()), '%s_id' % (field.m2m_reverse_field_name())
+    return [through(**{source: owner, target: related}) for owner, related in pairs]
+
+
+def delete_rows(model, column, queryset):
+    """
+    Deletes the rows of ``model``'s own table whose ``column`` is among
+    the pks of ``queryset``, in one statement and without signals.
+    """
+    sql, params = queryset.values('pk').query.sql_with_params()
+    qn = connection.ops.quote_name
+    connection.cursor().execute('DELETE FROM %s WHERE %s IN (%s)' % (qn(model._meta.db_table), qn(column), sql), params)
+
+
+def clear_area(area):
+    """
+    Deletes everything in an area but the Area row, one statement per table
+    and without signals, so that it can be imported again. Exits from other
+    areas into its rooms must be disconnected first. Rows of other areas
+    that point into it (resets, shop stock, containers its keys open) are
+    deleted the usual way, as they would have been along with its rows.
+    The caller indexes the area and touches it once refilled.
+    """
+    rooms = Room.objects.filter(area=area)
+    mobiles = Mobile.objects.filter(area=area)
+    items = Item.objects.filter(area=area)
+    for queryset in (
+        MobRoomReset.objects.filter(room__area=area).exclude(mobile__area=area),
+        MobItemReset.objects.filter(item__area=area).exclude(mobile__area=area),
+        ItemRoomReset.objects.filter(item__area=area).exclude(room__area=area),
+        ItemContainerReset.objects.filter(item__area=area).exclude(container__area=area),
+        Shopkeeper.reset_items.through.objects.filter(item__area=area).exclude(shopkeeper__mobile__area=area),
+        Container.objects.filter(key__area=area).exclude(area=area),
+        ):
+        queryset.delete()
+
+    # Nothing else tells the caches that these rows are gone.
+    for kind, queryset in (('mobile', mobiles), ('item', items), ('room', rooms)):
+        invalidate_rows(kind, list(queryset.values_list('pk', flat=True)))
+    drop_layout(area.pk, rooms.values_list('pk', flat=True))
+    unindex_area(area.pk)
+
+    doors = Door.objects.filter(room__area=area)
+    shops = Shopkeeper.objects.filter(mobile__area=area)
+    delete_rows(DoorTrigger, 'door_id', doors)
+    delete_rows(Door, 'room_id', rooms)
+    delete_rows(ItemRoomReset, 'room_id', rooms)
+    delete_rows(MobRoomReset, 'mobile_id', mobiles)
+    delete_rows(MobItemReset, 'mobile_id', mobiles)
+    delete_rows(ItemContainerReset, 'container_id', items)
+    delete_rows(Shopkeeper.reset_items.through, Shopkeeper._meta.get_field('reset_items').m2m_column_name(), shops)
+    delete_rows(Shopkeeper, 'mobile_id', mobiles)
+    delete_rows(ExtraDescription, 'item_id', items)
+    # Every table an item spans, children before their parents.
+    item_models = set()
+    for item_class in ITEM_CLASSES.values():
+        item_models.add(item_class)
+        item_models.update(item_class._meta.get_parent_list())
+    item_models = sorted(item_models, key=lambda model: -len(model._meta.get_parent_list()))
+    for model, queryset in [(Room, rooms), (Mobile, mobiles)] + [(model, items) for model in item_models]:
+        for field in model._meta.local_many_to_many:
+            delete_rows(field.rel.through, field.m2m_column_name(), queryset)
+    for model, queryset in [(model, items) for model in item_models] + [(Mobile, mobiles), (Room, rooms)]:
+        delete_rows(model, model._meta.pk.column, queryset)
+    areas = Area.objects.filter(pk=area.pk)
+    delete_rows(AreaHelp, 'area_id', areas)
+    delete_rows(Area.flags.through, Area._meta.get_field('flags').m2m_column_name(), areas)
+
+
+class AreaImporter(object):
+    """
+    Creates areas from AreaReader records.
+
+    Exits into rooms that aren't in the area being imported are resolved
+    against the whole world by finish(), once every file has been imported.
+    Exits from other areas into an area that is replaced are led into the
+    new rooms with the same vnums. Resets that can't be resolved are
+    skipped and noted in ``warnings``.
+    """
+    def __init__(self, replace=False, author=None):
+        self.replace = replace
+        self.author = author
+        self.lookups = Lookups()
+        self.exits = []
+        self.warnings = []
+
+    def warn(self, area, message):
+        self.warnings.append(u'%s: %s' % (area['name'], message))
+
+    def vnum_map(self, model, area):
+        return dict(model.objects.filter(area=area).values_list('vnum', 'pk'))
+
+    @commit_on_success
+    def create(self, record):
+        existing = Area.objects.filter(vnum=record['vnum'])
+        if existing and not self.replace:
+            raise AreaFileError('area %d already exists' % (record['vnum']))
+        username = self.author or record['author']
+        if Area.objects.filter(author__username=username).exclude(vnum=record['vnum']).exists():
+            raise AreaFileError('%s already has an area' % (username))
+        entrances = []
+        if existing:
+            # Deleting the old rooms would delete the exits into them from
+            # other areas too, so those are disconnected first and
+            # reconnected below.
+            entrances = Door.objects.filter(room_to__area__in=existing).exclude(room__area__in=existing)
+            entrances = list(entrances.values('pk', 'direction', 'room', 'room__vnum', 'room__area',
+                                              'room__area__vnum', 'room_to__vnum'))
+            for chunk in chunked([entrance['pk'] for entrance in entrances], IN_SIZE):
+                Door.objects.filter(pk__in=chunk).update(room_to=None, row_version=F('row_version') + 1)
+            # The Area row is kept, so its revisions and versions carry on.
+            clear_area(existing[0])
+
+        author, created = User.objects.get_or_create(username=username)
+        if created:
+            author.set_unusable_password()
+            author.save()
+        fields = dict(author=author, vnum=record['vnum'], name=record['name'], level_low=record['level_low'],
+                      level_high=record['level_high'], flags_vector=record['flags'], notes='')
+        if existing:
+            existing.update(**fields)
+            area = Area.objects.get(pk=existing[0].pk)
+        else:
+            area = Area.objects.create(**fields)
+        bulk_insert(Area.flags.through, m2m_rows(Area._meta.get_field('flags'),
+            [(area.pk, flag) for flag in self.lookups.flags(AreaFlag, record['flags'])]))
+        helps = record.get('helps', [])
+        if helps:
+            # An area only has the one help.
+            AreaHelp.objects.create(area=area, **helps[0])
+            if len(helps) > 1:
+                self.warn(record, 'only the first of %d helps was imported' % (len(helps)))
+
+        mobiles = self.create_mobiles(area, record)
+        items = self.create_items(area, record)
+        rooms = self.create_rooms(area, record)
+        self.create_resets(area, record, mobiles, items, rooms)
+        self.reconnect(record, entrances, rooms)
+        index_area(area.pk)
+        if existing:
+            # Its old rows were deleted without signals.
+            invalidate_area(area.pk)
+            touch_area(area.pk)
+            forget_indexes()
+        return area
+
+    def reconnect(self, record, entrances, rooms):
+        """
+        Leads the exits from other areas into a replaced area's old rooms
+        into the new rooms with the same vnums.
+        """
+        by_room, nowhere, touched = {}, [], set()
+        for door in entrances:
+            touched.add(door['room__area'])
+            if door['room_to__vnum'] in rooms:
+                by_room.setdefault(rooms[door['room_to__vnum']], []).append(door['pk'])
+            else:
+                nowhere.append(Door(pk=door['pk'], room_id=door['room']))
+                self.warn(record, 'exit %s from room %d of area %d leads nowhere, room %d is gone' % (
+                    door['direction'], door['room__vnum'], door['room__area__vnum'], door['room_to__vnum']))
+        for room, doors in by_room.items():
+            for chunk in chunked(doors, IN_SIZE):
+                Door.objects.filter(pk__in=chunk).update(room_to=room)
+        # Doors are updated without signals. Those still leading to the same
+        # vnum export just as before.
+        for door in nowhere:
+            invalidate_export(door)
+        for area_pk in sorted(touched):
+            touch_area(area_pk)
+
+    def create_mobiles(self, area, record):
+        lookups = self.lookups
+        bulk_insert(Mobile, [
+            Mobile(area=area, vnum=mob['vnum'], names=mob['names'], short_desc=mob['short_desc'],
+                   long_desc=mob['long_desc'], look_desc=mob['look_desc'], level=mob['level'],
+                   alignment=mob['alignment'], sex=mob['sex'], is_animal=bool(mob['is_animal']),
+                   no_wear=bool(mob['no_wear']), total_in_game=mob['total_in_game'],
+                   action_flags_vector=mob['action_flags'], affect_flags_vector=mob['affect_flags'],
+                   spell_id=lookups.pk(Spell, mob['spell']) if mob['spell'] != -1 else None,
+                   preferred_language_id=lookups.pk(PreferredLanguage, mob['preferred_language']), notes='')
+            for mob in record.get('mobiles', [])])
+        mobiles = self.vnum_map(Mobile, area)
+
+        for name, model in (('action_flags', ActionFlag), ('affect_flags', AffectFlag), ('known_languages', KnownLanguage)):
+            pairs = [(mobiles[mob['vnum']], flag) for mob in record.get('mobiles', [])
+                     for flag in lookups.flags(model, mob[name])]
+            bulk_insert(getattr(Mobile, name).through, m2m_rows(Mobile._meta.get_field(name), pairs))
+        pairs = []
+        for vnum, function in record.get('specials', []):
+            if vnum not in mobiles:
+                self.warn(record, 'special function for unknown mob %d' % (vnum))
+                continue
+            pairs.append((mobiles[vnum], lookups.pk(SpecialFunction, function)))
+        bulk_insert(Mobile.special_functions.through, m2m_rows(Mobile._meta.get_field('special_functions'), pairs))
+        return mobiles
+
+    def create_items(self, area, record):
+        objects = record.get('objects', [])
+        for item in objects:
+            if item['item_type'] not in ITEM_CLASSES:
+                raise AreaFileError('object %d has unknown item type %d' % (item['vnum'], item['item_type']))
+        bulk_insert(Item, [
+            Item(area=area, vnum=item['vnum'], names=item['names'], short_desc=item['short_desc'],
+                 long_desc=item['long_desc'], takeable=bool(item['takeable']),
+                 wear_flags_id=self.lookups.pk(WearFlag, item['wear_flags']),
+                 weight=item['weight'], cost=item['cost'], values=0,
+                 flammable=bool(item['flammable']), metallic=bool(item['metallic']),
+                 two_handed=bool(item['two_handed']), underwater_breath=bool(item['underwater_breath']),
+                 total_in_game=item['total_in_game'], notes='', item_type=item['item_type'],
+                 type_values=u' '.join([unicode(value) for value in item['values']]))
+            for item in objects])
+        items = self.vnum_map(Item, area)
+        self.lookups.items = items
+
+        # The concrete rows, grouped by type, then their many-to-many rows.
+        children = {}
+        m2m = {}
+        for item in objects:
+            item_class = ITEM_CLASSES[item['item_type']]
+            child = item_class(item_ptr_id=items[item['vnum']])
+            for name, related in child.read_values(item['values'], self.lookups).items():
+                m2m.setdefault((item_class, name), []).extend((child.pk, pk) for pk in related)
+            children.setdefault(item_class, []).append(child)
+        for item_class, rows in children.items():
+            bulk_insert(item_class, rows)
+        for (item_class, name), pairs in m2m.items():
+            bulk_insert(getattr(item_class, name).through, m2m_rows(item_class._meta.get_field(name), pairs))
+
+        bulk_insert(ExtraDescription, [
+            ExtraDescription(item_id=items[item['vnum']], TFC_id=position, keywords=keywords, description=description)
+            for item in objects for position, (keywords, description) in enumerate(item['extras'])])
+        return items
+
+    def create_rooms(self, area, record):
+        bulk_insert(Room, [Room(area=area, vnum=room['vnum'], notes='') for room in record.get('rooms', [])])
+        rooms = self.vnum_map(Room, area)
+
+        door_resets = {}
+        for reset in record.get('resets', []):
+            if reset[0] == u'D':
+                command, every_cycle, room, direction, state = reset
+                door_resets[(room, direction)] = (every_cycle, state)
+        doors = []
+        for room in record.get('rooms', []):
+            for door in room['doors']:
+                to = rooms.get(door['room_to'])
+                if to is None and door['room_to'] != -1:
+                    self.exits.append((area.pk, room['vnum'], door['direction'], door['room_to']))
+                every_cycle, state = door_resets.get((room['vnum'], door['direction']), (0, None))
+                doors.append(Door(room_id=rooms[room['vnum']], direction=door['direction'],
+                                  door_type_id=self.lookups.pk(DoorType, door['door_type']), name=door['name'],
+                                  keywords=door['keywords'], description=door['description'], room_to_id=to,
+                                  reset=(room['vnum'], door['direction']) in door_resets,
+                                  reset_every_cycle=bool(every_cycle), reset_value=state, notes=''))
+        bulk_insert(Door, doors)
+
+        pairs = []
+        for vnum, function in record.get('rspecs', []):
+            if vnum not in rooms:
+                self.warn(record, 'special function for unknown room %d' % (vnum))
+                continue
+            pairs.append((rooms[vnum], self.lookups.pk(RoomSpecialFunction, function)))
+        bulk_insert(Room.special_functions.through, m2m_rows(Room._meta.get_field('special_functions'), pairs))
+
+        door_pks = dict(((vnum, direction), pk) for vnum, direction, pk in
+                        Door.objects.filter(room__area=area).values_list('room__vnum', 'direction', 'pk'))
+        triggers = []
+        for trigger_type, vnum, direction, TFC_id in record.get('triggers', []):
+            if (vnum, direction) not in door_pks:
+                self.warn(record, 'trigger for unknown exit %d %s' % (vnum, direction))
+                continue
+            triggers.append(DoorTrigger(door_id=door_pks[(vnum, direction)], trigger_type=trigger_type, TFC_id=TFC_id))
+        bulk_insert(DoorTrigger, triggers)
+        return rooms
+
+    def create_resets(self, area, record, mobiles, items, rooms):
+        shops = dict((shop[0], shop) for shop in record.get('shops', []))
+        # Keyed by each model's unique_together, so repeats collapse.
+        mob_rooms, mob_items, room_items, contents, stock = {}, {}, {}, {}, {}
+        mobile = mobile_vnum = None
+        for reset in record.get('resets', []):
+            command = reset[0]
+            if command == u'D':
+                continue
+            if command == u'M':
+                mobile, room = mobiles.get(reset[2]), rooms.get(reset[4])
+                if mobile is None or room is None:
+                    self.warn(record, 'skipped reset "%s"' % (u' '.join([unicode(t) for t in reset])))
+                    mobile = None
+                    continue
+                mob_rooms[(mobile, room)] = MobRoomReset(mobile_id=mobile, room_id=room, reset_every_cycle=bool(reset[1]))
+                mobile_vnum = reset[2]
+                continue
+            item = items.get(reset[2])
+            target = {u'G': mobile, u'E': mobile, u'O': rooms.get(reset[-1]), u'P': items.get(reset[-1])}[command]
+            if item is None or target is None:
+                self.warn(record, 'skipped reset "%s"' % (u' '.join([unicode(t) for t in reset])))
+                continue
+            every_cycle = bool(reset[1])
+            if command == u'G' and mobile_vnum in shops:
+                # Anything given to a shopkeeper is stock.
+                stock[(mobile, item)] = (mobile, item)
+            elif command in (u'G', u'E'):
+                wear = self.lookups.pk(ResetWearFlag, reset[4]) if command == u'E' else None
+                mob_items[(item, mobile)] = MobItemReset(item_id=item, mobile_id=mobile, reset_every_cycle=every_cycle,
+                                                         wear_location_id=wear)
+            elif command == u'O':
+                room_items[(target, item)] = ItemRoomReset(room_id=target, item_id=item, reset_every_cycle=every_cycle)
+            else:
+                contents[(target, item)] = ItemContainerReset(container_id=target, item_id=item, reset_every_cycle=every_cycle)
+        bulk_insert(MobRoomReset, mob_rooms.values())
+        bulk_insert(MobItemReset, mob_items.values())
+        bulk_insert(ItemRoomReset, room_items.values())
+        bulk_insert(ItemContainerReset, contents.values())
+
+        keepers = []
+        for vnum, b1, b2, b3, b4, b5, race, opens, closes in shops.values():
+            if vnum not in mobiles:
+                self.warn(record, 'shop for unknown mob %d' % (vnum))
+                continue
+            keepers.append(Shopkeeper(mobile_id=mobiles[vnum], race_id=self.lookups.pk(Race, race),
+                                      will_buy=u','.join([unicode(t) for t in (b1, b2, b3, b4, b5) if t]),
+                                      opens=opens, closes=closes))
+        bulk_insert(Shopkeeper, keepers)
+        keepers = dict(Shopkeeper.objects.filter(mobile__area=area).values_list('mobile', 'pk'))
+        bulk_insert(Shopkeeper.reset_items.through, m2m_rows(Shopkeeper._meta.get_field('reset_items'),
+            [(keepers[keeper], stocked) for keeper, stocked in stock.values()]))
+
+    def finish(self):
+        """
+        Connects exits into rooms of other areas, now that they all exist.
+        Room vnums are only unique per area, so an exit whose vnum matches
+        more than one room elsewhere is left unconnected.
+        """
+        touched = set()
+        for area, vnum, direction, to in self.exits:
+            candidates = list(Room.objects.filter(vnum=to).exclude(area=area).values_list('pk', flat=True)[:2])
+            door = Door.objects.filter(room__area=area, room__vnum=vnum, direction=direction)
+            if len(candidates) == 1:
+                door.update(room_to=candidates[0], row_version=F('row_version') + 1)
+                touched.add(area)
+            else:
+                self.warnings.append(u'exit %s from room %d to room %d %s' % (
+                    direction, vnum, to, 'is ambiguous' if candidates else 'leads nowhere'))
+        # Exits are connected with update(), which sends no signals.
+        for area_pk in sorted(touched):
+            touch_area(area_pk)
+        self.exits = []
+        transaction.commit_unless_managed()
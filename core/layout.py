@@ -0,0 +1,165 @@
+"""
+Grid layout of an area's rooms, for the map editor.
+
+Each connected group of rooms is laid out breadth-first from its lowest vnum,
+one grid step per exit in the exit's direction (Up and Down change the z
+level). Exits that don't fit a grid, such as a loop that comes back to a
+different room, would put two rooms in one cell; the later room takes the
+nearest free cell on the same level instead. The groups are then placed
+side by side along x.
+
+Layouts are kept in Django's cache per group. When a door changes only the
+groups on either side of it are laid out again.
+"""
+from collections import deque
+
+from django.conf import settings
+from django.core.cache import cache
+
+from core.graph import RoomGraph
+from core.models import Room
+
+
+LAYOUT_CACHE_TIMEOUT = getattr(settings, 'LAYOUT_CACHE_TIMEOUT', 60 * 60 * 24 * 30)
+
+# Grid step of each direction in DIRECTION_CHOICES.
+DELTAS = ((0, 1, 0), (1, 0, 0), (0, -1, 0), (-1, 0, 0), (0, 0, 1), (0, 0, -1))
+
+# Empty columns between groups of rooms.
+GAP = 2
+
+
+def layout_key(area_pk):
+    return 'layout:%d' % (area_pk)
+
+
+def components(graph):
+    """
+    Returns the connected groups of rooms in ``graph`` (ignoring which way
+    exits lead), as lists of room indices, each starting with its lowest.
+    """
+    linked = [[] for room in range(len(graph))]
+    for room in range(len(graph)):
+        for direction, to in graph.neighbours(room):
+            linked[room].append(to)
+            linked[to].append(room)
+    group = [None] * len(graph)
+    found = []
+    for start in range(len(graph)):
+        if group[start] is not None:
+            continue
+        group[start] = len(found)
+        rooms = [start]
+        queue = deque(rooms)
+        while queue:
+            for to in linked[queue.popleft()]:
+                if group[to] is None:
+                    group[to] = len(found)
+                    rooms.append(to)
+                    queue.append(to)
+        found.append(rooms)
+    return found
+
+
+def free_cell(taken, cell):
+    """
+    Returns the free cell nearest to ``cell`` on the same level.
+    """
+    if cell not in taken:
+        return cell
+    x, y, z = cell
+    ring = 1
+    while True:
+        cells = [(x + dx, y + dy, z) for dx in range(-ring, ring + 1) for dy in range(-ring, ring + 1)
+                 if max(abs(dx), abs(dy)) == ring]
+        cells.sort(key=lambda (cx, cy, cz): abs(cx - x) + abs(cy - y))
+        for cell in cells:
+            if cell not in taken:
+                return cell
+        ring += 1
+
+
+def place_component(graph, rooms):
+    """
+    Lays out one connected group of rooms. Returns {room pk: (x, y, z)},
+    with the group's first room at the origin.
+    """
+    members = set(rooms)
+    # Exits into a room are walked backwards from their destination.
+    steps = dict((room, []) for room in rooms)
+    for room in rooms:
+        for direction, to in graph.neighbours(room):
+            if to in members:
+                steps[room].append((DELTAS[direction], 1, to))
+                steps[to].append((DELTAS[direction], -1, room))
+    coords = {rooms[0]: (0, 0, 0)}
+    taken = set(coords.values())
+    queue = deque(rooms[:1])
+    while queue:
+        room = queue.popleft()
+        x, y, z = coords[room]
+        for (dx, dy, dz), sign, to in steps[room]:
+            if to in coords:
+                continue
+            cell = free_cell(taken, (x + sign * dx, y + sign * dy, z + sign * dz))
+            coords[to] = cell
+            taken.add(cell)
+            queue.append(to)
+    return dict((graph.pks[room], cell) for room, cell in coords.iteritems())
+
+
+def area_layout(area):
+    """
+    Returns {room pk: (x, y, z)} for every room in ``area``, laying out
+    only the groups of rooms that changed since the last call.
+    """
+    key = layout_key(area.pk)
+    cached = cache.get(key) or {'components': {}, 'layout': None}
+    if cached['layout'] is not None:
+        return cached['layout']
+    graph = RoomGraph(RoomGraph.rows(Room.objects.filter(area=area).order_by('vnum')))
+    placed = {}
+    layout = {}
+    x = 0
+    for rooms in components(graph):
+        pks = tuple(sorted(graph.pks[room] for room in rooms))
+        coords = cached['components'].get(pks)
+        if coords is None:
+            coords = place_component(graph, rooms)
+        placed[pks] = coords
+        left = min(cx for cx, cy, cz in coords.itervalues())
+        right = max(cx for cx, cy, cz in coords.itervalues())
+        for pk, (cx, cy, cz) in coords.iteritems():
+            layout[pk] = (cx - left + x, cy, cz)
+        x += right - left + 1 + GAP
+    cache.set(key, {'components': placed, 'layout': layout}, LAYOUT_CACHE_TIMEOUT)
+    return layout
+
+
+### Invalidation ###
+def drop_layout(area_pk, rooms=()):
+    """
+    Forgets the combined layout of an area, and the layout of each group
+    that includes one of ``rooms``.
+    """
+    key = layout_key(area_pk)
+    cached = cache.get(key)
+    if cached is None:
+        return
+    rooms = set(rooms)
+    cached['components'] = dict((pks, coords) for pks, coords in cached['components'].iteritems()
+                                if rooms.isdisjoint(pks))
+    cached['layout'] = None
+    cache.set(key, cached, LAYOUT_CACHE_TIMEOUT)
+
+
+def door_changed(sender, instance, **kwargs):
+    rooms = [pk for pk in (instance.room_id, instance.room_to_id) if pk is not None]
+    for area_pk in set(Room.objects.filter(pk__in=rooms).values_list('area', flat=True)):
+        drop_layout(area_pk, rooms)
+
+
+def room_changed(sender, instance, **kwargs):
+    # Groups are matched by their rooms, so a new or deleted room only
+    # needs the combined layout redone.
+    drop_layout(instance.area_id)
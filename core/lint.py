@@ -0,0 +1,205 @@
+"""
+Checks an area before it goes to the game server.
+
+lint_area() loads what the rules look at with one values query per table,
+then makes a single pass over the rows, running every rule registered for
+each kind of row. lint_world() does the same for every area, spread across
+a process pool.
+"""
+from collections import Counter, namedtuple
+from multiprocessing import Pool
+
+from django.db import connection
+
+from core.lists import DIRECTION_CHOICES
+from core.models import (
+    ITEM_CLASSES,
+    Area,
+    Door,
+    Item,
+    ItemContainerReset,
+    ItemRoomReset,
+    MobItemReset,
+    MobRoomReset,
+    Mobile,
+    Room,
+    Shopkeeper,
+    )
+
+
+DIRECTIONS = dict(DIRECTION_CHOICES)
+
+ERROR = 'error'
+WARNING = 'warning'
+
+# Shopkeepers only read this many item types from will_buy.
+SHOP_BUY_TYPES = 5
+
+
+class Diagnostic(namedtuple('Diagnostic', 'level area kind pk rule message')):
+    """
+    One problem found by a rule: ``area`` is the area's vnum, ``kind`` and
+    ``pk`` the row at fault.
+    """
+    __slots__ = ()
+
+    def __unicode__(self):
+        return u'%d: %s: %s' % (self.area, self.level, self.message)
+
+
+KINDS = ('mobile', 'item', 'room', 'door', 'shop', 'reset')
+RULES = {}
+
+
+def rule(kind):
+    """
+    Registers a rule for rows of ``kind``. A rule takes the AreaData and a
+    row, and returns (level, message) pairs.
+    """
+    def register(function):
+        RULES.setdefault(kind, []).append(function)
+        return function
+    return register
+
+
+class AreaData(object):
+    """
+    Everything the rules need about one area, as value dicts by kind.
+    """
+    def __init__(self, area):
+        self.area = area
+        self.low, self.high = area.vnum_range()
+        self.rows = {
+            'mobile': Mobile.objects.filter(area=area).values('pk', 'vnum', 'total_in_game'),
+            'item': Item.objects.filter(area=area).values('pk', 'vnum', 'total_in_game'),
+            'room': Room.objects.filter(area=area).values('pk', 'vnum'),
+            # room_to__vnum is None when room_to is set but the room is gone.
+            'door': Door.objects.filter(room__area=area).values('pk', 'room__vnum', 'direction',
+                                                                 'room_to', 'room_to__vnum'),
+            'shop': Shopkeeper.objects.filter(mobile__area=area).values('pk', 'mobile__vnum', 'will_buy',
+                                                                         'opens', 'closes'),
+            'reset': list(self.resets()),
+        }
+        self.mobile_resets = Counter(reset['mobile'] for reset in self.rows['reset'] if reset['type'] == 'M')
+        self.item_resets = Counter(reset['item'] for reset in self.rows['reset'] if reset['item'] is not None)
+
+    def resets(self):
+        """
+        Every reset in the area, as dicts with the reset ``type`` (as in
+        #RESETS), the ``mobile`` and ``item`` it resets, and the item's vnum
+        and area.
+        """
+        area = self.area
+        item_fields = ('item', 'item__vnum', 'item__area')
+        for reset in MobRoomReset.objects.filter(mobile__area=area).values('pk', 'mobile'):
+            yield dict(reset, type='M', item=None)
+        for reset in MobItemReset.objects.filter(mobile__area=area).values('pk', 'mobile', *item_fields):
+            yield dict(reset, type='G')
+        for reset in ItemRoomReset.objects.filter(room__area=area).values('pk', *item_fields):
+            yield dict(reset, type='O', mobile=None)
+        for reset in ItemContainerReset.objects.filter(container__area=area).values('pk', *item_fields):
+            yield dict(reset, type='P', mobile=None)
+        stock = (Shopkeeper.reset_items.through.objects.filter(shopkeeper__mobile__area=area)
+                 .values('pk', 'shopkeeper__mobile', *item_fields))
+        for reset in stock:
+            mobile = reset.pop('shopkeeper__mobile')
+            yield dict(reset, type='G', mobile=mobile)
+
+
+### Rules ###
+@rule('mobile')
+@rule('item')
+@rule('room')
+def vnum_in_range(data, row):
+    if not data.low <= row['vnum'] <= data.high:
+        yield ERROR, 'vnum %d is outside the area (%d-%d)' % (row['vnum'], data.low, data.high)
+
+
+@rule('mobile')
+def mobile_total_in_game(data, row):
+    resets = data.mobile_resets[row['pk']]
+    if resets > row['total_in_game']:
+        yield WARNING, 'mob %d is reset %d times but total_in_game is %d' % (row['vnum'], resets, row['total_in_game'])
+
+
+@rule('item')
+def item_total_in_game(data, row):
+    resets = data.item_resets[row['pk']]
+    if resets > row['total_in_game']:
+        yield WARNING, 'object %d is reset %d times but total_in_game is %d' % (row['vnum'], resets, row['total_in_game'])
+
+
+@rule('door')
+def door_destination(data, row):
+    direction = DIRECTIONS[int(row['direction'])]
+    if row['room_to'] is None:
+        yield WARNING, '%s exit from room %d leads nowhere' % (direction, row['room__vnum'])
+    elif row['room_to__vnum'] is None:
+        yield ERROR, '%s exit from room %d leads to missing room %d' % (direction, row['room__vnum'], row['room_to'])
+
+
+@rule('shop')
+def shop_will_buy(data, row):
+    types = [item_type.strip() for item_type in row['will_buy'].split(',') if item_type.strip()]
+    for item_type in types:
+        if not item_type.isdigit() or int(item_type) not in ITEM_CLASSES:
+            yield ERROR, 'shop %d buys unknown item type "%s"' % (row['mobile__vnum'], item_type)
+    if len(types) > SHOP_BUY_TYPES:
+        yield WARNING, 'shop %d buys %d item types; only the first %d are used' % (row['mobile__vnum'], len(types),
+                                                                                   SHOP_BUY_TYPES)
+
+
+@rule('shop')
+def shop_hours(data, row):
+    for name in ('opens', 'closes'):
+        if not 0 <= row[name] <= 23:
+            yield ERROR, 'shop %d %s at hour %d' % (row['mobile__vnum'], name, row[name])
+
+
+@rule('reset')
+def reset_item_area(data, row):
+    if row['item'] is not None and row['item__area'] != data.area.pk:
+        yield ERROR, '%s reset uses object %d from another area' % (row['type'], row['item__vnum'])
+
+
+### Running ###
+def lint_area(area):
+    """
+    Runs every rule over ``area``. Returns a list of Diagnostics.
+    """
+    data = AreaData(area)
+    found = []
+    for kind in KINDS:
+        rules = RULES.get(kind, ())
+        for row in data.rows[kind]:
+            for function in rules:
+                found.extend(Diagnostic(level, area.vnum, kind, row['pk'], function.__name__, message)
+                             for level, message in function(data, row))
+    return found
+
+
+def lint_area_pk(pk):
+    return lint_area(Area.objects.get(pk=pk))
+
+
+def lint_world(areas=None, processes=None):
+    """
+    Lints ``areas`` (every area by default), one area per task in a pool of
+    ``processes`` worker processes (one per CPU by default), or in this
+    process if ``processes`` is 1.
+    """
+    if areas is None:
+        areas = Area.objects.all()
+    pks = list(areas.order_by('vnum').values_list('pk', flat=True))
+    if processes == 1:
+        results = map(lint_area_pk, pks)
+    else:
+        # Workers are forked, and mustn't share this process's connection.
+        connection.close()
+        pool = Pool(processes)
+        try:
+            results = pool.map(lint_area_pk, pks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    return [diagnostic for result in results for diagnostic in result]
@@ -0,0 +1,70 @@
+import json
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from core.benchmark import SCENARIOS, Benchmark
+from core.synthetic import WorldGenerator
+
+
+class Command(BaseCommand):
+    help = ('Builds a synthetic world in a throwaway database, times export, import, lint, admin '
+            'changelists, graph analysis and reset simulation over it, and writes the results as JSON. '
+            'The database is created like the test database, so set TEST_NAME for a file database.')
+    option_list = BaseCommand.option_list + (
+        make_option('--areas', dest='areas', type='int', default=10,
+            help='Number of areas (default 10).'),
+        make_option('--rooms', dest='rooms', type='int', default=50,
+            help='Rooms per area (default 50).'),
+        make_option('--mobiles', dest='mobiles', type='int', default=20,
+            help='Mobs per area (default 20).'),
+        make_option('--items', dest='items', type='int', default=40,
+            help='Items per area (default 40).'),
+        make_option('--seed', dest='seed', type='int', default=0,
+            help='Random seed for the world (default 0).'),
+        make_option('--repeat', dest='repeat', type='int', default=3,
+            help='Times to run each scenario (default 3).'),
+        make_option('--sample', dest='sample', type='int', default=5,
+            help='Areas the per-area scenarios work through (default 5).'),
+        make_option('--scenarios', dest='scenarios', default=','.join(SCENARIOS),
+            help='Comma-separated scenarios to run (default all).'),
+        make_option('-o', '--output', dest='output', default=None,
+            help='File to write the results to (default standard output).'),
+        )
+
+    def handle(self, *args, **options):
+        scenarios = [name for name in options['scenarios'].split(',') if name]
+        for name in scenarios:
+            if name not in SCENARIOS:
+                raise CommandError('Unknown scenario %s; expected one of %s.' % (name, ', '.join(SCENARIOS)))
+        if options['repeat'] < 1:
+            raise CommandError('--repeat must be at least 1.')
+        try:
+            generator = WorldGenerator(areas=options['areas'], rooms=options['rooms'], mobiles=options['mobiles'],
+                                       items=options['items'], seed=options['seed'])
+        except ValueError as e:
+            raise CommandError(e)
+
+        connection = connections[DEFAULT_DB_ALIAS]
+        old_name = connection.creation.create_test_db(verbosity=0)
+        try:
+            warnings = generator.build()
+            results = Benchmark(sample=options['sample'], repeat=options['repeat']).run(scenarios)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+        results['world'] = {
+            'areas': generator.areas,
+            'rooms': generator.rooms,
+            'mobiles': generator.mobiles,
+            'items': generator.items,
+            'seed': generator.seed,
+            'warnings': len(warnings),
+            }
+
+        output = json.dumps(results, indent=2, sort_keys=True) + '\n'
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,41 @@
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.lint import ERROR
+from core.models import Area
+from core.world import check_world, write_bundle
+
+
+class Command(BaseCommand):
+    args = '[area vnum ...]'
+    help = ('Checks every area (or the given areas) for conflicts with each other, then exports them '
+            'with an area.lst into a gzipped tar archive.')
+    option_list = BaseCommand.option_list + (
+        make_option('-o', '--output', dest='output', default=None,
+            help='File to write the archive to (default standard output).'),
+        make_option('-p', '--processes', dest='processes', type='int', default=None,
+            help='Number of worker processes (default: one per CPU).'),
+        make_option('--force', action='store_true', dest='force', default=False,
+            help='Build the archive even if the areas conflict.'),
+        )
+
+    def handle(self, *args, **options):
+        areas = Area.objects.all()
+        if args:
+            areas = areas.filter(vnum__in=args)
+        diagnostics = check_world(areas)
+        for diagnostic in diagnostics:
+            self.stderr.write((u'%s\n' % (unicode(diagnostic))).encode('utf-8'))
+        errors = len([diagnostic for diagnostic in diagnostics if diagnostic.level == ERROR])
+        if errors and not options['force']:
+            raise CommandError('%d conflicts between areas; nothing was built.' % (errors))
+
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout
+        try:
+            names = write_bundle(output, areas, processes=options['processes'])
+        finally:
+            if options['output']:
+                output.close()
+        self.stderr.write('Bundled %d areas.\n' % (len(names)))
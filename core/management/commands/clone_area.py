@@ -0,0 +1,71 @@
+from optparse import make_option
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from core.clone import CloneError, clone_area, copy_rooms
+from core.models import Area, Item, Mobile, Room
+
+
+class Command(BaseCommand):
+    args = '<area vnum> <new vnum>'
+    help = ('Copies an area and everything in it to a new area. With --rooms, copies just those '
+            'rooms, with their doors and what is reset in them, to new vnums in an existing area.')
+    option_list = BaseCommand.option_list + (
+        make_option('--name', dest='name', default=None,
+            help='Name of the new area (default "<name> (copy)").'),
+        make_option('--author', dest='author', default=None,
+            help='Username of the new area\'s author, who must not have an area yet (default "<author>-copy").'),
+        make_option('--rooms', dest='rooms', default=None,
+            help='Copy only the rooms numbered LOW-HIGH; <new vnum> is then the area to copy them into.'),
+        make_option('--offset', dest='offset', type='int', default=None,
+            help='Added to the vnums of the rooms, mobs and items copied with --rooms.'),
+        )
+
+    def handle(self, *args, **options):
+        if len(args) != 2:
+            raise CommandError('Usage: clone_area %s' % (self.args))
+        area = self.area(args[0])
+        try:
+            if options['rooms']:
+                self.copy_rooms(area, args[1], options)
+            else:
+                self.clone(area, args[1], options)
+        except CloneError as e:
+            raise CommandError(e)
+
+    def area(self, vnum):
+        try:
+            return Area.objects.get(vnum=vnum)
+        except (Area.DoesNotExist, ValueError):
+            raise CommandError('No area with vnum %s.' % (vnum))
+
+    def clone(self, area, vnum, options):
+        if not vnum.isdigit():
+            raise CommandError('Bad vnum %s.' % (vnum))
+        if Area.objects.filter(vnum=vnum).exists():
+            raise CommandError('Area %s already exists.' % (vnum))
+        username = options['author'] or '%s-copy' % (area.author.username)
+        author, created = User.objects.get_or_create(username=username)
+        if created:
+            author.set_unusable_password()
+            author.save()
+        elif Area.objects.filter(author=author).exists():
+            raise CommandError('%s already has an area.' % (username))
+        clone = clone_area(area, int(vnum), options['name'] or '%s (copy)' % (area.name), author)
+        self.stdout.write('Copied area %d to %d.\n' % (area.vnum, clone.vnum))
+
+    def copy_rooms(self, area, vnum, options):
+        try:
+            low, high = [int(n) for n in options['rooms'].split('-')]
+        except ValueError:
+            raise CommandError('--rooms must be LOW-HIGH.')
+        if options['offset'] is None:
+            raise CommandError('--rooms needs --offset.')
+        target = self.area(vnum)
+        rooms = Room.objects.filter(area=area, vnum__range=(low, high))
+        if not rooms.exists():
+            raise CommandError('Area %d has no rooms numbered %d-%d.' % (area.vnum, low, high))
+        copier = copy_rooms(rooms, target, options['offset'])
+        self.stdout.write('Copied %d rooms, %d mobs and %d items to area %d.\n' % (
+            len(copier.pks[Room]), len(copier.pks[Mobile]), len(copier.pks[Item]), target.vnum))
@@ -0,0 +1,47 @@
+import json
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.diff import AreaDiff, Snapshot
+from core.importer import AreaFileError
+from core.models import Area, AreaVersion
+from core.snapshots import version_snapshot
+
+
+class Command(BaseCommand):
+    args = '<area vnum> [<.are file>]'
+    help = ('Shows what changed in an area since the version in an .are file, or a stored version, '
+            'such as the last one approved for the game.')
+    option_list = BaseCommand.option_list + (
+        make_option('--stored', dest='stored', type='int', default=None,
+            help='Compare with this stored version (see snapshot_area) instead of a file.'),
+        make_option('--json', action='store_true', dest='json', default=False,
+            help='Write the differences as JSON.'),
+        )
+
+    def handle(self, *args, **options):
+        if len(args) != (1 if options['stored'] is not None else 2):
+            raise CommandError('Usage: diff_area %s' % (self.args))
+        try:
+            area = Area.objects.get(vnum=args[0])
+        except (Area.DoesNotExist, ValueError):
+            raise CommandError('No area with vnum %s.' % (args[0]))
+        if options['stored'] is not None:
+            try:
+                old = version_snapshot(AreaVersion.objects.get(vnum=area.vnum, number=options['stored']))
+            except AreaVersion.DoesNotExist:
+                raise CommandError('Area %d has no version %d.' % (area.vnum, options['stored']))
+        else:
+            try:
+                with open(args[1]) as f:
+                    old = Snapshot.from_lines((line.decode('utf-8') for line in f), args[1])
+            except (IOError, AreaFileError) as e:
+                raise CommandError(e)
+
+        diff = AreaDiff(old, Snapshot.from_area(area))
+        if options['json']:
+            self.stdout.write(json.dumps(diff.as_dict(), indent=2, sort_keys=True) + '\n')
+        else:
+            for line in diff.lines():
+                self.stdout.write(line.encode('utf-8'))
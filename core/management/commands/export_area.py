@@ -0,0 +1,47 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.export import AreaExporter
+from core.export_cache import CachedAreaExporter
+from core.models import Area, AreaVersion
+from core.snapshots import export_version
+
+
+class Command(BaseCommand):
+    args = '<area vnum>'
+    help = 'Writes the .are file for an area to stdout or to a file.'
+    option_list = BaseCommand.option_list + (
+        make_option('-o', '--output', dest='output', default=None,
+            help='File to write the area to instead of stdout.'),
+        make_option('--no-cache', action='store_false', dest='cache', default=True,
+            help='Render the whole area instead of reusing cached parts of earlier exports.'),
+        make_option('--stored', dest='stored', type='int', default=None,
+            help='Write a stored version of the area (see snapshot_area) instead of the current one.'),
+        )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Usage: export_area %s' % (self.args))
+        if options['stored'] is not None:
+            # Stored versions outlive their area.
+            try:
+                chunks = export_version(AreaVersion.objects.get(vnum=args[0], number=options['stored']))
+            except (AreaVersion.DoesNotExist, ValueError):
+                raise CommandError('Area %s has no version %d.' % (args[0], options['stored']))
+        else:
+            try:
+                area = Area.objects.get(vnum=args[0])
+            except (Area.DoesNotExist, ValueError):
+                raise CommandError('No area with vnum %s.' % (args[0]))
+            chunks = (CachedAreaExporter if options['cache'] else AreaExporter)(area)
+
+        output = self.stdout
+        if options['output']:
+            output = open(options['output'], 'w')
+        try:
+            for chunk in chunks:
+                output.write(chunk.encode('utf-8'))
+        finally:
+            if options['output']:
+                output.close()
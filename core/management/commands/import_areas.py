@@ -0,0 +1,39 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.importer import AreaFileError, AreaImporter, AreaReader
+
+
+class Command(BaseCommand):
+    args = '<area file> [area file ...]'
+    help = 'Imports TFC .are files.'
+    option_list = BaseCommand.option_list + (
+        make_option('--replace', action='store_true', dest='replace', default=False,
+            help='Replace areas that already exist instead of skipping them.'),
+        make_option('--author', dest='author', default=None,
+            help='Username to make the author of the imported areas, instead of the one in each file.'),
+        )
+
+    def handle(self, *args, **options):
+        if not args:
+            raise CommandError('Usage: import_areas %s' % (self.args))
+        importer = AreaImporter(replace=options['replace'], author=options['author'])
+        failed = 0
+        for path in args:
+            try:
+                with open(path) as area_file:
+                    record = AreaReader(area_file, path).read()
+                area = importer.create(record)
+            except (AreaFileError, IOError) as e:
+                failed += 1
+                self.stderr.write('Skipped %s: %s\n' % (path, e))
+                continue
+            self.stdout.write('Imported %s (%d): %d rooms, %d mobiles, %d objects\n' % (
+                area.name.encode('utf-8'), area.vnum, len(record.get('rooms', [])),
+                len(record.get('mobiles', [])), len(record.get('objects', []))))
+        importer.finish()
+        for warning in importer.warnings:
+            self.stderr.write('Warning: %s\n' % (warning.encode('utf-8')))
+        if failed:
+            raise CommandError('%d of %d areas could not be imported.' % (failed, len(args)))
@@ -0,0 +1,26 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.lint import ERROR, lint_world
+from core.models import Area
+
+
+class Command(BaseCommand):
+    args = '[area vnum ...]'
+    help = 'Checks areas for problems before they go to the game server.'
+    option_list = BaseCommand.option_list + (
+        make_option('-p', '--processes', dest='processes', type='int', default=None,
+            help='Number of worker processes (default: one per CPU).'),
+        )
+
+    def handle(self, *args, **options):
+        areas = Area.objects.all()
+        if args:
+            areas = areas.filter(vnum__in=args)
+        diagnostics = lint_world(areas, processes=options['processes'])
+        for diagnostic in diagnostics:
+            self.stdout.write((u'%s\n' % (unicode(diagnostic))).encode('utf-8'))
+        errors = len([diagnostic for diagnostic in diagnostics if diagnostic.level == ERROR])
+        if errors:
+            raise CommandError('%d errors, %d warnings.' % (errors, len(diagnostics) - errors))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from core.models import FLAG_FIELDS, Item, update_flag_vectors
+from core.signals import rows_updated
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the flag bit vectors from the many-to-many flag rows.'
+
+    def handle(self, *args, **options):
+        for model, name in FLAG_FIELDS:
+            field = '%s_vector' % (name)
+            vectors = dict(model._base_manager.values_list('pk', field))
+            changed = [pk for pk, vector in update_flag_vectors(model, name, list(vectors)).items()
+                       if vector != vectors[pk]]
+            if changed:
+                fields = [field] + (['type_values'] if issubclass(model, Item) else [])
+                rows_updated.send(sender=model, pks=changed, fields=fields)
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from core.models import Item
+from core.signals import rows_updated
+
+
+class Command(BaseCommand):
+    args = '[area vnum ...]'
+    help = 'Recomputes the packed item type and values line stored on each Item.'
+
+    def handle(self, *args, **options):
+        items = Item.objects.all()
+        if args:
+            items = items.filter(area__vnum__in=args)
+        changed = Item.objects.pack(items)
+        if changed:
+            rows_updated.send(sender=Item, pks=changed, fields=['item_type', 'type_values'])
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import Area
+from core.search import create_index, enabled, index_area, rebuild_index
+
+
+class Command(BaseCommand):
+    args = '[area vnum ...]'
+    help = 'Indexes the text of every area (or just the given areas) for search.'
+
+    def handle(self, *args, **options):
+        if not enabled():
+            raise CommandError('Search needs an SQLite database.')
+        create_index()
+        if args:
+            for area in Area.objects.filter(vnum__in=args):
+                index_area(area.pk)
+        else:
+            rebuild_index()
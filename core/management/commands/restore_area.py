@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import AreaVersion
+from core.snapshots import restore_version
+
+
+class Command(BaseCommand):
+    args = '<area vnum> <version>'
+    help = 'Replaces an area with one of its stored versions.'
+
+    def handle(self, *args, **options):
+        if len(args) != 2:
+            raise CommandError('Usage: restore_area %s' % (self.args))
+        try:
+            version = AreaVersion.objects.get(vnum=args[0], number=args[1])
+        except (AreaVersion.DoesNotExist, ValueError):
+            raise CommandError('Area %s has no version %s.' % tuple(args))
+        restore_version(version)
+        self.stdout.write('Restored %s.\n' % (unicode(version).encode('utf-8')))
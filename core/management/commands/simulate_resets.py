@@ -0,0 +1,53 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import Area, Item, Mobile, Room
+from core.simulate import ResetSimulator
+
+
+class Command(BaseCommand):
+    args = '<area vnum>'
+    help = 'Simulates reset cycles of an area and prints what it holds afterwards.'
+    option_list = BaseCommand.option_list + (
+        make_option('-c', '--cycles', dest='cycles', type='int', default=100,
+            help='Number of reset cycles to run (default 100).'),
+        make_option('--occupied-every', dest='occupied_every', type='int', default=0,
+            help='Players are in the area every Nth cycle (default never).'),
+        make_option('--attrition', dest='attrition', type='float', default=0.0,
+            help='Chance that players kill each mob or take each item in an occupied cycle.'),
+        make_option('--seed', dest='seed', type='int', default=None,
+            help='Random seed, for repeatable runs.'),
+        )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Usage: simulate_resets %s' % (self.args))
+        try:
+            area = Area.objects.get(vnum=args[0])
+        except (Area.DoesNotExist, ValueError):
+            raise CommandError('No area with vnum %s.' % (args[0]))
+
+        cycles = options['cycles']
+        every = options['occupied_every']
+        occupied = range(every - 1, cycles, every) if every else ()
+        simulator = ResetSimulator(area)
+        simulator.run(cycles, occupied=occupied, attrition=options['attrition'], seed=options['seed'])
+
+        rooms = dict(Room.objects.filter(area=area).values_list('pk', 'vnum'))
+        mobiles = dict(Mobile.objects.filter(pk__in=simulator.mobiles).values_list('pk', 'vnum'))
+        items = dict(Item.objects.filter(pk__in=simulator.items).values_list('pk', 'vnum'))
+        populations = simulator.populations()
+        room_items = simulator.room_items()
+        lines = ['After %d cycles:' % (cycles)]
+        for room in sorted(set(populations) | set(room_items), key=rooms.get):
+            contents = ['mob %d x%d' % (mobiles[pk], n) for pk, n in sorted(populations.get(room, {}).items())]
+            contents += ['obj %d x%d' % (items[pk], n) for pk, n in sorted(room_items.get(room, {}).items())]
+            lines.append('  room %d: %s' % (rooms[room], ', '.join(contents)))
+        for container, contents in sorted(simulator.container_items().items()):
+            lines.append('  in obj %d: %s' % (items[container], ', '.join(
+                'obj %d x%d' % (items[pk], n) for pk, n in sorted(contents.items()))))
+        for model, pk, first, times in simulator.cap_hits():
+            lines.append('%s %s hit total_in_game %d times, first in cycle %d' % (
+                model._meta.verbose_name, pk if pk is not None else '(shop stock)', times, first))
+        self.stdout.write('\n'.join(lines) + '\n')
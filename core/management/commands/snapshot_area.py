@@ -0,0 +1,26 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import Area
+from core.snapshots import take_snapshot
+
+
+class Command(BaseCommand):
+    args = '<area vnum> [<area vnum> ...]'
+    help = 'Stores the current version of each area, for later export, diffs or restores.'
+    option_list = BaseCommand.option_list + (
+        make_option('-m', '--comment', dest='comment', default='',
+            help='Note to keep with the versions, such as who approved them.'),
+        )
+
+    def handle(self, *args, **options):
+        if not args:
+            raise CommandError('Usage: snapshot_area %s' % (self.args))
+        for vnum in args:
+            try:
+                area = Area.objects.get(vnum=vnum)
+            except (Area.DoesNotExist, ValueError):
+                raise CommandError('No area with vnum %s.' % (vnum))
+            version = take_snapshot(area, options['comment'])
+            self.stdout.write('%s\n' % (unicode(version).encode('utf-8')))
@@ -1,14 +1,110 @@
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import connection, models
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
 
 from core.lists import (
     ALIGNMENT_CHOICES,
     DIRECTION_CHOICES,
     DOOR_RESET_CHOICES,
     DOOR_TRIGGER_TYPE_CHOICES,
+    ITEM_TYPE_CLASSES,
     SEX_CHOICES,
     WEAPON_TYPE_CHOICES,
     )
+from core.bulk import chunked
+from core.registry import invalidate as invalidate_registry, lookup, registry
+from core.signals import connect_handlers, rows_updated
+
+
+# Each area owns this many vnums, starting at its own.
+VNUMS_PER_AREA = getattr(settings, 'VNUMS_PER_AREA', 100)
+
+
+def flag_vector(flags):
+    """
+    Packs flag rows into the bit vector the game stores, using each flag's
+    TFC_id as its bit position.
+    """
+    vector = 0
+    for flag in flags:
+        vector |= 1 << flag.TFC_id
+    return vector
+
+
+def flag_bits(vector):
+    """
+    The inverse of flag_vector(): the TFC_ids of the bits set in a vector.
+    """
+    return [bit for bit in range(vector.bit_length()) if vector & (1 << bit)]
+
+
+class FlagQuerySet(models.query.QuerySet):
+    def flagged(self, field, has=(), lacks=()):
+        """
+        Rows whose ``field`` flags include all of ``has`` and none of
+        ``lacks``, tested with bitwise SQL on the field's vector column.
+        Flags can be given as rows or by name, e.g.
+
+            Mobile.objects.flagged('action_flags', has=['aggressive'], lacks=['sentinel'])
+        """
+        table = registry()[self.model._meta.get_field(field).rel.to]
+        column = '%s.%s' % (connection.ops.quote_name(self.model._meta.db_table),
+                            connection.ops.quote_name('%s_vector' % (field)))
+        def mask(flags):
+            return flag_vector([table.by_name(flag) if isinstance(flag, basestring) else flag for flag in flags])
+        where, params = [], []
+        if has:
+            where.append('(%s & %%s) = %%s' % (column))
+            params.extend([mask(has), mask(has)])
+        if lacks:
+            where.append('(%s & %%s) = 0' % (column))
+            params.append(mask(lacks))
+        return self.extra(where=where, params=params)
+
+
+class FlagManager(models.Manager):
+    """
+    Manager for models whose many-to-many flags are also kept as bit vectors.
+    """
+    def get_query_set(self):
+        return FlagQuerySet(self.model, using=self._db)
+
+    def flagged(self, *args, **kwargs):
+        return self.get_query_set().flagged(*args, **kwargs)
+
+
+class ConflictError(Exception):
+    """
+    Raised when saving a row that was changed or deleted by someone else
+    since it was read.
+    """
+    pass
+
+
+class VersionedModel(models.Model):
+    """
+    A model whose rows count their saves in ``row_version``. Saving an
+    existing row checks that its version is still the one read, raising
+    ConflictError if another save got there first, so two builders editing
+    the same row can't silently overwrite each other.
+    """
+    row_version = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if self.pk is not None and not self._state.adding and not kwargs.get('force_insert'):
+            # Claims the next version in the same transaction as the save.
+            owner = self._meta.get_field('row_version').model
+            claimed = owner._base_manager.filter(pk=self.pk, row_version=self.row_version).update(
+                row_version=self.row_version + 1)
+            if not claimed:
+                raise ConflictError('%s %s was changed or deleted by someone else since it was read.' % (
+                    self._meta.verbose_name, self))
+            self.row_version += 1
+        super(VersionedModel, self).save(*args, **kwargs)
 
 
 ### Area models ###
@@ -34,9 +130,26 @@ class Area(models.Model):
     level_low = models.PositiveSmallIntegerField(blank=False, default=1)
     level_high = models.PositiveSmallIntegerField(blank=False, default=50)
     flags = models.ManyToManyField(AreaFlag)
+    flags_vector = models.BigIntegerField(db_index=True, default=0, editable=False)
 
     notes = models.TextField()
 
+    objects = FlagManager()
+
+    def vnum_range(self):
+        """
+        The lowest and highest vnums the area's mobs, items and rooms may use.
+        """
+        return self.vnum, self.vnum + VNUMS_PER_AREA - 1
+
+    def clone(self, vnum, name, author):
+        """
+        Copies this area and everything in it to a new area numbered
+        ``vnum`` (see core.clone).
+        """
+        from core.clone import clone_area
+        return clone_area(self, vnum, name, author)
+
 
 class AreaHelp(models.Model):
     """
@@ -52,7 +165,6 @@ class AreaHelp(models.Model):
 
 
 ### Item models ###
-# TODO: fill out the write_values() defs for each item type. use adv string formatting!
 # TODO: write tests to ensure that the item type ids are correct and all t
 class Spell(models.Model):
     """
@@ -152,7 +264,54 @@ class ItemModifier(models.Model):
 ### area builder. This could all be cleaned up with some Class Factory
 ### magic (which would also make Item Types dynamically editable), but that
 ### is going to have to be on the wishlist for now.
-class Item(models.Model):
+###
+### In the meantime every concrete item also copies its type id and its
+### packed values line onto the Item row when saved, so listing or exporting
+### items only ever needs the Item table. The child tables are still where
+### the type-specific fields are edited.
+class ItemManager(models.Manager):
+    def typed(self, items):
+        """
+        Returns the concrete (Light, Weapon, ...) instance for each of the
+        given items, in the same order, with one query per item type present.
+        """
+        items = list(items)
+        pks_by_type = {}
+        for item in items:
+            pks_by_type.setdefault(item.item_type, []).append(item.pk)
+        typed = {}
+        for item_type, pks in pks_by_type.items():
+            typed.update(ITEM_CLASSES[item_type].objects.in_bulk(pks))
+        return [typed[item.pk] for item in items]
+
+    def pack(self, queryset=None):
+        """
+        Recomputes item_type and type_values for every concrete item in
+        ``queryset`` (all items by default), for rows saved before they
+        existed or whose lookup rows have since changed. A queryset of one
+        item type only looks at that type's table. Returns the pks of the
+        items whose packed columns changed, the only ones written.
+        """
+        if queryset is None:
+            queryset = self.all()
+        item_classes = ITEM_CLASSES.values()
+        if queryset.model in item_classes:
+            item_classes = [queryset.model]
+        changed = []
+        for item_class in item_classes:
+            # Lookup rows come from the registry, so only join the others.
+            related = [field.name for field in item_class._meta.fields
+                       if field.rel and field.rel.to not in LOOKUP_MODELS + (Area,) and not field.rel.parent_link]
+            m2m = [field.name for field in item_class._meta.many_to_many]
+            children = (item_class.objects.filter(pk__in=queryset.values('pk'))
+                        .select_related(*related).prefetch_related(*m2m))
+            for item in children:
+                if item.update_packed():
+                    changed.append(item.pk)
+        return changed
+
+
+class Item(VersionedModel):
     """
     An item that lives in a TFC Area.
 
@@ -186,35 +345,106 @@ class Item(models.Model):
 
     notes = models.TextField()
 
+    # Filled in from the concrete item type by pack().
+    item_type = models.PositiveSmallIntegerField(db_index=True, default=0, editable=False)
+    type_values = models.CharField(max_length=100, blank=True, editable=False)
+
+    # Set by each concrete item type.
+    TFC_item_type = None
+
+    objects = ItemManager()
+
     class Meta:
         unique_together = ('area', 'vnum')
 
+    def __unicode__(self):
+        return u'%d %s' % (self.vnum, self.short_desc)
+
+    def pack(self):
+        """
+        Copies this item's type id and values line onto the Item row.
+        """
+        self.item_type = self.TFC_item_type
+        self.type_values = self.write_values()
+
+    def update_packed(self):
+        """
+        Packs the item and writes just the packed columns back, if they
+        changed. Returns whether they did.
+        """
+        packed = (self.item_type, self.type_values)
+        self.pack()
+        if (self.item_type, self.type_values) == packed:
+            return False
+        Item.objects.filter(pk=self.pk).update(item_type=self.item_type, type_values=self.type_values)
+        return True
+
+    def save(self, *args, **kwargs):
+        if self.TFC_item_type is None:
+            return super(Item, self).save(*args, **kwargs)
+        # Many-to-many values can't be read until the item has a pk, so new
+        # items with spells or flags are packed once they've been inserted.
+        # pack_item_m2m and update_flag_vectors() keep them up to date
+        # after that.
+        deferred = self.pk is None and bool(self._meta.many_to_many)
+        if deferred:
+            self.item_type = self.TFC_item_type
+        else:
+            self.pack()
+        super(Item, self).save(*args, **kwargs)
+        if deferred:
+            self.update_packed()
+
+    def typed(self):
+        """
+        Returns the concrete item (Light, Weapon, ...) this row belongs to.
+        """
+        return ITEM_CLASSES[self.item_type].objects.get(pk=self.pk)
+
+    def read_values(self, values, lookups):
+        """
+        The inverse of write_values(): sets this item's fields from the four
+        numbers of a values line. Many-to-many fields can't be set until the
+        item is saved, so their pks are returned as {field name: [pks]}.
+        """
+        return {}
+
 
 class Light(Item):
     """
     An item of the Light type.
     """
-    item_type = 1
+    TFC_item_type = 1
     hours = models.SmallIntegerField(blank=False, default=0, help_text="Number of hours of light. Use -1 for infinite and 0 for dead.")
 
     def write_values(self):
         """
-        Prints out the values needed for a zone file.
+        Returns the values line needed for a zone file.
         """
-        print "0 0 %d 0" % (hours)
+        return "0 0 %d 0" % (self.hours)
+
+    def read_values(self, values, lookups):
+        self.hours = values[2]
+        return {}
 
 
 class Fountain(Item):
     """
     A fountain item.
     """
-    item_type = 25
+    TFC_item_type = 25
     spell = models.ForeignKey(Spell, blank=False)
     spell_level = models.PositiveSmallIntegerField(blank=False)
     drink_type = models.ForeignKey(DrinkType, blank=False)
 
     def write_values(self):
-        pass
+        return "%d %d %d 0" % (self.spell_level, lookup(Spell, self.spell_id).TFC_id, lookup(DrinkType, self.drink_type_id).TFC_id)
+
+    def read_values(self, values, lookups):
+        self.spell_level = values[0]
+        self.spell_id = lookups.pk(Spell, values[1])
+        self.drink_type_id = lookups.pk(DrinkType, values[2])
+        return {}
 
     
 class BaseWeapon(Item):
@@ -228,6 +458,12 @@ class BaseWeapon(Item):
     class Meta:
         abstract = True
 
+    def read_values(self, values, lookups):
+        self.minimum_damage = values[1]
+        self.maximum_damage = values[2]
+        self.weapon_damage_type_id = lookups.pk(WeaponDamageType, values[3])
+        return {}
+
 
 class BaseArmor(Item):
     """
@@ -238,6 +474,10 @@ class BaseArmor(Item):
     class Meta:
         abstract = True
 
+    def read_values(self, values, lookups):
+        self.ac_rating = values[0]
+        return {}
+
 
 class BaseFood(Item):
     """
@@ -249,6 +489,11 @@ class BaseFood(Item):
     class Meta:
         abstract = True
 
+    def read_values(self, values, lookups):
+        self.hours = values[0]
+        self.poison = values[3]
+        return {}
+
 
 class SimpleMagicalItem(Item):
     """
@@ -259,7 +504,19 @@ class SimpleMagicalItem(Item):
 
     class Meta:
         abstract = True
-        
+
+    def write_spell_values(self):
+        """
+        Level followed by three spell slots; empty slots are written as -1.
+        """
+        spells = [spell.TFC_id for spell in self.spells.all()][:3]
+        spells += [-1] * (3 - len(spells))
+        return "%d %d %d %d" % tuple([self.spell_level] + spells)
+
+    def read_values(self, values, lookups):
+        self.spell_level = values[0]
+        return {'spells': [lookups.pk(Spell, spell) for spell in values[1:] if spell != -1]}
+
 
 class ChargedMagicalItem(Item):
     """
@@ -273,32 +530,40 @@ class ChargedMagicalItem(Item):
     class Meta:
         abstract = True
 
+    def write_charge_values(self):
+        return "%d %d %d %d" % (self.spell_level, self.max_charges, self.remaining_charges, lookup(Spell, self.spell_id).TFC_id)
+
+    def read_values(self, values, lookups):
+        self.spell_level, self.max_charges, self.remaining_charges = values[:3]
+        self.spell_id = lookups.pk(Spell, values[3])
+        return {}
+
 
 class Weapon(BaseWeapon):
-    item_type = 5
+    TFC_item_type = 5
 
     def write_values(self):
-        pass
+        return "0 %d %d %d" % (self.minimum_damage, self.maximum_damage, lookup(WeaponDamageType, self.weapon_damage_type_id).TFC_id)
 
 
 class AnimalWeapon(BaseWeapon):
     """
     A weapon derived from an animal (e.g. a scorpion's stinger).)
     """
-    item_type = 6
+    TFC_item_type = 6
 
     def write_values(self):
-        pass
+        return "0 %d %d %d" % (self.minimum_damage, self.maximum_damage, lookup(WeaponDamageType, self.weapon_damage_type_id).TFC_id)
 
     class Meta:
         verbose_name = 'animal-based weapon'
 
 
 class Armor(BaseArmor):
-    item_type = 9
+    TFC_item_type = 9
 
     def write_values(self):
-        pass
+        return "%d 0 0 0" % (self.ac_rating)
 
     class Meta:
         verbose_name = 'armor item'
@@ -309,95 +574,95 @@ class AnimalArmor(BaseArmor):
     Armor derived from an animal. Mobs that have no_wear_armor
     can still wear animal armor.
     """
-    item_type = 14
+    TFC_item_type = 14
 
     def write_values(self):
-        pass
+        return "%d 0 0 0" % (self.ac_rating)
 
     class Meta:
         verbose_name = 'animal-based armor item'
 
 
 class Food(BaseFood):
-    item_type = 19
+    TFC_item_type = 19
 
     def write_values(self):
-        pass
+        return "%d 0 0 %d" % (self.hours, self.poison)
 
     class Meta:
         verbose_name = 'food item'
 
 
 class PetFood(BaseFood):
-    item_type = 11
+    TFC_item_type = 11
 
     def write_values(self):
-        pass
+        return "%d 0 0 %d" % (self.hours, self.poison)
 
     class Meta:
         verbose_name = 'pet food item'
 
 
 class Scroll(SimpleMagicalItem):
-    item_type = 2
+    TFC_item_type = 2
 
     def write_values(self):
-        pass
+        return self.write_spell_values()
 
 
 class Potion(SimpleMagicalItem):
-    item_type = 10
+    TFC_item_type = 10
 
     def write_values(self):
-        pass
+        return self.write_spell_values()
 
 
 class Pill(SimpleMagicalItem):
-    item_type = 26
+    TFC_item_type = 26
 
     def write_values(self):
-        pass
+        return self.write_spell_values()
 
 
 class Wand(ChargedMagicalItem):
-    item_type = 3
+    TFC_item_type = 3
 
     def write_values(self):
-        pass
+        return self.write_charge_values()
 
 
 class Staff(ChargedMagicalItem):
-    item_type = 4
+    TFC_item_type = 4
 
     def write_values(self):
-        pass
+        return self.write_charge_values()
 
     class Meta:
         verbose_name_plural = 'staves'
 
 
 class Fetish(ChargedMagicalItem):
-    item_type = 7
+    TFC_item_type = 7
 
     def write_values(self):
-        pass
+        return self.write_charge_values()
 
     class Meta:
         verbose_name_plural = 'fetishes'
 
 
 class Ring(ChargedMagicalItem):
-    item_type = 29
+    TFC_item_type = 29
 
     def write_values(self):
-        pass
+        return self.write_charge_values()
 
 
 class Relic(ChargedMagicalItem):
-    item_type = 33
+    TFC_item_type = 33
 
     def write_values(self):
-        pass
+        return self.write_charge_values()
 
 
 class NonMagicalItem(Item):
@@ -406,63 +671,63 @@ class NonMagicalItem(Item):
 
 
 class Treasure(NonMagicalItem):
-    item_type = 8
+    TFC_item_type = 8
 
     def write_values(self):
-        pass
+        return "0 0 0 0"
 
     class Meta:
         verbose_name = 'treasure item'
 
 
 class Furniture(NonMagicalItem):
-    item_type = 12
+    TFC_item_type = 12
 
     def write_values(self):
-        pass
+        return "0 0 0 0"
 
     class Meta:
         verbose_name = 'furniture item'
 
 
 class Trash(NonMagicalItem):
-    item_type = 13
+    TFC_item_type = 13
     # Shopkeepers don't sell Trash. Sorry.
     salable = False
 
     def write_values(self):
-        pass
+        return "0 0 0 0"
 
     class Meta:
         verbose_name = 'trash item'
 
 
 class Key(NonMagicalItem):
-    item_type = 18
+    TFC_item_type = 18
 
     def write_values(self):
-        pass
+        return "0 0 0 0"
 
 
 class Boat(NonMagicalItem):
-    item_type = 22
+    TFC_item_type = 22
 
     def write_values(self):
-        pass
+        return "0 0 0 0"
 
 
 class Decoration(NonMagicalItem):
-    item_type = 27
+    TFC_item_type = 27
 
     def write_values(self):
-        pass
+        return "0 0 0 0"
 
 
 class Jewelry(NonMagicalItem):
-    item_type = 30
+    TFC_item_type = 30
 
     def write_values(self):
-        pass
+        return "0 0 0 0"
 
     class Meta:
         verbose_name = 'jewelry item'
@@ -472,26 +737,42 @@ class DrinkContainer(Item):
     """
     An item that can contain liquids.
     """
-    item_type = 17
+    TFC_item_type = 17
     capacity = models.SmallIntegerField(blank=False, help_text="Capacity of this drink container.")
     remaining = models.SmallIntegerField(blank=False, help_text="Amount remaining in the container.")
     drink_type = models.ForeignKey(DrinkType, blank=False)
     poison = models.SmallIntegerField(blank=False, default=0, help_text="0 is non-poisonous, non-zero is poisonous.")
 
     def write_values(self):
-        pass
+        return "%d %d %d %d" % (self.capacity, self.remaining, lookup(DrinkType, self.drink_type_id).TFC_id, self.poison)
+
+    def read_values(self, values, lookups):
+        self.capacity, self.remaining = values[:2]
+        self.drink_type_id = lookups.pk(DrinkType, values[2])
+        self.poison = values[3]
+        return {}
 
 
 class Container(Item):
     """
     An item that can contain other non-liquid items.
     """
-    item_type = 15
-    key = models.ForeignKey(Key, blank=True)
+    TFC_item_type = 15
+    key = models.ForeignKey(Key, blank=True, null=True)
     flags = models.ManyToManyField('ContainerFlag')
+    flags_vector = models.BigIntegerField(db_index=True, default=0, editable=False)
+
+    objects = FlagManager()
 
     def write_values(self):
-        pass
+        key_vnum = self.key.vnum if self.key_id else -1
+        return "%d %d %d 0" % (self.weight, self.flags_vector, key_vnum)
+
+    def read_values(self, values, lookups):
+        self.weight = values[0]
+        self.flags_vector = values[1]
+        self.key_id = lookups.item_pk(values[2]) if values[2] != -1 else None
+        return {'flags': [lookups.pk(ContainerFlag, bit) for bit in flag_bits(values[1])]}
 
 
 class ItemContainerReset(models.Model):
@@ -512,17 +793,50 @@ class ItemContainerReset(models.Model):
 
 
 class Money(Item):
-    item_type = 20
+    TFC_item_type = 20
     number_of_coins = models.SmallIntegerField(blank=False, default=1, help_text="How many coins is this money worth?")
 
     def write_values(self):
-        pass
+        return "%d 0 0 0" % (self.number_of_coins)
+
+    def read_values(self, values, lookups):
+        self.number_of_coins = values[0]
+        return {}
 
     class Meta:
         verbose_name = 'pile of money'
         verbose_name_plural = 'piles of money'
 
 
+# Concrete item classes by their TFC item type.
+ITEM_CLASSES = dict((cls.TFC_item_type, cls) for cls in [globals()[name] for name in ITEM_TYPE_CLASSES])
+
+
+def pack_item_m2m(sender, instance, action, reverse, **kwargs):
+    """
+    Re-packs an item's values line once its spells change.
+    """
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        # A spell was given to (or taken from) a set of items.
+        if kwargs['pk_set']:
+            Item.objects.pack(Item.objects.filter(pk__in=kwargs['pk_set']))
+        return
+    instance.update_packed()
+
+
+def pack_key_containers(sender, instance, created, **kwargs):
+    """
+    Re-packs the containers a key opens, whose values lines print its vnum.
+    """
+    if created:
+        return
+    changed = Item.objects.pack(Container.objects.filter(key=instance.pk))
+    if changed:
+        rows_updated.send(sender=Container, pks=changed, fields=['type_values'])
+
+
 ### Mobile models
 class Race(models.Model):
     """
@@ -583,7 +897,7 @@ class SpecialFunction(models.Model):
     generic = models.BooleanField(blank=False, default=True)
 
 
-class Mobile(models.Model):
+class Mobile(VersionedModel):
     """
     A creature that can move around and do stuff, but isn't human.
 
@@ -601,10 +915,12 @@ class Mobile(models.Model):
     alignment = models.PositiveSmallIntegerField(choices=ALIGNMENT_CHOICES)
     sex = models.SmallIntegerField(choices=SEX_CHOICES)
     is_animal = models.BooleanField(default=False, help_text="Is this Mob an animal?")
-    spell = models.ForeignKey(Spell, blank=True, help_text="What spell (if any) does this Mob know?")
+    spell = models.ForeignKey(Spell, blank=True, null=True, help_text="What spell (if any) does this Mob know?")
 
     affect_flags = models.ManyToManyField(AffectFlag)
+    affect_flags_vector = models.BigIntegerField(db_index=True, default=0, editable=False)
     action_flags = models.ManyToManyField(ActionFlag)
+    action_flags_vector = models.BigIntegerField(db_index=True, default=0, editable=False)
     no_wear = models.BooleanField(default=False, help_text="Should this Mob be allowed to wear armor (animal armor excluded)?")
     special_functions = models.ManyToManyField(SpecialFunction, blank=True)
 
@@ -615,9 +931,14 @@ class Mobile(models.Model):
 
     notes = models.TextField()
 
+    objects = FlagManager()
+
     class Meta:
         unique_together = ('area', 'vnum')
 
+    def __unicode__(self):
+        return u'%d %s' % (self.vnum, self.short_desc)
+
 
 class Shopkeeper(models.Model):
     """
@@ -663,7 +984,7 @@ class MobItemReset(models.Model):
     item = models.ForeignKey(Item, blank=False, related_name='mob_resets')
     mobile = models.ForeignKey(Mobile, blank=False, related_name='item_resets')
     reset_every_cycle = models.BooleanField(blank=False, default=False, help_text="Reset this item every cycle (instead of only when zone is deserted)?")
-    wear_location = models.ForeignKey(ResetWearFlag, blank=True, help_text="Optional: Where (if anywhere) do you want the Mob to equip this item?")
+    wear_location = models.ForeignKey(ResetWearFlag, blank=True, null=True, help_text="Optional: Where (if anywhere) do you want the Mob to equip this item?")
     comment = models.TextField(blank=True)
 
     class Meta:
@@ -702,7 +1023,7 @@ class RoomSpecialFunction(models.Model):
     description = models.TextField()   
 
 
-class Room(models.Model):
+class Room(VersionedModel):
     """
     A room in TFC Area.
 
@@ -718,6 +1039,9 @@ class Room(models.Model):
     class Meta:
         unique_together = ('area', 'vnum')
 
+    def __unicode__(self):
+        return u'%d' % (self.vnum)
+
 
 class ItemRoomReset(models.Model):
     """
@@ -757,7 +1081,11 @@ class DoorType(models.Model):
     description = models.TextField()
 
 
-class Door(models.Model):
+# Door.direction is stored as a string, so its choices' keys must be too.
+DOOR_DIRECTION_CHOICES = tuple((unicode(n), label) for n, label in DIRECTION_CHOICES)
+
+
+class Door(VersionedModel):
     """
     A door leading out of a room. A room can have up to six doors, one in each direction.
 
@@ -766,19 +1094,271 @@ class Door(models.Model):
     """
     room = models.ForeignKey(Room, blank=False, related_name='exits')
     name = models.CharField(max_length=50, blank=False, help_text='A one-word description of the door (e.g. "door" or "gate")')
-    direction = models.CharField(max_length=1, blank=False, choices=DIRECTION_CHOICES)
+    direction = models.CharField(max_length=1, blank=False, choices=DOOR_DIRECTION_CHOICES)
     door_type = models.ForeignKey(DoorType, blank=False)
     keywords = models.TextField(blank=False, help_text='Keywords for interacting with the door.')
 
     description = models.TextField(blank=True)
-    room_to = models.ForeignKey(Room, blank=True, related_name='entrances')
+    room_to = models.ForeignKey(Room, blank=True, null=True, related_name='entrances')
 
     reset = models.BooleanField(blank=False, default=False, help_text="Should this door be reset?")
     reset_every_cycle = models.BooleanField(blank=False, default=False, help_text="Reset this door every cycle (instead of only when deserted)?")
-    reset_value = models.SmallIntegerField(blank=True, choices=DOOR_RESET_CHOICES)
+    reset_value = models.SmallIntegerField(blank=True, null=True, choices=DOOR_RESET_CHOICES)
     reset_comment = models.TextField(blank=True)
 
     notes = models.TextField()
 
     class Meta:
         unique_together = ('room', 'direction')
+
+    def __unicode__(self):
+        return u'%s exit of %s' % (self.get_direction_display(), self.room)
+
+
+### Version models ###
+class SnapshotBlob(models.Model):
+    """
+    A piece of an area's export, stored once however many versions share
+    it, under the SHA-1 of its text. ``data`` is the text compressed with
+    zlib and base64 encoded (see core.snapshots).
+    """
+    digest = models.CharField(max_length=40, primary_key=True)
+    data = models.TextField()
+    size = models.PositiveIntegerField(help_text='Length of the text before compression.')
+
+
+class AreaVersion(models.Model):
+    """
+    A stored version of an area's export, kept for rollback and audit.
+    ``manifest`` names the blob listing the digests of the version's pieces
+    in file order. Versions outlive their area, so they also record its
+    vnum and name.
+    """
+    area = models.ForeignKey(Area, blank=True, null=True, on_delete=models.SET_NULL, related_name='versions')
+    vnum = models.PositiveIntegerField()
+    name = models.TextField()
+    number = models.PositiveIntegerField()
+    created = models.DateTimeField(auto_now_add=True)
+    comment = models.TextField(blank=True)
+    manifest = models.ForeignKey(SnapshotBlob)
+
+    class Meta:
+        unique_together = ('vnum', 'number')
+        ordering = ('vnum', 'number')
+
+    def __unicode__(self):
+        return u'%s, version %d' % (self.name, self.number)
+
+
+### Change tracking ###
+class AreaRevision(models.Model):
+    """
+    Counts the changes to an area's rooms, exits, mobs, items and resets
+    (see core.api). Changes before ``floor`` were made without being
+    logged, so can't be sent as a delta.
+    """
+    area = models.OneToOneField(Area, primary_key=True, related_name='revision')
+    number = models.PositiveIntegerField(default=0)
+    floor = models.PositiveIntegerField(default=0)
+
+
+class AreaChange(models.Model):
+    """
+    The latest revision of an area in which a row changed, by kind and pk.
+    """
+    area = models.ForeignKey(Area, related_name='changes')
+    kind = models.CharField(max_length=30)
+    object_pk = models.PositiveIntegerField()
+    revision = models.PositiveIntegerField(db_index=True)
+
+    class Meta:
+        unique_together = ('area', 'kind', 'object_pk')
+
+
+# The small, rarely edited tables that rows refer to by TFC_id. These are
+# served from core.registry rather than queried.
+LOOKUP_MODELS = (
+    AreaFlag,
+    Spell,
+    WeaponDamageType,
+    DrinkType,
+    ContainerFlag,
+    ItemType,
+    WearFlag,
+    ResetWearFlag,
+    ItemExtraFlag,
+    ItemModifier,
+    Race,
+    KnownLanguage,
+    PreferredLanguage,
+    ActionFlag,
+    AffectFlag,
+    SpecialFunction,
+    RoomType,
+    RoomFlag,
+    RoomSpecialFunction,
+    DoorType,
+    )
+
+
+### Flag vectors ###
+# Many-to-many flag fields that are also stored as a bit vector, in a
+# <field>_vector column, so they can be exported and filtered without a join.
+FLAG_FIELDS = (
+    (Area, 'flags'),
+    (Mobile, 'action_flags'),
+    (Mobile, 'affect_flags'),
+    (Container, 'flags'),
+    )
+
+
+def update_flag_vectors(model, name, pks):
+    """
+    Recomputes the ``name`` vector of the given ``model`` rows from their
+    many-to-many rows. Returns the new vectors by pk.
+    """
+    field = model._meta.get_field(name)
+    source, target = field.m2m_field_name(), field.m2m_reverse_field_name()
+    table = registry()[field.rel.to]
+    vectors = {}
+    for chunk in chunked(pks, 500):
+        vectors.update((pk, 0) for pk in chunk)
+        rows = field.rel.through.objects.filter(**{'%s__in' % (source): chunk}).values_list(source, target)
+        for owner, flag in rows:
+            vectors[owner] |= 1 << table.get(flag).TFC_id
+    by_vector = {}
+    for pk, vector in vectors.items():
+        by_vector.setdefault(vector, []).append(pk)
+    for vector, owners in by_vector.items():
+        for chunk in chunked(owners, 500):
+            model._base_manager.filter(pk__in=chunk).update(**{'%s_vector' % (name): vector})
+    if issubclass(model, Item):
+        # The update sent no signals, and values lines print the vector.
+        for chunk in chunked(list(vectors), 500):
+            Item.objects.pack(model.objects.filter(pk__in=chunk))
+    return vectors
+
+
+def flag_owners(model, name, flag):
+    """
+    The pks of the ``model`` rows that have ``flag`` in field ``name``.
+    """
+    field = model._meta.get_field(name)
+    rows = field.rel.through.objects.filter(**{field.m2m_reverse_field_name(): flag})
+    return list(rows.values_list(field.m2m_field_name(), flat=True))
+
+
+def update_flag_m2m(sender, instance, action, reverse, model, pk_set, **kwargs):
+    owner_model, name = FLAG_THROUGH[sender]
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            vectors = update_flag_vectors(owner_model, name, [instance.pk])
+            setattr(instance, '%s_vector' % (name), vectors[instance.pk])
+    elif action == 'pre_clear':
+        # The flag is being taken from every row; note which ones first.
+        instance._cleared_owners = flag_owners(owner_model, name, instance.pk)
+    elif action == 'post_clear':
+        update_flag_vectors(owner_model, name, instance._cleared_owners)
+    elif action in ('post_add', 'post_remove'):
+        update_flag_vectors(owner_model, name, list(pk_set))
+
+
+def lookup_items(model, pk):
+    """
+    The pks of the items whose values lines print lookup row ``pk`` of
+    ``model``.
+    """
+    pks = set()
+    for item_class in ITEM_CLASSES.values():
+        for field in item_class._meta.local_fields + item_class._meta.local_many_to_many:
+            # Flag vectors are re-packed by update_flag_vectors().
+            if field.rel and field.rel.to is model and (item_class, field.name) not in FLAG_FIELDS:
+                pks.update(item_class.objects.filter(**{field.name: pk}).values_list('pk', flat=True))
+    return pks
+
+
+def tfc_id_changed(sender, instance):
+    """
+    Whether a lookup row being saved has a new TFC_id. The registry still
+    has the row as it was before the save.
+    """
+    try:
+        return registry()[sender].get(instance.pk).TFC_id != instance.TFC_id
+    except KeyError:
+        # A new row, which nothing refers to yet.
+        return False
+
+
+def note_lookup_items(sender, instance, **kwargs):
+    # Values lines only change with the row's TFC_id.
+    if kwargs.get('signal') is pre_save and not tfc_id_changed(sender, instance):
+        return
+    instance._lookup_items = lookup_items(sender, instance.pk)
+
+
+def pack_lookup_items(sender, instance, **kwargs):
+    """
+    Re-packs the items whose values lines print a lookup row whose TFC_id
+    was changed, or that was deleted.
+    """
+    changed = []
+    for chunk in chunked(list(getattr(instance, '_lookup_items', ())), 500):
+        changed.extend(Item.objects.pack(Item.objects.filter(pk__in=chunk)))
+    instance._lookup_items = ()
+    if changed:
+        rows_updated.send(sender=Item, pks=changed, fields=['type_values'])
+
+
+def note_flag_owners(sender, instance, **kwargs):
+    # Vectors only change with the flag's TFC_id.
+    if kwargs.get('signal') is pre_save and not tfc_id_changed(sender, instance):
+        return
+    instance._flag_owners = [(model, name, flag_owners(model, name, instance.pk))
+                             for model, name in FLAG_FIELDS if model._meta.get_field(name).rel.to is sender]
+
+
+def update_flag_owners(sender, instance, **kwargs):
+    """
+    Recomputes the vectors of every row with a flag whose TFC_id was edited,
+    or that was deleted.
+    """
+    for model, name, owners in getattr(instance, '_flag_owners', ()):
+        update_flag_vectors(model, name, owners)
+        if owners:
+            fields = ['%s_vector' % (name)] + (['type_values'] if issubclass(model, Item) else [])
+            rows_updated.send(sender=model, pks=owners, fields=fields)
+    instance._flag_owners = ()
+
+FLAG_THROUGH = dict((getattr(model, name).through, (model, name)) for model, name in FLAG_FIELDS)
+
+
+### Signals ###
+for lookup_model in LOOKUP_MODELS:
+    post_save.connect(invalidate_registry, sender=lookup_model)
+    post_delete.connect(invalidate_registry, sender=lookup_model)
+
+for through in FLAG_THROUGH:
+    m2m_changed.connect(update_flag_m2m, sender=through)
+for flag_model in set(model._meta.get_field(name).rel.to for model, name in FLAG_FIELDS):
+    pre_save.connect(note_flag_owners, sender=flag_model)
+    post_save.connect(update_flag_owners, sender=flag_model)
+    pre_delete.connect(note_flag_owners, sender=flag_model)
+    post_delete.connect(update_flag_owners, sender=flag_model)
+
+# Flag fields are packed along with their vectors.
+for item_class in ITEM_CLASSES.values():
+    for field in item_class._meta.many_to_many:
+        if field.rel.through not in FLAG_THROUGH:
+            m2m_changed.connect(pack_item_m2m, sender=field.rel.through)
+# After the registry, which values lines read TFC_ids from.
+for lookup_model in LOOKUP_MODELS:
+    pre_save.connect(note_lookup_items, sender=lookup_model)
+    post_save.connect(pack_lookup_items, sender=lookup_model)
+    pre_delete.connect(note_lookup_items, sender=lookup_model)
+    post_delete.connect(pack_lookup_items, sender=lookup_model)
+post_save.connect(pack_key_containers, sender=Key)
+
+# Keeps cached area exports, pages, map layouts, the search index, the
+# API's change log, the live change feed and the vnum indexes in step with
+# edits, and sets up SQLite connections.
+connect_handlers()
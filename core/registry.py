@@ -0,0 +1,101 @@
+"""
+Process-wide cache of the TFC_id lookup tables.
+
+The lookup tables (flags, spells, languages, types and so on, listed in
+core.models.LOOKUP_MODELS) are small and almost never change, so each
+process loads them all once and serves them from memory. Saving or deleting
+a lookup row changes a version stamp kept in Django's cache, and every
+process reloads the next time it asks for the registry. Deployments with
+more than one process need a cache backend they share for that to reach
+all of them.
+"""
+from uuid import uuid4
+
+from django.core.cache import cache
+
+
+VERSION_KEY = 'registry:version'
+VERSION_TIMEOUT = 60 * 60 * 24 * 30
+
+_registry = None
+
+
+class LookupTable(object):
+    """
+    The rows of one lookup model, by pk, TFC_id and name.
+    """
+    def __init__(self, model, objects):
+        self.model = model
+        self.objects = tuple(objects)
+        self._by_pk = dict((obj.pk, obj) for obj in self.objects)
+        self._by_TFC_id = dict((obj.TFC_id, obj) for obj in self.objects)
+        self._by_name = dict((obj.name, obj) for obj in self.objects)
+
+    def __iter__(self):
+        return iter(self.objects)
+
+    def __len__(self):
+        return len(self.objects)
+
+    def get(self, pk):
+        return self._by_pk[pk]
+
+    def by_TFC_id(self, TFC_id):
+        return self._by_TFC_id[TFC_id]
+
+    def by_name(self, name):
+        return self._by_name[name]
+
+
+class Registry(object):
+    """
+    Every lookup table, loaded at one version.
+    """
+    def __init__(self, version):
+        from core.models import LOOKUP_MODELS
+        self.version = version
+        self.tables = dict((model, LookupTable(model, model.objects.order_by('TFC_id'))) for model in LOOKUP_MODELS)
+
+    def __getitem__(self, model):
+        return self.tables[model]
+
+    def __contains__(self, model):
+        return model in self.tables
+
+
+def current_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Nothing says the tables are unchanged, so start a new version.
+        cache.add(VERSION_KEY, uuid4().hex, VERSION_TIMEOUT)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def registry():
+    """
+    Returns the current Registry, reloading it if a lookup row has changed
+    since it was loaded.
+    """
+    global _registry
+    version = current_version()
+    if _registry is None or _registry.version != version:
+        _registry = Registry(version)
+    return _registry
+
+
+def lookup(model, pk):
+    """
+    Returns the lookup row of ``model`` with primary key ``pk``.
+    """
+    return registry()[model].get(pk)
+
+
+def invalidate(sender=None, **kwargs):
+    """
+    Marks every process's registry stale. Connected to the lookup models'
+    post_save and post_delete signals.
+    """
+    global _registry
+    _registry = None
+    cache.set(VERSION_KEY, uuid4().hex, VERSION_TIMEOUT)
@@ -0,0 +1,232 @@
+"""
+Full-text search over the prose of every area.
+
+The names, descriptions and notes of areas, helps, rooms, doors, mobs,
+items and extra descriptions are kept in one SQLite FTS5 table, one row per
+object, with the object's keywords in a ``names`` column (which counts for
+more in the ranking) and the rest of its text in ``text``. A row's rowid is
+the object's pk times the number of SOURCES plus the index of its source,
+so rows are replaced and deleted by rowid without a lookup.
+
+The signal handlers below keep the table in step with saves and deletes.
+Rows written without signals (by the importer and the area copier) are
+indexed with index_area(). The table is created, and filled from the other
+tables, by syncdb; ``manage.py rebuild_search_index`` does the latter for a
+database whose index has fallen out of step.
+
+The index is written through a raw cursor, which Django doesn't commit, and
+a save has already committed by the time its post_save handler runs, so
+every write commits itself unless it's part of a managed transaction.
+"""
+import re
+
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from core.commits import commit_on_success
+from core.models import Area, AreaHelp, Door, ExtraDescription, Item, Mobile, Room
+
+
+SEARCH_TABLE = 'core_search'
+
+
+class Source(object):
+    """
+    One model's contribution to the index: its keyword fields, its other
+    text fields, and the path from it to its area.
+    """
+    def __init__(self, kind, model, area, names, text):
+        self.kind = kind
+        self.model = model
+        self.area = area
+        self.names = names
+        self.text = text
+
+    def row(self, values):
+        """
+        The index row for (pk, area pk, names..., text...).
+        """
+        split = 2 + len(self.names)
+        return (values[0] * len(SOURCES) + SOURCES.index(self), document(values[2:split]),
+                document(values[split:]), self.kind, values[1])
+
+    def rows(self, queryset):
+        """
+        Yields the index row of each object in ``queryset``, with one query.
+        """
+        for values in queryset.values_list(*(('pk', self.area) + self.names + self.text)).iterator():
+            yield self.row(values)
+
+
+SOURCES = (
+    Source('area', Area, 'pk', ('name',), ('notes',)),
+    Source('help', AreaHelp, 'area', ('keywords',), ('text',)),
+    Source('room', Room, 'area', (), ('notes',)),
+    Source('door', Door, 'room__area', ('name', 'keywords'), ('description', 'notes')),
+    Source('mobile', Mobile, 'area', ('names',), ('short_desc', 'long_desc', 'look_desc', 'notes')),
+    Source('item', Item, 'area', ('names',), ('short_desc', 'long_desc', 'notes')),
+    Source('extra', ExtraDescription, 'item__area', ('keywords',), ('description',)),
+    )
+
+KINDS = dict((source.kind, source) for source in SOURCES)
+
+# Keywords count for this many times the rest of an object's text.
+NAMES_WEIGHT = 10.0
+
+
+def document(values):
+    return u'\n'.join(value for value in values if value)
+
+
+def source_of(instance):
+    for source in SOURCES:
+        if isinstance(instance, source.model):
+            return source
+    return None
+
+
+def cursor():
+    return connections[DEFAULT_DB_ALIAS].cursor()
+
+
+def enabled():
+    return connections[DEFAULT_DB_ALIAS].vendor == 'sqlite'
+
+
+### Indexing ###
+def create_index():
+    cursor().execute("CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5("
+                     "names, text, kind UNINDEXED, area UNINDEXED, tokenize = 'unicode61 remove_diacritics 2')"
+                     % (SEARCH_TABLE))
+
+
+def write_rows(rows):
+    rows = list(rows)
+    if rows:
+        cursor().executemany('INSERT OR REPLACE INTO %s (rowid, names, text, kind, area) VALUES (%%s, %%s, %%s, %%s, %%s)'
+                             % (SEARCH_TABLE), rows)
+        transaction.commit_unless_managed(using=DEFAULT_DB_ALIAS)
+
+
+def index_area(area_pk):
+    """
+    Indexes everything in an area, with one query per source and one to
+    write the rows. For rows inserted without signals.
+    """
+    rows = []
+    for source in SOURCES:
+        rows.extend(source.rows(source.model._default_manager.filter(**{source.area: area_pk})))
+    write_rows(rows)
+
+
+def unindex_area(area_pk):
+    """
+    Drops everything in an area from the index, for rows deleted without
+    signals.
+    """
+    cursor().execute('DELETE FROM %s WHERE area = %%s' % (SEARCH_TABLE), [area_pk])
+    transaction.commit_unless_managed(using=DEFAULT_DB_ALIAS)
+
+
+@commit_on_success
+def rebuild_index():
+    """
+    Empties the index and indexes every area again, in one transaction.
+    """
+    cursor().execute('DELETE FROM %s' % (SEARCH_TABLE))
+    for area_pk in Area.objects.values_list('pk', flat=True):
+        index_area(area_pk)
+
+
+def index_object(source, instance):
+    if source.area in ('pk', 'area'):
+        # Everything is on the instance.
+        area_pk = instance.pk if source.area == 'pk' else instance.area_id
+        write_rows([source.row([instance.pk, area_pk] + [getattr(instance, name) for name in source.names + source.text])])
+    else:
+        write_rows(source.rows(source.model._default_manager.filter(pk=instance.pk)))
+
+
+def object_saved(sender, instance, created, raw=False, **kwargs):
+    source = source_of(instance)
+    if source is None or raw or not enabled():
+        return
+    index_object(source, instance)
+    # Doors and extra descriptions carry the area of their room or item.
+    if not created and isinstance(instance, Room):
+        write_rows(KINDS['door'].rows(Door.objects.filter(room=instance)))
+    elif not created and isinstance(instance, Item):
+        write_rows(KINDS['extra'].rows(ExtraDescription.objects.filter(item=instance)))
+
+
+def object_deleted(sender, instance, **kwargs):
+    source = source_of(instance)
+    if source is None or not enabled():
+        return
+    cursor().execute('DELETE FROM %s WHERE rowid = %%s' % (SEARCH_TABLE),
+                     [instance.pk * len(SOURCES) + SOURCES.index(source)])
+    transaction.commit_unless_managed(using=DEFAULT_DB_ALIAS)
+
+
+def tables_created(sender, **kwargs):
+    # flush sends this too, after emptying the other tables.
+    if sender.__name__ == Area.__module__ and enabled():
+        create_index()
+        rebuild_index()
+
+
+### Searching ###
+class SearchHit(object):
+    def __init__(self, kind, obj, area_pk, snippet, rank):
+        self.kind = kind
+        self.object = obj
+        self.area_pk = area_pk
+        self.snippet = snippet
+        self.rank = rank
+
+
+def match_expression(query):
+    """
+    An FTS5 query matching every word of ``query``, the last as a prefix
+    (so results follow typing). Other punctuation is ignored rather than
+    read as FTS5 syntax.
+    """
+    words = re.findall(r'\w+', query, re.UNICODE)
+    if not words:
+        return None
+    return u' '.join(u'"%s"' % (word) for word in words) + u'*'
+
+
+def search(query, area=None, kinds=None, limit=50):
+    """
+    Returns a list of SearchHit for the objects whose text matches every
+    word of ``query``, best first. ``area`` (a pk) and ``kinds`` (keys of
+    KINDS) narrow the search.
+    """
+    expression = match_expression(query)
+    if expression is None:
+        return []
+    for kind in kinds or ():
+        if kind not in KINDS:
+            raise ValueError('Unknown kind %r.' % (kind))
+    sql = ["SELECT rowid, kind, area, snippet(%s, -1, '[', ']', '...', 12), bm25(%s, %s, 1.0) AS rank "
+           "FROM %s WHERE %s MATCH %%s" % (SEARCH_TABLE, SEARCH_TABLE, NAMES_WEIGHT, SEARCH_TABLE, SEARCH_TABLE)]
+    params = [expression]
+    if area is not None:
+        sql.append('AND area = %s')
+        params.append(area)
+    if kinds:
+        sql.append('AND kind IN (%s)' % (', '.join(['%s'] * len(kinds))))
+        params.extend(kinds)
+    sql.append('ORDER BY rank LIMIT %s')
+    params.append(limit)
+    c = cursor()
+    c.execute(' '.join(sql), params)
+    rows = c.fetchall()
+
+    pks = {}
+    for rowid, kind, area_pk, snippet, rank in rows:
+        pks.setdefault(kind, []).append(rowid // len(SOURCES))
+    objects = dict((kind, KINDS[kind].model._default_manager.in_bulk(kind_pks)) for kind, kind_pks in pks.items())
+    return [SearchHit(kind, objects[kind][rowid // len(SOURCES)], area_pk, snippet, rank)
+            for rowid, kind, area_pk, snippet, rank in rows
+            if rowid // len(SOURCES) in objects[kind]]
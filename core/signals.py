@@ -0,0 +1,94 @@
+"""
+core's own signals, and the wiring of the handlers that keep everything
+derived from the models in step with edits.
+
+Cached exports and map layouts, the search index, the API's change log
+(whose revision numbers also key core.area_cache), the live change feed and
+the vnum indexes each keep their handlers in their own module, and every
+one of those modules imports core.models. Importing
+them from core.models would make an import cycle for whichever of them a
+program imported first, so connect_handlers() connects each handler by its
+dotted path once the models are defined, and a module is only imported
+when one of its handlers is first called.
+"""
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save, post_syncdb, pre_delete
+from django.dispatch import Signal
+from django.utils.importlib import import_module
+
+
+# Sent by core.models after rewriting rows with update(), which sends no
+# signals of its own, with the model, the rows' pks and the fields written.
+rows_updated = Signal(providing_args=['pks', 'fields'])
+
+# Sent by core.api once a row's change is logged, with the row, its
+# Resource, the area and its new revision number. ``fields`` names the
+# fields changed when the save didn't (many-to-many fields, or columns
+# rewritten with update()).
+change_noted = Signal(providing_args=['instance', 'resource', 'area_pk', 'number', 'created', 'deleted', 'fields'])
+
+# Sent by core.api.touch_area(), with the area and its new revision number.
+area_touched = Signal(providing_args=['area_pk', 'number'])
+
+
+class Handler(object):
+    """
+    A receiver that imports the function at ``path`` the first time it's
+    called, and calls it.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.function = None
+
+    def __call__(self, *args, **kwargs):
+        if self.function is None:
+            module, name = self.path.rsplit('.', 1)
+            self.function = getattr(import_module(module), name)
+        return self.function(*args, **kwargs)
+
+
+def connect(signal, path, sender=None):
+    # Nothing else holds the Handler, so it mustn't be a weak reference.
+    signal.connect(Handler(path), sender=sender, weak=False)
+
+
+def connect_handlers():
+    """
+    Connects the handlers of every module that follows edits. Called by
+    core.models once its models are defined.
+    """
+    from core.models import Area, Door, Room
+
+    connect(post_init, 'core.api.remember_area')
+    connect(pre_delete, 'core.api.row_deleting')
+    connect(post_save, 'core.api.row_changed')
+    connect(post_delete, 'core.api.row_changed')
+    connect(m2m_changed, 'core.api.m2m_row_changed')
+    connect(rows_updated, 'core.api.rows_changed')
+    connect(post_save, 'core.api.area_changed', sender=Area)
+    connect(post_delete, 'core.api.area_deleted', sender=Area)
+
+    connect(post_save, 'core.export_cache.invalidate_saved')
+    connect(post_delete, 'core.export_cache.invalidate_saved')
+    connect(m2m_changed, 'core.export_cache.invalidate_m2m')
+    connect(rows_updated, 'core.export_cache.invalidate_updated')
+    connect(change_noted, 'core.export_cache.invalidate_left')
+
+    connect(post_init, 'core.feed.remember_fields')
+    connect(change_noted, 'core.feed.publish_change')
+    connect(area_touched, 'core.feed.publish_touch')
+
+    connect(post_save, 'core.layout.door_changed', sender=Door)
+    connect(post_delete, 'core.layout.door_changed', sender=Door)
+    connect(post_save, 'core.layout.room_changed', sender=Room)
+    connect(post_delete, 'core.layout.room_changed', sender=Room)
+
+    connect(post_save, 'core.search.object_saved')
+    connect(post_delete, 'core.search.object_deleted')
+    connect(post_syncdb, 'core.search.tables_created')
+
+    connect(post_save, 'core.vnums.vnum_saved')
+    connect(post_delete, 'core.vnums.vnum_deleted')
+
+    # Sets up SQLite connections for concurrent writers.
+    connect(connection_created, 'core.sqlite.configure_connection')
@@ -0,0 +1,262 @@
+"""
+Zone reset simulator.
+
+ResetSimulator compiles an area's resets, in the order the exporter writes
+them, into flat arrays: one slot per reset with its opcode, the mob or item
+it loads, where it loads it and whether it fires every cycle. Running a
+cycle is then a loop over those arrays updating counters held in the same
+layout, so thousands of cycles run without going back to the database.
+
+Each cycle follows the game's rules:
+- A mob reset (M) loads its mob into its room unless total_in_game of that
+  mob are already loaded.
+- The items handed to a mob (G/E, including shop stock) are only loaded
+  with a mob the same cycle's M reset just loaded.
+- An object reset (O) loads into a room that doesn't already hold it.
+- A container reset (P) fills the container once one has been loaded.
+- Items never pass their own total_in_game either.
+Resets not marked reset_every_cycle only fire while the area is deserted.
+On cycles when players are in the area, ``attrition`` is the chance that
+each loaded mob is killed (with what it carries) and each loose item
+taken before the reset runs.
+"""
+from array import array
+import random
+
+from core.models import (
+    ItemContainerReset,
+    ItemRoomReset,
+    MobItemReset,
+    MobRoomReset,
+    Shopkeeper,
+    )
+
+
+# Opcodes, named after the #RESETS commands.
+MOB, GIVE, OBJECT, PUT = range(4)
+
+
+class ResetSimulator(object):
+    """
+    An area's resets compiled for simulation. Call run(), then read the
+    results from populations(), room_items(), container_items() and
+    cap_hits().
+    """
+    def __init__(self, area):
+        self.area = area
+        self.mobiles = []
+        self.items = []
+        self.rooms = []
+        self._mobile_index = {}
+        self._item_index = {}
+        self._room_index = {}
+        self.mobile_caps = array('l')
+        self.item_caps = array('l')
+        # One slot per reset.
+        self.ops = array('b')
+        self.every_cycle = array('b')
+        self.loads = array('l')
+        self.where = array('l')
+        self.pks = []
+        self.compile()
+        self.reset()
+
+    ### Compiling ###
+    def mobile(self, pk, cap):
+        if pk not in self._mobile_index:
+            self._mobile_index[pk] = len(self.mobiles)
+            self.mobiles.append(pk)
+            self.mobile_caps.append(cap)
+        return self._mobile_index[pk]
+
+    def item(self, pk, cap):
+        if pk not in self._item_index:
+            self._item_index[pk] = len(self.items)
+            self.items.append(pk)
+            self.item_caps.append(cap)
+        return self._item_index[pk]
+
+    def room(self, pk):
+        if pk not in self._room_index:
+            self._room_index[pk] = len(self.rooms)
+            self.rooms.append(pk)
+        return self._room_index[pk]
+
+    def add(self, op, pk, every_cycle, loads, where):
+        self.ops.append(op)
+        self.pks.append(pk)
+        self.every_cycle.append(every_cycle)
+        self.loads.append(loads)
+        self.where.append(where)
+
+    def compile(self):
+        area = self.area
+        gives = {}
+        mob_items = (MobItemReset.objects.filter(mobile__area=area).order_by('item__vnum')
+                     .values_list('pk', 'mobile', 'reset_every_cycle', 'item', 'item__total_in_game'))
+        for pk, mobile, every_cycle, item, cap in mob_items:
+            gives.setdefault(mobile, []).append((pk, every_cycle, item, cap))
+        stock = (Shopkeeper.reset_items.through.objects.filter(shopkeeper__mobile__area=area)
+                 .order_by('item__vnum')
+                 .values_list('shopkeeper__mobile', 'item', 'item__total_in_game'))
+        for mobile, item, cap in stock:
+            gives.setdefault(mobile, []).append((None, False, item, cap))
+
+        mob_resets = (MobRoomReset.objects.filter(mobile__area=area).order_by('room__vnum', 'mobile__vnum')
+                      .values_list('pk', 'mobile', 'mobile__total_in_game', 'reset_every_cycle', 'room'))
+        for pk, mobile, cap, every_cycle, room in mob_resets:
+            # A GIVE's "where" is its MOB's slot.
+            mob_op = len(self.ops)
+            self.add(MOB, pk, every_cycle, self.mobile(mobile, cap), self.room(room))
+            for give, give_every_cycle, item, item_cap in gives.get(mobile, []):
+                self.add(GIVE, give, give_every_cycle, self.item(item, item_cap), mob_op)
+        room_items = (ItemRoomReset.objects.filter(room__area=area).order_by('room__vnum', 'item__vnum')
+                      .values_list('pk', 'item', 'item__total_in_game', 'reset_every_cycle', 'room'))
+        for pk, item, cap, every_cycle, room in room_items:
+            self.add(OBJECT, pk, every_cycle, self.item(item, cap), self.room(room))
+        contents = (ItemContainerReset.objects.filter(container__area=area)
+                    .order_by('container__vnum', 'item__vnum')
+                    .values_list('pk', 'item', 'item__total_in_game', 'reset_every_cycle',
+                                 'container', 'container__total_in_game'))
+        for pk, item, cap, every_cycle, container, container_cap in contents:
+            self.add(PUT, pk, every_cycle, self.item(item, cap), self.item(container, container_cap))
+
+    ### Running ###
+    def reset(self):
+        """
+        Empties the area, as at boot.
+        """
+        self.cycle = 0
+        # Loaded by each reset and still in the game.
+        self.loaded = array('l', [0]) * len(self.ops)
+        self.mobile_totals = array('l', [0]) * len(self.mobiles)
+        self.item_totals = array('l', [0]) * len(self.items)
+        # Per reset: times a cap stopped it, and the first cycle it did.
+        self.capped = array('l', [0]) * len(self.ops)
+        self.first_capped = array('l', [-1]) * len(self.ops)
+
+    def run(self, cycles, occupied=(), attrition=0.0, seed=None):
+        """
+        Runs ``cycles`` reset cycles. ``occupied`` holds the numbers of the
+        cycles (counting from 0 at boot) in which players are in the area.
+        """
+        occupied = set(occupied)
+        rng = random.Random(seed)
+        ops, every_cycle, loads, where = self.ops, self.every_cycle, self.loads, self.where
+        loaded, mobile_totals, item_totals = self.loaded, self.mobile_totals, self.item_totals
+        mobile_caps, item_caps = self.mobile_caps, self.item_caps
+        spawned = bytearray(len(ops))
+        for cycle in range(self.cycle, self.cycle + cycles):
+            deserted = cycle not in occupied
+            if not deserted and attrition:
+                self.attrit(attrition, rng)
+            for slot in range(len(ops)):
+                spawned[slot] = 0
+                if not (deserted or every_cycle[slot]):
+                    continue
+                op = ops[slot]
+                target = loads[slot]
+                if op == MOB:
+                    if mobile_totals[target] >= mobile_caps[target]:
+                        self.cap(slot, cycle)
+                        continue
+                    mobile_totals[target] += 1
+                    spawned[slot] = 1
+                elif op == GIVE:
+                    if not spawned[where[slot]]:
+                        continue
+                    if item_totals[target] >= item_caps[target]:
+                        self.cap(slot, cycle)
+                        continue
+                    item_totals[target] += 1
+                else:
+                    if loaded[slot] or (op == PUT and not item_totals[where[slot]]):
+                        continue
+                    if item_totals[target] >= item_caps[target]:
+                        self.cap(slot, cycle)
+                        continue
+                    item_totals[target] += 1
+                loaded[slot] += 1
+        self.cycle += cycles
+
+    def cap(self, slot, cycle):
+        self.capped[slot] += 1
+        if self.first_capped[slot] < 0:
+            self.first_capped[slot] = cycle
+
+    def attrit(self, attrition, rng):
+        """
+        Players kill loaded mobs, along with what they carry, and take loose
+        items.
+        """
+        ops, loads, loaded = self.ops, self.loads, self.loaded
+        for slot in range(len(ops)):
+            if ops[slot] == GIVE or not loaded[slot]:
+                continue
+            removed = sum(1 for n in range(loaded[slot]) if rng.random() < attrition)
+            if not removed:
+                continue
+            if ops[slot] == MOB:
+                self.mobile_totals[loads[slot]] -= removed
+                # Each GIVE slot after a MOB belongs to it.
+                give = slot + 1
+                while give < len(ops) and ops[give] == GIVE:
+                    lost = loaded[give] * removed // loaded[slot]
+                    loaded[give] -= lost
+                    self.item_totals[loads[give]] -= lost
+                    give += 1
+            else:
+                self.item_totals[loads[slot]] -= removed
+            loaded[slot] -= removed
+
+    ### Results ###
+    def populations(self):
+        """
+        {room pk: {mob pk: number loaded}}
+        """
+        found = {}
+        for slot in range(len(self.ops)):
+            if self.ops[slot] == MOB and self.loaded[slot]:
+                mobs = found.setdefault(self.rooms[self.where[slot]], {})
+                mobile = self.mobiles[self.loads[slot]]
+                mobs[mobile] = mobs.get(mobile, 0) + self.loaded[slot]
+        return found
+
+    def room_items(self):
+        """
+        {room pk: {item pk: number}}, counting items carried by mobs as in
+        the mob's room.
+        """
+        found = {}
+        for slot in range(len(self.ops)):
+            if self.ops[slot] == OBJECT:
+                room = self.where[slot]
+            elif self.ops[slot] == GIVE:
+                room = self.where[self.where[slot]]
+            else:
+                continue
+            if self.loaded[slot]:
+                items = found.setdefault(self.rooms[room], {})
+                item = self.items[self.loads[slot]]
+                items[item] = items.get(item, 0) + self.loaded[slot]
+        return found
+
+    def container_items(self):
+        """
+        {container pk: {item pk: number}}
+        """
+        found = {}
+        for slot in range(len(self.ops)):
+            if self.ops[slot] == PUT and self.loaded[slot]:
+                items = found.setdefault(self.items[self.where[slot]], {})
+                items[self.items[self.loads[slot]]] = self.loaded[slot]
+        return found
+
+    def cap_hits(self):
+        """
+        (reset model, reset pk, first cycle, times) for each reset that a
+        total_in_game cap stopped. Shop stock has no reset pk.
+        """
+        models = {MOB: MobRoomReset, GIVE: MobItemReset, OBJECT: ItemRoomReset, PUT: ItemContainerReset}
+        return [(models[self.ops[slot]], self.pks[slot], self.first_capped[slot], self.capped[slot])
+                for slot in range(len(self.ops)) if self.capped[slot]]
@@ -0,0 +1,134 @@
+"""
+Stored versions of areas.
+
+A version is an area's export split into pieces: each mob, object and room
+fragment, each reset, and each of the smaller blocks whole. Every piece is
+compressed and stored once, as a SnapshotBlob keyed by the SHA-1 of its
+text, so versions share the pieces that didn't change between them. The
+list of a version's digests is itself stored as a blob, its manifest.
+
+Exporting a version streams the pieces back from the store in manifest
+order, reading only blob rows; restoring one passes that text through
+AreaReader to AreaImporter, which writes with bulk inserts.
+"""
+import base64
+import hashlib
+import zlib
+
+from django.db import transaction
+from django.db.models import Max
+
+from core.bulk import IN_SIZE, bulk_insert, chunked
+from core.diff import Snapshot
+from core.export_cache import CachedAreaExporter
+from core.importer import AreaImporter, AreaReader
+from core.models import AreaVersion, SnapshotBlob
+
+
+# Blocks stored a row at a time. The others are small enough to store whole.
+PIECEWISE_BLOCKS = ('mobile', 'object', 'room', 'reset')
+
+
+def digest(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def compress(text):
+    return base64.b64encode(zlib.compress(text.encode('utf-8')))
+
+
+def decompress(data):
+    return zlib.decompress(base64.b64decode(data)).decode('utf-8')
+
+
+def export_pieces(area):
+    """
+    Yields an area's export as the pieces it's stored in.
+    """
+    exporter = CachedAreaExporter(area)
+    for name in exporter.BLOCKS:
+        chunks = getattr(exporter, '%s_block' % (name))()
+        if name in PIECEWISE_BLOCKS:
+            for chunk in chunks:
+                yield chunk
+        else:
+            yield u''.join(chunks)
+    yield u'#$\n'
+
+
+def store(texts):
+    """
+    Stores the given texts as blobs, skipping those already stored, and
+    returns their digests in the same order.
+    """
+    pieces = dict((digest(text), text) for text in texts)
+    missing = set(pieces)
+    for chunk in chunked(sorted(pieces), IN_SIZE):
+        missing.difference_update(SnapshotBlob.objects.filter(digest__in=chunk).values_list('digest', flat=True))
+    bulk_insert(SnapshotBlob, [SnapshotBlob(digest=key, data=compress(pieces[key]), size=len(pieces[key]))
+                               for key in sorted(missing)])
+    return [digest(text) for text in texts]
+
+
+@transaction.commit_on_success
+def take_snapshot(area, comment=''):
+    """
+    Stores the area as it is now and returns its AreaVersion. If nothing
+    changed since its latest version, that version is returned instead.
+    """
+    digests = store(list(export_pieces(area)))
+    manifest = store([u'\n'.join(digests)])[0]
+    latest = AreaVersion.objects.filter(vnum=area.vnum).order_by('-number')[:1]
+    if latest and latest[0].manifest_id == manifest:
+        return latest[0]
+    number = AreaVersion.objects.filter(vnum=area.vnum).aggregate(number=Max('number'))['number'] or 0
+    return AreaVersion.objects.create(area=area, vnum=area.vnum, name=area.name, number=number + 1,
+                                      comment=comment, manifest_id=manifest)
+
+
+def load(digests):
+    """
+    Yields the text of each of ``digests`` in order, reading IN_SIZE
+    blobs at a time.
+    """
+    for chunk in chunked(digests, IN_SIZE):
+        data = dict(SnapshotBlob.objects.filter(digest__in=chunk).values_list('digest', 'data'))
+        for key in chunk:
+            yield decompress(data[key])
+
+
+def export_version(version):
+    """
+    Yields the .are file of a stored version as a series of text chunks,
+    like AreaExporter.
+    """
+    manifest = next(load([version.manifest_id]))
+    return load(manifest.split(u'\n'))
+
+
+def version_lines(version):
+    for chunk in export_version(version):
+        for line in chunk.splitlines(True):
+            yield line
+
+
+def version_snapshot(version):
+    """
+    A core.diff Snapshot of a stored version.
+    """
+    return Snapshot.from_lines(version_lines(version), unicode(version))
+
+
+def restore_version(version):
+    """
+    Replaces the area with the stored version, connecting its exits to
+    other areas again, and the exits of other areas into it, and returns
+    the Area.
+    """
+    record = AreaReader(version_lines(version), unicode(version)).read()
+    importer = AreaImporter(replace=True)
+    area = importer.create(record)
+    importer.finish()
+    # The restored area's own history carries on from the old one's.
+    AreaVersion.objects.filter(vnum=area.vnum).update(area=area)
+    return area
@@ -0,0 +1,24 @@
+"""
+SQLite set up for several builders writing at once.
+
+Every new connection to a database file is switched to write-ahead
+logging, so reads no longer block the writer or wait for it, and told to
+wait up to SQLITE_BUSY_TIMEOUT milliseconds for the write lock instead of
+failing at once with "database is locked". With WAL, synchronous=NORMAL is
+still safe against corruption and saves a sync per commit.
+"""
+from django.conf import settings
+
+
+SQLITE_BUSY_TIMEOUT = getattr(settings, 'SQLITE_BUSY_TIMEOUT', 20000)
+
+
+def configure_connection(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    cursor = connection.connection.cursor()
+    cursor.execute('PRAGMA busy_timeout = %d' % (SQLITE_BUSY_TIMEOUT))
+    if connection.settings_dict['NAME'] not in ('', ':memory:'):
+        cursor.execute('PRAGMA journal_mode = WAL')
+        cursor.execute('PRAGMA synchronous = NORMAL')
+    cursor.close()
@@ -0,0 +1,23 @@
+// Fills an AutocompleteSelect with the rows matching its search box.
+(function($) {
+    $(function() {
+        $('input.autocomplete-search').each(function() {
+            var search = $(this);
+            var select = $('#' + search.data('for'));
+            var timer = null;
+            search.keyup(function() {
+                clearTimeout(timer);
+                timer = setTimeout(function() {
+                    $.getJSON(select.data('autocomplete'), {q: search.val()}, function(results) {
+                        select.find('option').not(':selected').not('[value=""]').remove();
+                        $.each(results, function(i, result) {
+                            if (!select.find('option[value="' + result.id + '"]').length) {
+                                select.append($('<option>').val(result.id).text(result.label));
+                            }
+                        });
+                    });
+                }, 250);
+            });
+        });
+    });
+})(django.jQuery);
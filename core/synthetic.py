@@ -0,0 +1,226 @@
+"""
+Synthetic worlds for benchmarks.
+
+WorldGenerator makes area records in the shape AreaReader returns and
+creates them with AreaImporter, so a world is built with the importer's
+bulk inserts rather than a save() per row. The same seed and sizes always
+give the same world. Each area's rooms form a grid with exits between
+neighbours, the first room of each area leads up into the area before
+it (and back down), and items cycle through every type in ITEM_CLASSES.
+"""
+import random
+
+from core.importer import AreaImporter
+from core.models import (
+    ITEM_CLASSES,
+    VNUMS_PER_AREA,
+    ActionFlag,
+    AffectFlag,
+    Container,
+    DoorType,
+    DrinkContainer,
+    DrinkType,
+    Fountain,
+    Key,
+    KnownLanguage,
+    Light,
+    Money,
+    PreferredLanguage,
+    Race,
+    RoomSpecialFunction,
+    SpecialFunction,
+    Spell,
+    WearFlag,
+    WeaponDamageType,
+    )
+
+
+# Lookup rows the generated areas refer to, by TFC_id.
+LOOKUP_ROWS = (
+    (WearFlag, 0, 'take', {'description': ''}),
+    (WearFlag, 1, 'finger', {'description': ''}),
+    (DoorType, 0, 'no door', {'description': ''}),
+    (DoorType, 1, 'door', {'description': ''}),
+    (Spell, 1, 'armor', {}),
+    (Spell, 2, 'bless', {}),
+    (DrinkType, 0, 'water', {'adjective': 'clear'}),
+    (WeaponDamageType, 1, 'slash', {'weapon_type': 'S'}),
+    (PreferredLanguage, 0, 'common', {}),
+    (KnownLanguage, 0, 'common', {}),
+    (Race, 1, 'human', {}),
+    (ActionFlag, 1, 'sentinel', {'description': 'Stays put.'}),
+    (AffectFlag, 3, 'detect invisible', {'description': ''}),
+    (SpecialFunction, 'spec_guard', 'guard', {'description': ''}),
+    (RoomSpecialFunction, 'rspec_bank', 'bank', {'description': ''}),
+    )
+
+# Directions as exported: east/west and north/south between grid cells,
+# up/down between areas.
+NORTH, EAST, SOUTH, WEST, UP, DOWN = u'0', u'1', u'2', u'3', u'4', u'5'
+
+
+def ensure_lookups():
+    for model, TFC_id, name, fields in LOOKUP_ROWS:
+        if not model.objects.filter(TFC_id=TFC_id).exists():
+            model.objects.create(TFC_id=TFC_id, name=name, **fields)
+
+
+def item_values(item_class, rng, keys):
+    """
+    A plausible values line for an item of ``item_class``, as four ints.
+    """
+    if item_class is Light:
+        return [0, 0, rng.choice([-1, 0, 24, 100]), 0]
+    if item_class is Fountain:
+        return [rng.randint(1, 30), 1, 0, 0]
+    if item_class is DrinkContainer:
+        return [10, rng.randint(0, 10), 0, 0]
+    if item_class is Container:
+        return [rng.randint(10, 100), 0, rng.choice(keys) if keys else -1, 0]
+    if item_class is Money:
+        return [rng.randint(1, 500), 0, 0, 0]
+    name = item_class.__name__
+    if name in ('Weapon', 'AnimalWeapon'):
+        low = rng.randint(1, 10)
+        return [0, low, low + rng.randint(0, 10), 1]
+    if name in ('Armor', 'AnimalArmor'):
+        return [rng.randint(1, 10), 0, 0, 0]
+    if name in ('Food', 'PetFood'):
+        return [rng.randint(1, 24), 0, 0, 0]
+    if name in ('Scroll', 'Potion', 'Pill'):
+        return [rng.randint(1, 50), 1, rng.choice([2, -1]), -1]
+    if name in ('Wand', 'Staff', 'Fetish', 'Ring', 'Relic'):
+        charges = rng.randint(1, 10)
+        return [rng.randint(1, 50), charges, charges, 2]
+    return [0, 0, 0, 0]
+
+
+class WorldGenerator(object):
+    """
+    Builds ``areas`` areas of ``rooms`` rooms, ``mobiles`` mobs and
+    ``items`` items each, numbered from ``first_vnum``.
+    """
+    def __init__(self, areas=10, rooms=50, mobiles=20, items=40, seed=0, first_vnum=VNUMS_PER_AREA):
+        for name, count in (('rooms', rooms), ('mobiles', mobiles), ('items', items)):
+            if not 1 <= count <= VNUMS_PER_AREA:
+                raise ValueError('%s per area must be between 1 and %d' % (name, VNUMS_PER_AREA))
+        self.areas = areas
+        self.rooms = rooms
+        self.mobiles = mobiles
+        self.items = items
+        self.seed = seed
+        self.first_vnum = first_vnum
+
+    def build(self):
+        """
+        Creates the world and returns the AreaImporter's warnings.
+        """
+        ensure_lookups()
+        rng = random.Random(self.seed)
+        importer = AreaImporter()
+        for n in range(self.areas):
+            importer.create(self.area_record(n, rng))
+        importer.finish()
+        return importer.warnings
+
+    def area_record(self, n, rng):
+        vnum = self.first_vnum + n * VNUMS_PER_AREA
+        record = {
+            'name': u'Synthetic Area %d' % (n),
+            'author': u'synthetic%d' % (n),
+            'vnum': vnum,
+            'level_low': 1,
+            'level_high': rng.randint(10, 50),
+            'flags': 0,
+            'helps': [{'level': 0, 'keywords': u'SYNTHETIC %d' % (n), 'blank_line': False,
+                       'text': u'Generated area %d.\n' % (n)}],
+            'rooms': self.room_records(vnum, n, rng),
+            'objects': self.item_records(vnum, rng),
+            'mobiles': self.mobile_records(vnum, rng),
+            'rspecs': [(vnum, u'rspec_bank')],
+            'specials': [(vnum, u'spec_guard')],
+            }
+        record['resets'], record['shops'] = self.reset_records(vnum, record, rng)
+        record['triggers'] = [(u'P', room['vnum'], door['direction'], u'trig_locked')
+                              for room in record['rooms'][:5] for door in room['doors'][:1]]
+        return record
+
+    def room_records(self, vnum, n, rng):
+        width = max(1, int(self.rooms ** 0.5))
+        rooms = [{'vnum': vnum + i, 'doors': []} for i in range(self.rooms)]
+
+        def door(direction, to):
+            return {'direction': direction, 'description': u'', 'name': u'door', 'keywords': u'door',
+                    'door_type': rng.choice([0, 0, 1]), 'room_to': to}
+        for i, room in enumerate(rooms):
+            # East-west along each row, and most north-south links.
+            if i % width:
+                room['doors'].append(door(WEST, vnum + i - 1))
+                rooms[i - 1]['doors'].append(door(EAST, vnum + i))
+            if i >= width and rng.random() < 0.7:
+                room['doors'].append(door(SOUTH, vnum + i - width))
+                rooms[i - width]['doors'].append(door(NORTH, vnum + i))
+        # Up into the last room of the previous area, and down again.
+        if n:
+            rooms[0]['doors'].append(door(UP, vnum - VNUMS_PER_AREA + self.rooms - 1))
+        if n < self.areas - 1:
+            rooms[-1]['doors'].append(door(DOWN, vnum + VNUMS_PER_AREA))
+        return rooms
+
+    def item_records(self, vnum, rng):
+        types = sorted(ITEM_CLASSES)
+        items = []
+        keys = []
+        for i in range(self.items):
+            item_class = ITEM_CLASSES[types[i % len(types)]]
+            if item_class is Key:
+                keys.append(vnum + i)
+            items.append({
+                'vnum': vnum + i,
+                'names': u'%s %d' % (item_class.__name__.lower(), i),
+                'short_desc': u'a %s' % (item_class._meta.verbose_name),
+                'long_desc': u'A %s lies here.' % (item_class._meta.verbose_name),
+                'item_type': item_class.TFC_item_type,
+                'wear_flags': 0, 'takeable': 1, 'flammable': rng.randint(0, 1), 'metallic': rng.randint(0, 1),
+                'two_handed': 0, 'underwater_breath': 0,
+                'values': item_values(item_class, rng, keys),
+                'weight': rng.randint(1, 20), 'cost': rng.randint(1, 5000), 'total_in_game': rng.randint(1, 5),
+                'extras': [(u'mark', u'A maker\'s mark.')] if rng.random() < 0.2 else [],
+                })
+        return items
+
+    def mobile_records(self, vnum, rng):
+        return [{
+            'vnum': vnum + i,
+            'names': u'mob %d' % (i), 'short_desc': u'a mob', 'long_desc': u'A mob waits here.',
+            'look_desc': u'It looks generated.',
+            'level': rng.randint(1, 50), 'alignment': 0, 'sex': rng.randint(0, 2), 'is_animal': rng.randint(0, 1),
+            'no_wear': 0, 'total_in_game': rng.randint(1, 4),
+            'action_flags': rng.choice([0, 2]), 'affect_flags': rng.choice([0, 8]), 'spell': -1,
+            'preferred_language': 0, 'known_languages': 1,
+            } for i in range(self.mobiles)]
+
+    def reset_records(self, vnum, record, rng):
+        """
+        Places each mob in a room with an item or two, and the rest of the
+        items on the floor or in containers. The first mob keeps a shop.
+        """
+        resets = []
+        rooms = [room['vnum'] for room in record['rooms']]
+        items = record['objects']
+        containers = [item['vnum'] for item in items if item['item_type'] == Container.TFC_item_type]
+        shops = [[vnum, 5, 9, 0, 0, 0, 1, 6, 22]]
+        given = set()
+        for mob in record['mobiles']:
+            resets.append([u'M', rng.randint(0, 1), mob['vnum'], mob['total_in_game'], rng.choice(rooms)])
+            for item in rng.sample(items, min(2, len(items))):
+                given.add(item['vnum'])
+                resets.append([u'G', 0, item['vnum'], item['total_in_game']])
+        for item in items:
+            if item['vnum'] in given:
+                continue
+            if containers and item['vnum'] not in containers and rng.random() < 0.3:
+                resets.append([u'P', 0, item['vnum'], item['total_in_game'], rng.choice(containers)])
+            else:
+                resets.append([u'O', rng.randint(0, 1), item['vnum'], item['total_in_game'], rng.choice(rooms)])
+        return resets, shops
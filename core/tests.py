@@ -5,7 +5,85 @@ when you run "manage.py test".
 Replace this with more appropriate tests for your application.
 """
 
-from django.test import TestCase
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import traceback
+from cStringIO import StringIO
+
+import django.db.backends
+import django.db.models
+from django.contrib import admin
+from django.contrib.auth.models import Permission, User
+from django.core.cache import cache, get_cache
+from django.core.management import call_command, find_commands
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Q
+from django.forms.models import modelform_factory
+from django.db.backends.util import CursorDebugWrapper
+from django.test import TestCase, TransactionTestCase
+
+from core import area_cache as area_cache_module
+from core import feed as feed_module
+from core.admin import RoomAdmin
+from core.api import revision, version_token
+from core.area_cache import cached
+from core.benchmark import SCENARIOS, Benchmark
+from core.batch import BatchError, apply_batch
+from core.clone import CloneError, copy_rooms
+from core.commits import drop_callbacks, run_callbacks
+from core.diff import AreaDiff, Snapshot
+from core.export import AreaExporter
+from core.export_cache import CachedAreaExporter
+from core.feed import FEED_TIMEOUT, CacheBackend, LocalBackend, stream
+from core.forms import LookupChoiceField, LookupMultipleChoiceField, VersionedModelForm
+from core.graph import RoomGraph
+from core.importer import AreaFileError, AreaImporter, AreaReader
+from core import layout as layout_module
+from core.layout import area_layout, place_component
+from core.lint import lint_area, lint_world
+from core.registry import registry
+from core.search import search
+from core.simulate import ResetSimulator
+from core.snapshots import export_version, restore_version, take_snapshot, version_snapshot
+from core.synthetic import WorldGenerator
+from core.world import check_world, write_bundle
+from core.vnums import IntervalIndex, VnumError, allocate, create, forget_indexes, next_area_vnum
+from core.models import (
+    ITEM_CLASSES,
+    ActionFlag,
+    ContainerFlag,
+    ConflictError,
+    Area,
+    AreaHelp,
+    Container,
+    Door,
+    DoorType,
+    DrinkType,
+    ExtraDescription,
+    Fountain,
+    ItemContainerReset,
+    ItemRoomReset,
+    Item,
+    Key,
+    Light,
+    MobItemReset,
+    MobRoomReset,
+    Mobile,
+    PreferredLanguage,
+    Race,
+    Room,
+    Scroll,
+    Shopkeeper,
+    SnapshotBlob,
+    Spell,
+    WearFlag,
+    )
 
 
 class SimpleTest(TestCase):
@@ -14,3 +92,1542 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+def build_area(vnum=1000, rooms=3, name='Test Area', guards=0):
+    """
+    Creates a small but complete area: a line of rooms joined by doors, a
+    light in each room, a locked chest, and a shopkeeper who carries a key.
+    ``guards`` more mobs each stand in a room holding its light.
+    """
+    author = User.objects.create(username='builder%d' % (vnum))
+    area = Area.objects.create(author=author, vnum=vnum, name=name, notes='')
+    AreaHelp.objects.create(area=area, keywords='TEST AREA', text='A test area.')
+    wear, _ = WearFlag.objects.get_or_create(TFC_id=0, name='take')
+    door_type, _ = DoorType.objects.get_or_create(TFC_id=1, name='door')
+    language, _ = PreferredLanguage.objects.get_or_create(TFC_id=0, name='common')
+    race, _ = Race.objects.get_or_create(TFC_id=1, name='human')
+    DrinkType.objects.get_or_create(TFC_id=0, name='water', adjective='clear')
+
+    item_fields = dict(area=area, wear_flags=wear, values=0, notes='')
+    key = Key.objects.create(vnum=vnum + 1, names='key', short_desc='a key', long_desc='A key.', **item_fields)
+    chest = Container.objects.create(vnum=vnum + 2, names='chest', short_desc='a chest', long_desc='A chest.', key=key, **item_fields)
+    ExtraDescription.objects.create(item=chest, TFC_id=0, keywords='lid', description='The lid is carved.')
+
+    mob = Mobile.objects.create(area=area, vnum=vnum, names='shopkeeper', short_desc='the shopkeeper',
+                                long_desc='A shopkeeper waits.', look_desc='Bored.', alignment=0, sex=0,
+                                preferred_language=language, notes='')
+    Shopkeeper.objects.create(mobile=mob, race=race, will_buy='1,5')
+    MobItemReset.objects.create(mobile=mob, item=key)
+
+    previous = None
+    for offset in range(rooms):
+        room = Room.objects.create(area=area, vnum=vnum + offset, notes='')
+        light = Light.objects.create(vnum=vnum + 10 + offset, names='torch', short_desc='a torch',
+                                     long_desc='A torch burns.', hours=offset, **item_fields)
+        ItemRoomReset.objects.create(room=room, item=light)
+        if previous is not None:
+            Door.objects.create(room=previous, room_to=room, direction='1', door_type=door_type,
+                                name='door', keywords='door', notes='')
+            Door.objects.create(room=room, room_to=previous, direction='3', door_type=door_type,
+                                name='door', keywords='door', notes='')
+        previous = room
+        if offset < guards:
+            guard = Mobile.objects.create(area=area, vnum=vnum + 10 + offset, names='guard', short_desc='a guard',
+                                          long_desc='A guard stands here.', look_desc='Alert.', alignment=0,
+                                          sex=0, preferred_language=language, notes='')
+            MobRoomReset.objects.create(mobile=guard, room=room)
+            MobItemReset.objects.create(mobile=guard, item=light)
+    MobRoomReset.objects.create(mobile=mob, room=previous)
+    return area
+
+
+# One query per block or related table.
+EXPORT_QUERIES = 18
+
+
+### Query budgets ###
+# Frames in these directories are skipped when naming the code that ran a query.
+ORM_DIRS = (os.path.dirname(django.db.models.__file__), os.path.dirname(django.db.backends.__file__))
+
+
+def call_site():
+    """
+    The innermost frame on the stack that isn't the ORM's, as
+    "file:line in function".
+    """
+    # Skipping this function and SiteCursor's method.
+    for filename, line, function, text in reversed(traceback.extract_stack()[:-2]):
+        if filename.startswith(ORM_DIRS):
+            continue
+        return '%s:%d in %s' % (filename, line, function)
+    return '?'
+
+
+class SiteCursor(CursorDebugWrapper):
+    """
+    A debug cursor that also logs each query, with the code that ran it, to
+    its connection's ``query_log``.
+    """
+    def execute(self, sql, params=()):
+        site = call_site()
+        try:
+            return super(SiteCursor, self).execute(sql, params)
+        finally:
+            self.db.query_log.append((site, self.db.queries[-1]['sql']))
+
+    def executemany(self, sql, param_list):
+        site = call_site()
+        try:
+            return super(SiteCursor, self).executemany(sql, param_list)
+        finally:
+            self.db.query_log.append((site, self.db.queries[-1]['sql']))
+
+
+class QueryBudget(object):
+    """
+    Fails ``test`` if the with block runs more than ``budget`` queries,
+    listing the queries by the code that ran them.
+    """
+    def __init__(self, test, budget, label=''):
+        self.test = test
+        self.budget = budget
+        self.label = label
+
+    def __enter__(self):
+        # connection.queries is emptied at the start of every request, so
+        # the queries are logged separately.
+        self.connection = connection = connections[DEFAULT_DB_ALIAS]
+        self.old_debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        connection.query_log = []
+        connection.make_debug_cursor = lambda cursor: SiteCursor(cursor, connection)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        connection = self.connection
+        connection.use_debug_cursor = self.old_debug_cursor
+        del connection.make_debug_cursor
+        log = connection.query_log
+        del connection.query_log
+        if exc_type is not None or len(log) <= self.budget:
+            return
+        by_site = {}
+        for site, sql in log:
+            by_site.setdefault(site, []).append(sql)
+        lines = ['%s ran %d queries, over its budget of %d:' % (self.label or 'Block', len(log), self.budget)]
+        for site, sqls in sorted(by_site.items(), key=lambda (site, sqls): -len(sqls)):
+            lines.append('  %dx %s' % (len(sqls), site))
+            lines.append('      %s' % (sqls[0][:200]))
+        self.test.fail('\n'.join(lines))
+
+
+class AreaExportTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_export_blocks(self):
+        area = build_area()
+        text = u''.join(AreaExporter(area))
+        for block in ('#AREA', '#HELPS', '#MOBILES', '#OBJECTS', '#ROOMS', '#RESETS',
+                      '#SHOPS', '#SPECIALS', '#RSPECS', '#TRIGGERS'):
+            self.assertTrue(block in text, block)
+        self.assertTrue(text.endswith(u'#$\n'))
+        self.assertTrue(u'0 0 2 0\n' in text)
+        self.assertTrue(u'E\nlid~\nThe lid is carved.~\n' in text)
+        self.assertTrue(u'M 0 1000 1 1002\nG 0 1001 1\n' in text)
+        self.assertTrue(u'1000 1 5 0 0 0 1 6 23\n' in text)
+
+    def test_export_query_count_is_constant(self):
+        small = build_area(vnum=1000, rooms=2, name='Small')
+        large = build_area(vnum=2000, rooms=20, name='Large')
+        registry()
+        for area in (small, large):
+            area = Area.objects.get(pk=area.pk)
+            with self.assertNumQueries(EXPORT_QUERIES):
+                list(AreaExporter(area))
+
+    def test_export_view_streams_file(self):
+        area = build_area()
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        response = self.client.get('/areas/%d/export/' % (area.vnum))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename=test-area.are')
+        self.assertEqual(response.content.decode('utf-8'), u''.join(AreaExporter(area)))
+
+
+    def test_cached_export_rerenders_only_edits(self):
+        area = build_area(rooms=20)
+        self.assertEqual(u''.join(CachedAreaExporter(area)), u''.join(AreaExporter(area)))
+        with self.assertNumQueries(0):
+            list(CachedAreaExporter(area))
+
+        door = Door.objects.filter(room__area=area)[0]
+        door.description = u'A narrow gap.'
+        door.save()
+        # Room block: the pk list plus the edited room and its exits. The
+        # reset and trigger blocks (which show doors) are rebuilt whole.
+        with self.assertNumQueries(3 + 6 + 1):
+            text = u''.join(CachedAreaExporter(area))
+        self.assertTrue(u'A narrow gap.~\n' in text)
+        self.assertEqual(text, u''.join(AreaExporter(area)))
+
+    def test_cached_export_follows_m2m_changes(self):
+        area = build_area()
+        list(CachedAreaExporter(area))
+        mob = Mobile.objects.get(area=area)
+        mob.action_flags.add(ActionFlag.objects.create(TFC_id=3, name='sentinel', description=''))
+        self.assertTrue(u'8 0 -1\n' in u''.join(CachedAreaExporter(area)))
+
+    def test_cached_export_follows_renumbered_rooms_elsewhere(self):
+        area = build_area()
+        other = build_area(vnum=2000, rooms=2, name='Other Area')
+        Door.objects.create(room=Room.objects.get(area=area, vnum=1001), room_to=Room.objects.get(area=other, vnum=2000),
+                            direction='4', door_type=DoorType.objects.get(), name='', keywords='', notes='')
+        self.assertTrue(u'1 2000\n' in u''.join(CachedAreaExporter(area)))
+        room = Room.objects.get(area=other, vnum=2000)
+        room.vnum = 2050
+        room.save()
+        text = u''.join(CachedAreaExporter(area))
+        self.assertTrue(u'1 2050\n' in text)
+        self.assertEqual(text, u''.join(AreaExporter(area)))
+
+
+class ItemStorageTest(TestCase):
+    def test_items_are_packed_on_save(self):
+        area = build_area()
+        chest = Item.objects.get(area=area, vnum=1002)
+        self.assertEqual(chest.item_type, Container.TFC_item_type)
+        self.assertEqual(chest.type_values, u'4 0 1001 0')
+        with self.assertNumQueries(1):
+            self.assertEqual(len(list(Item.objects.filter(area=area).values_list('item_type', 'type_values'))), 5)
+
+    def test_m2m_changes_are_packed(self):
+        area = build_area()
+        wear = WearFlag.objects.get(TFC_id=0)
+        scroll = Scroll.objects.create(area=area, vnum=1100, names='scroll', short_desc='a scroll',
+                                       long_desc='A scroll.', wear_flags=wear, values=0, notes='', spell_level=5)
+        self.assertEqual(Item.objects.get(pk=scroll.pk).item_type, Scroll.TFC_item_type)
+        scroll.spells.add(Spell.objects.create(TFC_id=7, name='sleep'))
+        self.assertEqual(Item.objects.get(pk=scroll.pk).type_values, u'5 7 -1 -1')
+
+    def test_lookup_and_key_changes_are_packed(self):
+        area = build_area()
+        wear = WearFlag.objects.get(TFC_id=0)
+        spell = Spell.objects.create(TFC_id=7, name='sleep')
+        fountain = Fountain.objects.create(area=area, vnum=1100, names='fountain', short_desc='a fountain',
+                                           long_desc='A fountain.', wear_flags=wear, values=0, notes='',
+                                           spell=spell, spell_level=3, drink_type=DrinkType.objects.get(TFC_id=0))
+        self.assertEqual(Item.objects.get(pk=fountain.pk).type_values, u'3 7 0 0')
+        spell.TFC_id = 99
+        spell.save()
+        self.assertEqual(Item.objects.get(pk=fountain.pk).type_values, u'3 99 0 0')
+        list(CachedAreaExporter(area))
+        key = Key.objects.get(area=area)
+        key.vnum = 1099
+        key.save()
+        self.assertEqual(Item.objects.get(area=area, vnum=1002).type_values, u'4 0 1099 0')
+        self.assertIn(u'4 0 1099 0', u''.join(CachedAreaExporter(area)))
+
+    def test_typed(self):
+        area = build_area()
+        items = Item.objects.filter(area=area).order_by('vnum')
+        with self.assertNumQueries(4):
+            typed = Item.objects.typed(items)
+        self.assertEqual([type(item) for item in typed], [Key, Container, Light, Light, Light])
+        self.assertEqual(typed[2].hours, 0)
+
+
+# One query per table read or written, for any size of area.
+REPLACE_QUERIES = 97
+
+# Tables of an area's rows, and the path from each to the area. (A
+# shopkeeper's items come back as stock rather than as resets.)
+REPLACED = ((Room, 'area'), (Door, 'room__area'), (Mobile, 'area'), (Item, 'area'), (Light, 'area'),
+            (ExtraDescription, 'item__area'), (MobRoomReset, 'mobile__area'), (ItemRoomReset, 'room__area'),
+            (Shopkeeper, 'mobile__area'))
+
+
+class AreaImportTest(TestCase):
+    def test_round_trip(self):
+        area = build_area(rooms=5)
+        text = u''.join(AreaExporter(area))
+        importer = AreaImporter(replace=True)
+        imported = importer.create(AreaReader(text.splitlines(True)).read())
+        importer.finish()
+        self.assertEqual(Area.objects.count(), 1)
+        self.assertEqual(importer.warnings, [])
+        self.assertEqual(u''.join(AreaExporter(imported)), text)
+        self.assertEqual(Container.objects.get(area=imported).key.vnum, 1001)
+
+    def test_existing_area_is_kept(self):
+        area = build_area()
+        record = AreaReader(u''.join(AreaExporter(area)).splitlines(True)).read()
+        self.assertRaises(AreaFileError, AreaImporter().create, record)
+
+    def test_author_with_an_area(self):
+        build_area()
+        record = AreaReader(u''.join(AreaExporter(build_area(vnum=2000, name='Other Area'))).splitlines(True)).read()
+        self.assertRaises(AreaFileError, AreaImporter(replace=True, author='builder1000').create, record)
+        self.assertEqual(Area.objects.count(), 2)
+
+    def test_replace_keeps_entrances(self):
+        area = build_area()
+        other = build_area(vnum=2000, name='Other Area')
+        entrance = Door.objects.create(room=Room.objects.get(area=other, vnum=2000),
+                                       room_to=Room.objects.get(area=area, vnum=1001),
+                                       direction='0', door_type=DoorType.objects.get(TFC_id=1), notes='')
+        importer = AreaImporter(replace=True)
+        imported = importer.create(AreaReader(u''.join(AreaExporter(area)).splitlines(True)).read())
+        importer.finish()
+        self.assertEqual(Door.objects.get(pk=entrance.pk).room_to, Room.objects.get(area=imported, vnum=1001))
+        self.assertEqual(importer.warnings, [])
+
+    def test_replace_deletes_a_table_at_a_time(self):
+        for vnum, rooms in ((1000, 3), (2000, 10)):
+            area = build_area(vnum=vnum, rooms=rooms, name='Area %d' % (vnum))
+            record = AreaReader(u''.join(AreaExporter(area)).splitlines(True)).read()
+            counts = [model.objects.filter(**{path: area}).count() for model, path in REPLACED]
+            number = revision(area.pk)[0]
+            registry()
+            with self.assertNumQueries(REPLACE_QUERIES):
+                imported = AreaImporter(replace=True).create(record)
+            self.assertEqual(imported.pk, area.pk)
+            self.assertTrue(revision(area.pk)[0] > number)
+            self.assertEqual([model.objects.filter(**{path: area}).count() for model, path in REPLACED], counts)
+            self.assertEqual(u''.join(CachedAreaExporter(imported)), u''.join(AreaExporter(area)))
+            self.assertEqual([hit.object.pk for hit in search('torch', area.pk, ['item'])],
+                             list(Item.objects.filter(area=area, names='torch').order_by('pk').values_list('pk', flat=True)))
+
+    def test_replace_deletes_rows_of_other_areas_that_point_into_it(self):
+        area = build_area()
+        other = build_area(vnum=2000, name='Other Area')
+        reset = MobItemReset.objects.create(mobile=Mobile.objects.get(area=other), item=Key.objects.get(area=area))
+        AreaImporter(replace=True).create(AreaReader(u''.join(AreaExporter(area)).splitlines(True)).read())
+        self.assertFalse(MobItemReset.objects.filter(pk=reset.pk).exists())
+        self.assertEqual(MobItemReset.objects.filter(mobile__area=other).count(), 1)
+
+    def test_bad_file_reports_line(self):
+        reader = AreaReader([u'#AREA\n', u'Name~\n', u'builder~\n', u'1 50\n'], 'bad.are')
+        try:
+            reader.read()
+        except AreaFileError as e:
+            self.assertEqual(str(e), 'bad.are:4: expected 4 numbers, got 2')
+        else:
+            self.fail('AreaFileError not raised')
+
+
+class RegistryTest(TestCase):
+    def test_lookups_are_served_from_memory(self):
+        spell = Spell.objects.create(TFC_id=7, name='sleep')
+        registry()
+        with self.assertNumQueries(0):
+            self.assertEqual(registry()[Spell].by_TFC_id(7), spell)
+            field = LookupChoiceField(Spell.objects.all())
+            self.assertEqual(field.choices[1][0], spell.pk)
+            self.assertEqual(field.clean(str(spell.pk)), spell)
+            field = LookupMultipleChoiceField(Spell.objects.all())
+            self.assertEqual(field.clean([str(spell.pk)]), [spell])
+
+    def test_edits_reload_registry(self):
+        spell = Spell.objects.create(TFC_id=7, name='sleep')
+        self.assertEqual(registry()[Spell].get(spell.pk).TFC_id, 7)
+        spell.TFC_id = 8
+        spell.save()
+        self.assertEqual(registry()[Spell].get(spell.pk).TFC_id, 8)
+
+    def test_edits_repack_items(self):
+        area = build_area()
+        spell = Spell.objects.create(TFC_id=7, name='sleep')
+        scroll = Scroll.objects.create(area=area, vnum=1100, names='scroll', short_desc='a scroll', long_desc='A scroll.',
+                                       wear_flags=WearFlag.objects.get(TFC_id=0), values=0, notes='', spell_level=5)
+        scroll.spells.add(spell)
+        spell.name = 'deep sleep'
+        spell.save()
+        self.assertEqual(Item.objects.get(pk=scroll.pk).type_values, u'5 7 -1 -1')
+        spell.TFC_id = 8
+        spell.save()
+        self.assertEqual(Item.objects.get(pk=scroll.pk).type_values, u'5 8 -1 -1')
+        spell.delete()
+        self.assertEqual(Item.objects.get(pk=scroll.pk).type_values, u'5 -1 -1 -1')
+
+    def test_admin_change_form(self):
+        area = build_area()
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        mob = Mobile.objects.get(area=area)
+        response = self.client.get('/admin/core/mobile/%d/' % (mob.pk))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'PreferredLanguage object')
+
+
+class FlagVectorTest(TestCase):
+    def setUp(self):
+        self.area = build_area()
+        self.aggressive = ActionFlag.objects.create(TFC_id=5, name='aggressive', description='')
+        self.sentinel = ActionFlag.objects.create(TFC_id=1, name='sentinel', description='')
+        self.guard = Mobile.objects.get(area=self.area)
+        self.guard.action_flags.add(self.aggressive, self.sentinel)
+
+    def test_vectors_follow_m2m(self):
+        self.assertEqual(self.guard.action_flags_vector, 34)
+        self.assertEqual(Mobile.objects.get(pk=self.guard.pk).action_flags_vector, 34)
+        self.sentinel.mobile_set.clear()
+        self.assertEqual(Mobile.objects.get(pk=self.guard.pk).action_flags_vector, 32)
+        self.aggressive.TFC_id = 6
+        self.aggressive.save()
+        self.assertEqual(Mobile.objects.get(pk=self.guard.pk).action_flags_vector, 64)
+        self.aggressive.delete()
+        self.assertEqual(Mobile.objects.get(pk=self.guard.pk).action_flags_vector, 0)
+
+    def test_flagged(self):
+        wanderer = Mobile.objects.create(area=self.area, vnum=2, names='wolf', short_desc='a wolf', long_desc='',
+                                         look_desc='', alignment=0, sex=0, notes='',
+                                         preferred_language=self.guard.preferred_language)
+        wanderer.action_flags.add(self.aggressive)
+        self.assertEqual(list(Mobile.objects.flagged('action_flags', has=['aggressive'], lacks=['sentinel'])), [wanderer])
+        self.assertEqual(Mobile.objects.flagged('action_flags', has=[self.aggressive]).count(), 2)
+
+    def test_container_values_use_vector(self):
+        chest = Container.objects.get(area=self.area)
+        chest.flags.add(ContainerFlag.objects.create(TFC_id=2, name='closeable', description=''))
+        self.assertEqual(Item.objects.get(pk=chest.pk).type_values, u'4 4 1001 0')
+        self.assertEqual(list(Container.objects.flagged('flags', has=['closeable'])), [chest])
+
+    def test_container_values_follow_flag_edits(self):
+        chest = Container.objects.get(area=self.area)
+        closeable = ContainerFlag.objects.create(TFC_id=2, name='closeable', description='')
+        closeable.container_set.add(chest)
+        closeable.TFC_id = 3
+        closeable.save()
+        self.assertEqual(Item.objects.get(pk=chest.pk).type_values, u'4 8 1001 0')
+        closeable.container_set.clear()
+        self.assertEqual(Item.objects.get(pk=chest.pk).type_values, u'4 0 1001 0')
+
+
+class RoomGraphTest(TestCase):
+    def setUp(self):
+        self.area = build_area(rooms=4)
+        self.rooms = list(Room.objects.filter(area=self.area).order_by('vnum'))
+        self.door_type = DoorType.objects.get(TFC_id=1)
+
+    def exit(self, room, direction, room_to):
+        Door.objects.create(room=room, room_to=room_to, direction=direction, door_type=self.door_type,
+                            name='door', keywords='door', notes='')
+
+    def test_connected_area_is_clean(self):
+        with self.assertNumQueries(2):
+            graph = RoomGraph.for_area(self.area)
+        self.assertEqual(list(graph.vnums), [1000, 1001, 1002, 1003])
+        self.assertEqual(graph.unreachable(), [])
+        self.assertEqual(graph.dead_ends(), [])
+        self.assertEqual(graph.one_way_exits(), [])
+        self.assertEqual(graph.mismatched_exits(), [])
+
+    def test_checks(self):
+        first, second, third, last = self.rooms
+        Door.objects.filter(room=last).delete()
+        isolated = Room.objects.create(area=self.area, vnum=1004, notes='')
+        self.exit(first, '4', third)
+        graph = RoomGraph.for_area(self.area)
+        self.assertEqual(graph.unreachable(), [isolated.pk])
+        self.assertEqual(graph.unreachable(starts=[last.pk]), [first.pk, second.pk, third.pk, isolated.pk])
+        self.assertEqual(graph.dead_ends(), [last.pk, isolated.pk])
+        self.assertEqual(graph.one_way_exits(), [(first.pk, 4, third.pk), (third.pk, 1, last.pk)])
+        self.assertEqual(graph.mismatched_exits(), [(first.pk, 4, third.pk, None), (third.pk, 1, last.pk, None)])
+
+    def test_exits_between_areas(self):
+        other = build_area(vnum=2000, rooms=1, name='Other Area')
+        outside = Room.objects.get(area=other)
+        self.exit(outside, '0', self.rooms[2])
+        graph = RoomGraph.for_area(self.area)
+        self.assertEqual(graph.unreachable(), [])
+        self.assertEqual(graph.one_way_exits(), [])
+        world = RoomGraph.for_world()
+        self.assertEqual(len(world), 5)
+        self.assertEqual(world.one_way_exits(), [(outside.pk, 0, self.rooms[2].pk)])
+        self.assertEqual(world.unreachable(), [outside.pk])
+
+    def test_exit_to_another_area_is_not_a_dead_end(self):
+        last = self.rooms[-1]
+        Door.objects.filter(room=last).delete()
+        other = build_area(vnum=2000, rooms=1, name='Other Area')
+        self.exit(last, '1', Room.objects.get(area=other))
+        self.assertEqual(RoomGraph.for_area(self.area).dead_ends(), [])
+
+
+class RoomLayoutTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.area = build_area(rooms=3)
+        self.rooms = list(Room.objects.filter(area=self.area).order_by('vnum'))
+        self.door_type = DoorType.objects.get(TFC_id=1)
+
+    def exit(self, room, direction, room_to):
+        Door.objects.create(room=room, room_to=room_to, direction=direction, door_type=self.door_type,
+                            name='door', keywords='door', notes='')
+
+    def test_layout_follows_directions(self):
+        first, second, third = self.rooms
+        cellar = Room.objects.create(area=self.area, vnum=1003, notes='')
+        self.exit(second, '5', cellar)
+        layout = area_layout(self.area)
+        self.assertEqual(layout, {first.pk: (0, 0, 0), second.pk: (1, 0, 0), third.pk: (2, 0, 0),
+                                  cellar.pk: (1, 0, -1)})
+        with self.assertNumQueries(0):
+            self.assertEqual(area_layout(self.area), layout)
+
+    def test_collisions_take_nearest_free_cell(self):
+        first, second, third = self.rooms
+        # Going west from the third room leads somewhere other than the second.
+        Door.objects.filter(room=third).update(room_to=Room.objects.create(area=self.area, vnum=1003, notes=''))
+        cache.clear()
+        layout = area_layout(self.area)
+        self.assertEqual(len(set(layout.values())), 4)
+        self.assertEqual(layout[first.pk], (0, 0, 0))
+
+    def test_only_changed_components_are_laid_out(self):
+        island = Room.objects.create(area=self.area, vnum=1010, notes='')
+        hut = Room.objects.create(area=self.area, vnum=1011, notes='')
+        layout = area_layout(self.area)
+        self.assertEqual(layout[island.pk], (5, 0, 0))
+        self.assertEqual(layout[hut.pk], (8, 0, 0))
+
+        placed = []
+        def place(graph, rooms):
+            placed.append(sorted(graph.pks[room] for room in rooms))
+            return place_component(graph, rooms)
+        self.exit(island, '0', hut)
+        layout_module.place_component = place
+        try:
+            layout = area_layout(self.area)
+        finally:
+            layout_module.place_component = place_component
+        self.assertEqual(placed, [[island.pk, hut.pk]])
+        self.assertEqual(layout[hut.pk], (5, 1, 0))
+
+    def test_layout_view(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        response = self.client.get('/areas/%d/layout/' % (self.area.vnum))
+        self.assertEqual(json.loads(response.content), {'1000': [0, 0, 0], '1001': [1, 0, 0], '1002': [2, 0, 0]})
+
+
+class LintTest(TestCase):
+    def setUp(self):
+        self.area = build_area()
+
+    def rules(self, diagnostics):
+        return sorted((diagnostic.rule, diagnostic.pk) for diagnostic in diagnostics)
+
+    def test_clean_area(self):
+        self.assertEqual(lint_area(self.area), [])
+
+    def test_rules(self):
+        other = build_area(vnum=2000, rooms=1, name='Other Area')
+        foreign = Key.objects.get(area=other)
+        room = Room.objects.filter(area=self.area).latest('vnum')
+        door = Door.objects.filter(room=room).get()
+        Door.objects.filter(pk=door.pk).update(room_to=9999)
+        mob = Mobile.objects.get(area=self.area)
+        Mobile.objects.filter(pk=mob.pk).update(vnum=1100)
+        Shopkeeper.objects.filter(mobile=mob).update(will_buy='1,99,5,6,9,14', closes=24)
+        ItemRoomReset.objects.create(room=room, item=foreign)
+        MobRoomReset.objects.create(mobile=mob, room=Room.objects.get(area=self.area, vnum=1000))
+        shop = Shopkeeper.objects.get(mobile=mob)
+        # One query per table.
+        with self.assertNumQueries(10):
+            diagnostics = lint_area(self.area)
+        self.assertEqual(self.rules(diagnostics), [
+            ('door_destination', door.pk),
+            ('mobile_total_in_game', mob.pk),
+            ('reset_item_area', ItemRoomReset.objects.get(item=foreign).pk),
+            ('shop_hours', shop.pk),
+            ('shop_will_buy', shop.pk),
+            ('shop_will_buy', shop.pk),
+            ('vnum_in_range', mob.pk),
+            ])
+        self.assertEqual(lint_world(processes=1), diagnostics)
+
+
+class VnumAllocatorTest(TestCase):
+    def setUp(self):
+        forget_indexes()
+        self.area = build_area()
+
+    def test_interval_index(self):
+        index = IntervalIndex([5, 1, 2, 3, 9])
+        self.assertEqual(list(index), [(1, 3), (5, 5), (9, 9)])
+        index.add(4)
+        index.add(6, 8)
+        self.assertEqual(list(index), [(1, 9)])
+        index.remove(5)
+        self.assertEqual(list(index), [(1, 4), (6, 9)])
+        self.assertTrue(4 in index)
+        self.assertFalse(5 in index)
+        self.assertEqual(index.find_free(1, 20), 5)
+        self.assertEqual(index.find_free(1, 20, 2), 10)
+        self.assertEqual(index.find_free(1, 10, 2), None)
+
+    def test_allocate(self):
+        self.assertEqual(allocate(self.area, Room), 1003)
+        self.assertEqual(allocate(self.area, Room), 1004)
+        self.assertEqual(allocate(self.area, Mobile), 1001)
+        # Items use 1001, 1002 and 1010-1012.
+        self.assertEqual(allocate(self.area, Light, count=5), 1003)
+        self.assertEqual(allocate(self.area, Item, count=10), 1013)
+        self.assertRaises(VnumError, allocate, self.area, Item, count=80)
+
+        room = create(Room, self.area, notes='')
+        self.assertEqual(room.vnum, 1005)
+        room.delete()
+        with self.assertNumQueries(2):
+            self.assertEqual(allocate(self.area, Room), 1005)
+
+    def test_stale_index_is_reloaded(self):
+        self.assertEqual(allocate(self.area, Room), 1003)
+        # Behind this process's back, so the index still has 1002 used.
+        Room.objects.filter(area=self.area, vnum=1002).update(vnum=1004)
+        self.assertEqual(allocate(self.area, Room), 1002)
+
+    def test_blank_vnums_are_allocated(self):
+        refs = apply_batch([
+            {'op': 'create', 'model': 'room', 'ref': 'a', 'fields': {'area': self.area.pk, 'notes': 'x'}},
+            {'op': 'create', 'model': 'room', 'ref': 'b', 'fields': {'area': self.area.pk, 'notes': 'x'}},
+            {'op': 'create', 'model': 'room', 'ref': 'c', 'fields': {'area': self.area.pk, 'vnum': 1050, 'notes': 'x'}},
+            ])
+        self.assertEqual([Room.objects.get(pk=refs[ref]).vnum for ref in 'abc'], [1003, 1004, 1050])
+
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        response = self.client.post('/admin/core/room/add/?area=%d' % (self.area.pk),
+                                    {'area': self.area.pk, 'vnum': '', 'notes': 'New.'})
+        self.assertEqual(response.status_code, 302)
+        room = Room.objects.get(notes='New.')
+        self.assertEqual(room.vnum, 1005)
+        # An existing row keeps needing one.
+        response = self.client.post('/admin/core/room/%d/' % (room.pk), {'area': self.area.pk, 'vnum': '', 'notes': 'x'})
+        self.assertContains(response, 'This field is required.')
+
+    def test_next_area_vnum(self):
+        self.assertEqual(next_area_vnum(), 100)
+        self.assertEqual(next_area_vnum(1000), 1100)
+        build_area(vnum=1100, rooms=1, name='Next Area')
+        self.assertEqual(next_area_vnum(1000), 1200)
+
+
+class ResetSimulatorTest(TestCase):
+    def setUp(self):
+        self.area = build_area()
+        self.mob = Mobile.objects.get(area=self.area)
+        self.rooms = list(Room.objects.filter(area=self.area).order_by('vnum'))
+        self.key = Key.objects.get(area=self.area)
+        self.chest = Container.objects.get(area=self.area)
+
+    def test_caps(self):
+        ItemRoomReset.objects.create(room=self.rooms[0], item=self.chest)
+        put = ItemContainerReset.objects.create(container=self.chest, item=self.key)
+        with self.assertNumQueries(5):
+            simulator = ResetSimulator(self.area)
+        with self.assertNumQueries(0):
+            simulator.run(10)
+        self.assertEqual(simulator.populations(), {self.rooms[-1].pk: {self.mob.pk: 1}})
+        lights = dict((room.pk, {Light.objects.get(room_resets__room=room).pk: 1}) for room in self.rooms)
+        lights[self.rooms[-1].pk][self.key.pk] = 1
+        lights[self.rooms[0].pk][self.chest.pk] = 1
+        self.assertEqual(simulator.room_items(), lights)
+        self.assertEqual(simulator.container_items(), {})
+        # The shopkeeper took the only key, so the chest stays empty.
+        self.assertEqual(simulator.cap_hits(), [
+            (MobRoomReset, MobRoomReset.objects.get().pk, 1, 9),
+            (ItemContainerReset, put.pk, 0, 10),
+            ])
+
+    def test_deserted_only_resets_wait_for_players_to_leave(self):
+        Mobile.objects.filter(pk=self.mob.pk).update(total_in_game=5)
+        simulator = ResetSimulator(self.area)
+        simulator.run(4, occupied=[1, 2])
+        self.assertEqual(simulator.populations(), {self.rooms[-1].pk: {self.mob.pk: 2}})
+        simulator.run(2, occupied=[4], attrition=1.0, seed=0)
+        # Everything was killed or taken in cycle 4 and reset in cycle 5.
+        self.assertEqual(simulator.populations(), {self.rooms[-1].pk: {self.mob.pk: 1}})
+        self.assertEqual(simulator.mobile_totals[0], 1)
+
+
+class AdminScopeTest(TestCase):
+    def setUp(self):
+        self.area = build_area()
+        self.other = build_area(vnum=2000, rooms=2, name='Other Area')
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+
+    def test_change_form_lists_only_current_values(self):
+        door = Door.objects.filter(room__area=self.area).order_by('pk')[0]
+        response = self.client.get('/admin/core/door/%d/' % (door.pk))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '/autocomplete/room/?area=%d' % (self.area.pk))
+        self.assertContains(response, '/autocomplete/room/"')
+        self.assertContains(response, '<option value="%d" selected="selected">' % (door.room_id))
+        # Only the two selected rooms and the blank choices are listed.
+        # Only the selected rooms are listed.
+        self.assertContains(response, '>1000</option>')
+        self.assertNotContains(response, '>1002</option>')
+        self.assertNotContains(response, '>2000</option>')
+
+    def test_other_areas_rows_are_refused(self):
+        reset = MobItemReset.objects.get(mobile__area=self.area)
+        foreign = Key.objects.get(area=self.other)
+        response = self.client.post('/admin/core/mobitemreset/%d/' % (reset.pk), {
+            'mobile': reset.mobile_id, 'item': foreign.pk, 'wear_location': '', 'comment': ''})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Select a valid choice')
+        self.assertEqual(MobItemReset.objects.get(pk=reset.pk).item_id, reset.item_id)
+
+    def test_autocomplete(self):
+        response = self.client.get('/autocomplete/key/', {'q': 'key', 'area': self.other.pk})
+        foreign = Key.objects.get(area=self.other)
+        self.assertEqual(json.loads(response.content), [{'id': foreign.pk, 'label': '2001 a key'}])
+        response = self.client.get('/autocomplete/room/', {'q': '2001'})
+        self.assertEqual([row['label'] for row in json.loads(response.content)], ['2001'])
+
+    def test_conflicts_are_refused_until_the_form_is_reloaded(self):
+        room = Room.objects.get(area=self.area, vnum=1001)
+        url = '/admin/core/room/%d/' % (room.pk)
+        form = self.client.get(url).context['adminform'].form
+        data = dict((name, '' if value is None else value) for name, value in form.initial.items() if name in form.fields)
+        data.update(notes='Mine.', row_version=room.row_version)
+        Room.objects.get(pk=room.pk).save()
+        for attempt in range(2):
+            response = self.client.post(url, data)
+            self.assertContains(response, 'changed by someone else')
+            self.assertContains(response, '<input type="hidden" name="row_version" value="%d" />' % (room.row_version))
+            data['row_version'] = response.context['adminform'].form.data['row_version']
+        self.assertEqual(Room.objects.get(pk=room.pk).notes, '')
+        data['row_version'] = room.row_version + 1
+        self.assertEqual(self.client.post(url, data).status_code, 302)
+        self.assertEqual(Room.objects.get(pk=room.pk).notes, 'Mine.')
+
+    def test_changelist(self):
+        response = self.client.get('/admin/core/mobitemreset/')
+        self.assertContains(response, '1001 a key')
+
+
+class KeysetChangeListTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.area = build_area(rooms=5)
+        self.other = build_area(vnum=2000, rooms=4, name='Other Area')
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        self.original_per_page = RoomAdmin.list_per_page
+        RoomAdmin.list_per_page = 3
+
+    def tearDown(self):
+        RoomAdmin.list_per_page = self.original_per_page
+
+    def rooms(self, response):
+        return [(room.area_id, room.vnum) for room in response.context['cl'].result_list]
+
+    def test_pages_follow_key(self):
+        response = self.client.get('/admin/core/room/')
+        self.assertEqual(self.rooms(response), [(self.area.pk, 1000), (self.area.pk, 1001), (self.area.pk, 1002)])
+        self.assertContains(response, 'About 9 rooms')
+        seen = self.rooms(response)
+        while response.context['cl'].next_url:
+            response = self.client.get('/admin/core/room/' + response.context['cl'].next_url)
+            seen.extend(self.rooms(response))
+        self.assertEqual(seen, sorted(Room.objects.values_list('area', 'vnum')))
+
+    def test_filters_keep_working(self):
+        response = self.client.get('/admin/core/room/', {'area__id__exact': self.other.pk, 'after': '%d,2001' % (self.other.pk)})
+        self.assertEqual(self.rooms(response), [(self.other.pk, 2002), (self.other.pk, 2003)])
+        self.assertEqual(response.context['cl'].next_url, None)
+
+    def test_counts_are_cached(self):
+        self.client.get('/admin/core/room/')
+        cl = self.client.get('/admin/core/room/').context['cl']
+        # The total is cached, so the new room isn't counted until it expires.
+        Room.objects.create(area=self.area, vnum=1050, notes='')
+        self.assertEqual(self.client.get('/admin/core/room/').context['cl'].result_count, cl.result_count)
+
+    def test_sorting_falls_back_to_numbered_pages(self):
+        response = self.client.get('/admin/core/room/', {'o': '-1'})
+        self.assertFalse(response.context['cl'].keyset_active)
+        self.assertEqual(response.context['cl'].paginator.num_pages, 3)
+
+
+# One query per table read or written, for any size of area, ten to
+# index the copy for search and three to raise its API revision.
+CLONE_QUERIES = 62
+
+
+class CloneTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_clone_remaps_vnums_and_references(self):
+        area = build_area(vnum=1000)
+        shop = Shopkeeper.objects.get(mobile__area=area)
+        shop.reset_items = [Item.objects.get(area=area, vnum=1010)]
+        clone = area.clone(3000, 'Clone', User.objects.create(username='cloner'))
+
+        self.assertEqual(sorted(Room.objects.filter(area=clone).values_list('vnum', flat=True)), [3000, 3001, 3002])
+        chest = Container.objects.get(area=clone, vnum=3002)
+        self.assertEqual((chest.key.area_id, chest.key.vnum), (clone.pk, 3001))
+        self.assertEqual(chest.type_values, '4 0 3001 0')
+        self.assertEqual(chest.extra_descriptions.get().keywords, 'lid')
+        self.assertEqual(Light.objects.get(area=clone, vnum=3012).hours, 2)
+        for door in Door.objects.filter(room__area=clone):
+            self.assertEqual(door.room_to.area_id, clone.pk)
+        shop = Shopkeeper.objects.get(mobile__area=clone)
+        self.assertEqual([item.vnum for item in shop.reset_items.all()], [3010])
+        self.assertEqual(AreaHelp.objects.get(area=clone).keywords, 'TEST AREA')
+        reset = MobRoomReset.objects.get(mobile__area=clone)
+        self.assertEqual(reset.room.vnum, 3002)
+        self.assertEqual(MobItemReset.objects.get(mobile__area=clone).item.vnum, 3001)
+        self.assertEqual(ItemRoomReset.objects.filter(room__area=clone, item__area=clone).count(), 3)
+        self.assertTrue(u'M 0 3000 1 3002\nG 0 3001 1\n' in u''.join(AreaExporter(clone)))
+
+    def test_query_count_is_constant(self):
+        for vnum, rooms in ((1000, 3), (2000, 10)):
+            area = build_area(vnum=vnum, rooms=rooms, name='Area %d' % (vnum))
+            registry()
+            author = User.objects.create(username='cloner%d' % (vnum))
+            with self.assertNumQueries(CLONE_QUERIES):
+                area.clone(vnum + 5000, 'Clone %d' % (vnum), author)
+
+    def test_copy_rooms_into_same_area(self):
+        area = build_area(vnum=1000)
+        copier = copy_rooms(Room.objects.filter(area=area, vnum__gte=1001), area, 50)
+        self.assertEqual(sorted(Room.objects.filter(area=area).values_list('vnum', flat=True)),
+                         [1000, 1001, 1002, 1051, 1052])
+        # The shopkeeper is reset in room 1002, so comes along with his key.
+        self.assertEqual(Mobile.objects.get(area=area, vnum=1050).room_resets.get().room.vnum, 1052)
+        self.assertTrue(Item.objects.filter(area=area, vnum=1051).exists())
+        # The exit back to 1000 still leads there.
+        door = Door.objects.get(room__vnum=1051, direction='3')
+        self.assertEqual(door.room_to.vnum, 1000)
+        self.assertEqual(len(copier.pks[Room]), 2)
+        self.assertRaises(CloneError, copy_rooms, Room.objects.filter(area=area, vnum=1001), area, 50)
+
+
+class BatchEditTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.area = build_area(vnum=1000)
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        self.door_type = DoorType.objects.get()
+        self.room = Room.objects.get(area=self.area, vnum=1002)
+
+    def post(self, operations):
+        response = self.client.post('/batch/', json.dumps(operations), content_type='application/json')
+        return response.status_code, json.loads(response.content)
+
+    def door(self, room, room_to, direction):
+        return {'op': 'create', 'model': 'door', 'fields': {
+            'room': room, 'room_to': room_to, 'direction': direction, 'door_type': self.door_type.pk,
+            'name': 'door', 'keywords': 'door', 'notes': 'x'}}
+
+    def test_creates_with_refs(self):
+        torch = Item.objects.get(area=self.area, vnum=1010)
+        status, response = self.post([
+            {'op': 'create', 'model': 'room', 'ref': 'a', 'fields': {'area': self.area.pk, 'vnum': 1003, 'notes': 'x'}},
+            {'op': 'create', 'model': 'room', 'ref': 'b', 'fields': {'area': self.area.pk, 'vnum': 1004, 'notes': 'x'}},
+            self.door(self.room.pk, {'ref': 'a'}, 1),
+            self.door({'ref': 'a'}, self.room.pk, 3),
+            self.door({'ref': 'a'}, {'ref': 'b'}, 1),
+            {'op': 'create', 'model': 'itemroomreset', 'fields': {'room': {'ref': 'b'}, 'item': torch.pk}},
+            {'op': 'update', 'model': 'room', 'pk': self.room.pk, 'fields': {'notes': 'Moved.'}},
+            ])
+        self.assertEqual(status, 200, response)
+        a = Room.objects.get(area=self.area, vnum=1003)
+        self.assertEqual(response['refs'], {'a': a.pk, 'b': a.pk + 1})
+        self.assertEqual(sorted(a.exits.values_list('direction', 'room_to__vnum')), [('1', 1004), ('3', 1002)])
+        self.assertEqual(self.room.exits.get(direction='1').room_to, a)
+        self.assertEqual(ItemRoomReset.objects.get(room__vnum=1004).item, torch)
+        self.assertEqual(Room.objects.get(pk=self.room.pk).notes, 'Moved.')
+
+    def test_bad_batch_writes_nothing(self):
+        rooms = Room.objects.count()
+        status, response = self.post([
+            {'op': 'create', 'model': 'room', 'ref': 'a', 'fields': {'area': self.area.pk, 'vnum': 1003, 'notes': 'x'}},
+            self.door({'ref': 'a'}, 99999, 1),
+            {'op': 'update', 'model': 'mobile', 'pk': 99999, 'fields': {}},
+            {'op': 'delete', 'model': 'area', 'pk': self.area.pk},
+            self.door({'ref': 'c'}, self.room.pk, 1),
+            ])
+        self.assertEqual(status, 400)
+        self.assertEqual(sorted(response['errors']), ['1', '2', '3', '4'], response)
+        self.assertTrue('room_to' in response['errors']['1'])
+        self.assertEqual(Room.objects.count(), rooms)
+
+    def test_conflicts_roll_back(self):
+        status, response = self.post([
+            {'op': 'delete', 'model': 'itemroomreset', 'pk': ItemRoomReset.objects.all()[0].pk},
+            self.door(self.room.pk, self.room.pk, 1),
+            self.door(self.room.pk, Room.objects.get(area=self.area, vnum=1000).pk, 1),
+            ])
+        self.assertEqual(status, 400)
+        self.assertEqual(ItemRoomReset.objects.count(), 3)
+
+    def test_admin_permissions_apply(self):
+        editor = User.objects.create_user('editor', 'editor@example.com', 'editor')
+        editor.is_staff = True
+        editor.save()
+        editor.user_permissions.add(Permission.objects.get(content_type__app_label='core', codename='change_room'))
+        self.client.login(username='editor', password='editor')
+        status, response = self.post([
+            {'op': 'update', 'model': 'room', 'pk': self.room.pk, 'fields': {'notes': 'Moved.'}},
+            {'op': 'delete', 'model': 'room', 'pk': self.room.pk},
+            ])
+        self.assertEqual(status, 400)
+        self.assertEqual(sorted(response['errors']), ['1'])
+        self.assertTrue(Room.objects.filter(pk=self.room.pk).exists())
+        status, response = self.post([
+            {'op': 'update', 'model': 'room', 'pk': self.room.pk, 'fields': {'notes': 'Moved.'}},
+            ])
+        self.assertEqual(status, 200, response)
+
+
+# What each path runs today, counting the session and user lookups of
+# admin requests. Raise one only for a query that doesn't repeat per row.
+CHANGELIST_QUERIES = (
+    ('room', 5),
+    ('door', 5),
+    ('mobile', 5),
+    ('light', 5),
+    ('shopkeeper', 4),
+    ('mobroomreset', 4),
+    ('mobitemreset', 4),
+    ('itemroomreset', 4),
+    ('itemcontainerreset', 4),
+    )
+CHANGE_FORM_QUERIES = (
+    (Room, 7),
+    (Door, 7),
+    (Mobile, 10),
+    (Light, 6),
+    (Container, 8),
+    (Shopkeeper, 8),
+    (MobItemReset, 8),
+    )
+LINT_QUERIES = 10
+# bulk_insert() splits inserts at SQLite's parameter limit, so a big
+# enough area takes a few more. Ten of them index the area for search,
+# and one checks that the author has no other area.
+IMPORT_QUERIES = 38
+
+
+class QueryBudgetTest(TestCase):
+    """
+    The hot paths run a fixed number of queries however big the area is.
+    Each test runs against a small world and again after adding a much
+    larger area, within the same budget.
+    """
+    def setUp(self):
+        cache.clear()
+        self.small = build_area(vnum=1000, rooms=3, guards=2)
+        self.large = None
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+
+    def assertBudget(self, budget, label, run):
+        """
+        Runs ``run(area)`` on the small area, then on a large one.
+        """
+        for size in ('small', 'large'):
+            if size == 'large' and self.large is None:
+                self.large = build_area(vnum=2000, rooms=40, name='Large Area', guards=30)
+            cache.clear()
+            # Load the registry, as any request after the first finds it.
+            registry()
+            with QueryBudget(self, budget, '%s (%s world)' % (label, size)):
+                run(getattr(self, size))
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_changelists(self):
+        for name, budget in CHANGELIST_QUERIES:
+            self.assertBudget(budget, '%s changelist' % (name), lambda area: self.get('/admin/core/%s/' % (name)))
+
+    def test_change_forms(self):
+        for model, budget in CHANGE_FORM_QUERIES:
+            path = admin.site._registry[model].area_path
+            url = lambda area: '/admin/core/%s/%d/' % (model._meta.object_name.lower(),
+                                                       model.objects.filter(**{path: area})[0].pk)
+            self.assertBudget(budget, '%s change form' % (model._meta.object_name), lambda area: self.get(url(area)))
+
+    def test_export(self):
+        self.assertBudget(EXPORT_QUERIES, 'export', lambda area: list(AreaExporter(area)))
+        # Includes the response cache's lookup of the area's pk.
+        self.assertBudget(EXPORT_QUERIES + 7, 'export view',
+                          lambda area: self.get('/areas/%d/export/' % (area.vnum)).content)
+
+    def test_lint(self):
+        self.assertBudget(LINT_QUERIES, 'lint', lint_area)
+
+    def test_import(self):
+        records = []
+        for area in (self.small, build_area(vnum=2000, rooms=40, name='Large Area', guards=30)):
+            records.append(AreaReader(u''.join(AreaExporter(area)).splitlines(True)).read())
+            User.objects.filter(area=area).delete()
+        registry()
+        for record in records:
+            with QueryBudget(self, IMPORT_QUERIES, 'import of %s' % (record['name'])):
+                AreaImporter().create(record)
+
+
+class BenchmarkTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_generated_world(self):
+        warnings = WorldGenerator(areas=3, rooms=12, mobiles=4, items=30, seed=1).build()
+        self.assertEqual(warnings, [])
+        self.assertEqual(Room.objects.count(), 36)
+        self.assertEqual(set(type(item.typed()) for item in Item.objects.all()), set(ITEM_CLASSES.values()))
+        # Each area after the first leads up into the one before it.
+        door = Door.objects.get(room__vnum=200, direction='4')
+        self.assertEqual((door.room_to.area.vnum, door.room_to.vnum), (100, 111))
+        graph = RoomGraph.for_world()
+        self.assertEqual(graph.mismatched_exits(), [])
+
+    def test_same_seed_same_world(self):
+        WorldGenerator(areas=1, rooms=9, mobiles=3, items=5, seed=7).build()
+        first = u''.join(AreaExporter(Area.objects.get()))
+        Area.objects.get().author.delete()
+        WorldGenerator(areas=1, rooms=9, mobiles=3, items=5, seed=7).build()
+        self.assertEqual(u''.join(AreaExporter(Area.objects.get())), first)
+
+    def test_run(self):
+        WorldGenerator(areas=2, rooms=9, mobiles=3, items=10).build()
+        results = Benchmark(sample=1, repeat=1, cycles=10).run()
+        self.assertEqual(sorted(results['scenarios']), sorted(SCENARIOS))
+        self.assertEqual(results['counts']['rooms'], 18)
+        for timing in results['scenarios'].values():
+            self.assertTrue(timing['min'] <= timing['mean'] <= timing['max'])
+        # The import scenario cleans up after itself.
+        self.assertEqual(Area.objects.count(), 2)
+
+
+class SearchTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.area = build_area()
+        self.other = build_area(vnum=2000, name='Other Area')
+
+    def found(self, query, **kwargs):
+        return [(hit.kind, hit.object.pk) for hit in search(query, **kwargs)]
+
+    def test_saves_and_deletes_are_indexed(self):
+        chest = Item.objects.get(area=self.area, vnum=1002)
+        self.assertEqual(self.found('carved', area=self.area.pk), [('extra', chest.extra_descriptions.get().pk)])
+        chest.long_desc = 'An obsidian chest.'
+        chest.save()
+        self.assertEqual(self.found('obsid'), [('item', chest.pk)])
+        chest.long_desc = 'A chest.'
+        chest.save()
+        self.assertEqual(self.found('obsidian'), [])
+
+        door = Door.objects.filter(room__area=self.other)[0]
+        door.description = 'An obsidian arch.'
+        door.save()
+        self.assertEqual(self.found('obsidian'), [('door', door.pk)])
+        door.delete()
+        self.assertEqual(self.found('obsidian'), [])
+
+    def test_ranking_and_scopes(self):
+        mob = Mobile.objects.get(area=self.area)
+        mob.look_desc = 'He wears a torch on his hat.'
+        mob.save()
+        hits = self.found('torch')
+        # Keywords outrank descriptions.
+        self.assertEqual(hits[-1], ('mobile', mob.pk))
+        self.assertEqual(len(hits), 7)
+        self.assertEqual(len(self.found('torch', area=self.other.pk)), 3)
+        self.assertEqual(self.found('torch', kinds=['mobile']), [('mobile', mob.pk)])
+        self.assertEqual(self.found('"*)'), [])
+
+    def test_imports_and_copies_are_indexed(self):
+        record = AreaReader(u''.join(AreaExporter(self.area)).splitlines(True)).read()
+        record.update(vnum=3000, name='Imported', author='importer')
+        imported = AreaImporter().create(record)
+        self.assertEqual(len(self.found('lid carved', area=imported.pk)), 1)
+        clone = self.area.clone(4000, 'Clone', User.objects.create(username='cloner'))
+        self.assertEqual([hit.object.vnum for hit in search('key', area=clone.pk, kinds=['item'])], [4001])
+
+    def test_view(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        response = self.client.get('/search/', {'q': 'carved', 'area': self.other.pk})
+        self.assertEqual(json.loads(response.content)[0]['snippet'], 'The lid is [carved].')
+
+
+class SearchCommitTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.area = build_area()
+
+    def found(self, query):
+        # Whatever wasn't committed is gone, as it would be for another process.
+        transaction.rollback()
+        return [(hit.kind, hit.object.pk) for hit in search(query)]
+
+    def test_index_writes_are_committed(self):
+        room = Room.objects.get(area=self.area, vnum=1001)
+        room.notes = 'Obsidian walls.'
+        room.save()
+        self.assertEqual(self.found('obsidian'), [('room', room.pk)])
+        room.delete()
+        self.assertEqual(self.found('obsidian'), [])
+
+        connections[DEFAULT_DB_ALIAS].cursor().execute('DELETE FROM core_search')
+        transaction.commit_unless_managed()
+        call_command('rebuild_search_index')
+        self.assertEqual(len(self.found('torch')), 3)
+
+
+class AreaDiffTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.area = build_area()
+        self.old = Snapshot.from_lines(u''.join(AreaExporter(self.area)).splitlines(True))
+
+    def test_unchanged(self):
+        diff = AreaDiff(self.old, Snapshot.from_area(self.area))
+        self.assertFalse(diff)
+        self.assertEqual(list(diff.lines()), [])
+
+    def test_changes(self):
+        door = Door.objects.get(room__vnum=1001, direction='1')
+        door.description = u'A narrow gap.\nIt is dark.'
+        door.save()
+        Mobile.objects.filter(area=self.area).update(level=12)
+        light = Light.objects.get(area=self.area, vnum=1012)
+        light.hours = 99
+        light.save()
+        ItemRoomReset.objects.filter(item__vnum=1011).delete()
+        Room.objects.create(area=self.area, vnum=1050, notes='')
+
+        diff = AreaDiff(self.old, Snapshot.from_area(self.area))
+        self.assertEqual(diff.added, [('room', 1050)])
+        self.assertEqual(diff.removed, [('reset', u'O', 1011, 1001)])
+        changed = dict(diff.changed)
+        self.assertEqual([key for key, changes in diff.changed], [('door', 1001, u'1'), ('mobile', 1000), ('item', 1012)])
+        self.assertEqual(changed[('mobile', 1000)], {'level': (1, 12)})
+        self.assertEqual(changed[('item', 1012)], {'values': ([0, 0, 2, 0], [0, 0, 99, 0])})
+        text = u''.join(diff.lines())
+        self.assertTrue(u'+ room 1050\n- reset O 1011 1001\n~ door 1001 east\n' in text)
+        self.assertTrue(u'      + It is dark.\n' in text)
+        self.assertEqual(diff.as_dict()['changed'][1]['fields']['level'], {'old': 1, 'new': 12})
+
+
+class SnapshotTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.area = build_area(rooms=10)
+        self.text = u''.join(AreaExporter(self.area))
+
+    def test_versions_share_unchanged_pieces(self):
+        first = take_snapshot(self.area, 'approved')
+        blobs = SnapshotBlob.objects.count()
+        self.assertEqual(take_snapshot(self.area), first)
+        self.assertEqual(SnapshotBlob.objects.count(), blobs)
+
+        mob = Mobile.objects.get(area=self.area)
+        mob.long_desc = 'A shopkeeper yawns.'
+        mob.save()
+        second = take_snapshot(self.area)
+        self.assertEqual((first.number, second.number), (1, 2))
+        # The mob's fragment and the new manifest.
+        self.assertEqual(SnapshotBlob.objects.count(), blobs + 2)
+        self.assertEqual(u''.join(export_version(first)), self.text)
+        self.assertTrue(u'A shopkeeper yawns.~\n' in u''.join(export_version(second)))
+        diff = AreaDiff(version_snapshot(first), version_snapshot(second))
+        self.assertEqual([key for key, changes in diff.changed], [('mobile', 1000)])
+
+    def test_restore(self):
+        version = take_snapshot(self.area)
+        Room.objects.filter(area=self.area, vnum=1005).delete()
+        Mobile.objects.filter(area=self.area).update(level=30)
+        area = restore_version(version)
+        self.assertEqual(u''.join(AreaExporter(area)), self.text)
+        self.assertEqual(list(area.versions.all()), [version])
+
+    def test_restore_keeps_exits_from_other_areas(self):
+        other = build_area(vnum=2000, rooms=2, name='Other Area')
+        Door.objects.create(room=Room.objects.get(area=other, vnum=2001),
+                            room_to=Room.objects.get(area=self.area, vnum=1000),
+                            direction='4', door_type=DoorType.objects.get(), name='stair', keywords='stair', notes='')
+        other_text = u''.join(AreaExporter(other))
+        area = restore_version(take_snapshot(self.area))
+        self.assertEqual(Door.objects.filter(room__area=other).count(), 3)
+        self.assertEqual(Door.objects.get(room__area=other, direction='4').room_to.area, area)
+        self.assertEqual(u''.join(AreaExporter(other)), other_text)
+
+
+class WorldBundleTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.area = build_area()
+        self.other = build_area(vnum=2000, rooms=2, name='Test Area!')
+        Door.objects.create(room=Room.objects.get(area=self.area, vnum=1002),
+                            room_to=Room.objects.get(area=self.other, vnum=2000),
+                            direction='4', door_type=DoorType.objects.get(), name='stair', keywords='stair', notes='')
+
+    def test_checks(self):
+        self.assertEqual(check_world(), [])
+        Room.objects.filter(area=self.other, vnum=2001).update(vnum=1999)
+        found = [(d.area, d.rule, d.message) for d in check_world(Area.objects.filter(pk=self.area.pk))]
+        self.assertEqual(found, [(1000, 'world_exit', 'Up exit from room 1002 leads into area 2000, which isn\'t bundled')])
+        found = [(d.area, d.rule, d.message) for d in check_world()]
+        self.assertEqual(found, [(2000, 'vnum_range', 'room 1999 is outside the area\'s vnums')])
+
+    def test_bundle(self):
+        output = StringIO()
+        names = write_bundle(output, processes=1)
+        self.assertEqual(names, ['test-area.are', 'test-area-2000.are'])
+        archive = tarfile.open(fileobj=StringIO(output.getvalue()), mode='r:gz')
+        self.assertEqual(archive.getnames(), ['area/test-area.are', 'area/test-area-2000.are', 'area/area.lst'])
+        self.assertEqual(archive.extractfile('area/area.lst').read(), 'test-area.are\ntest-area-2000.are\n$\n')
+        self.assertEqual(archive.extractfile('area/test-area-2000.are').read().decode('utf-8'),
+                         u''.join(AreaExporter(self.other)))
+
+
+class AreaApiTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.area = build_area()
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        self.url = '/api/areas/%d/' % (self.area.vnum)
+
+    def test_conditional_get(self):
+        response = self.client.get(self.url)
+        data = json.loads(response.content)
+        self.assertEqual(response['ETag'], '"%s"' % (data['version']))
+        self.assertEqual(len(data['rooms']), Room.objects.filter(area=self.area).count())
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        listed = json.loads(self.client.get('/api/areas/').content)
+        self.assertEqual([(area['vnum'], area['version']) for area in listed], [(1000, data['version'])])
+
+        mob = Mobile.objects.get(area=self.area)
+        mob.level = 20
+        mob.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], '"%s"' % (data['version']))
+
+    def test_delta(self):
+        version = json.loads(self.client.get(self.url).content)['version']
+        mob = Mobile.objects.get(area=self.area)
+        mob.level = 20
+        mob.save()
+        room = Room.objects.get(area=self.area, vnum=1001)
+        room_pk = room.pk
+        exits = sorted(Door.objects.filter(Q(room=room) | Q(room_to=room)).values_list('pk', flat=True))
+        room.delete()
+        delta = json.loads(self.client.get(self.url, {'since': version}).content)
+        self.assertEqual(delta['since'], version)
+        self.assertEqual([row['level'] for row in delta['changed']['mobiles']], [20])
+        self.assertEqual(delta['deleted']['rooms'], [room_pk])
+        self.assertEqual(delta['deleted']['exits'], exits)
+        self.assertFalse('full' in delta)
+        latest = json.loads(self.client.get(self.url, {'since': delta['version']}).content)
+        self.assertEqual((latest['changed'], latest['deleted']), ({}, {}))
+        self.assertEqual(self.client.get(self.url, {'since': 'latest'}).status_code, 400)
+
+    def test_moved_rows_are_deleted_from_their_old_area(self):
+        other = build_area(vnum=2000, rooms=1, name='Other Area')
+        version = json.loads(self.client.get(self.url).content)['version']
+        other_url = '/api/areas/%d/' % (other.vnum)
+        other_version = json.loads(self.client.get(other_url).content)['version']
+        mob = Mobile.objects.get(area=self.area)
+        mob.area = other
+        mob.save()
+        delta = json.loads(self.client.get(self.url, {'since': version}).content)
+        self.assertEqual(delta['deleted']['mobiles'], [mob.pk])
+        delta = json.loads(self.client.get(other_url, {'since': other_version}).content)
+        self.assertEqual([row['id'] for row in delta['changed']['mobiles']], [mob.pk])
+
+    def test_rows_rewritten_by_update_are_logged(self):
+        mob = Mobile.objects.get(area=self.area)
+        chest = Item.objects.get(area=self.area, vnum=1002)
+        sentinel = ActionFlag.objects.create(TFC_id=1, name='sentinel', description='')
+        mob.action_flags.add(sentinel)
+
+        def changed(version, resource):
+            delta = json.loads(self.client.get(self.url, {'since': version}).content)
+            self.assertFalse('full' in delta)
+            return [row['id'] for row in delta['changed'].get(resource, [])]
+
+        # The containers a key opens print its vnum.
+        version = json.loads(self.client.get(self.url).content)['version']
+        key = Key.objects.get(area=self.area)
+        key.vnum = 1099
+        key.save()
+        self.assertEqual(changed(version, 'items'), [key.pk, chest.pk])
+
+        # The mobs with a flag hold its TFC_id in their vectors.
+        version = json.loads(self.client.get(self.url).content)['version']
+        sentinel.TFC_id = 7
+        sentinel.save()
+        self.assertEqual(changed(version, 'mobiles'), [mob.pk])
+        version = json.loads(self.client.get(self.url).content)['version']
+        sentinel.name = 'still'
+        sentinel.save()
+        self.assertEqual(changed(version, 'mobiles'), [])
+        sentinel.mobile_set.clear()
+        self.assertEqual(changed(version, 'mobiles'), [mob.pk])
+        self.assertEqual(Mobile.objects.get(pk=mob.pk).action_flags_vector, 0)
+
+        # The area's own row has no resource of its own.
+        version = json.loads(self.client.get(self.url).content)['version']
+        self.area.name = 'Renamed Area'
+        self.area.save()
+        self.assertNotEqual(json.loads(self.client.get(self.url).content)['version'], version)
+
+    def test_untracked_changes_resend_the_area(self):
+        version = json.loads(self.client.get(self.url).content)['version']
+        copy_rooms(Room.objects.filter(area=self.area, vnum=1001), self.area, 49)
+        delta = json.loads(self.client.get(self.url, {'since': version}).content)
+        self.assertTrue(delta['full'])
+        self.assertTrue(1050 in [row['vnum'] for row in delta['rooms']])
+
+
+class AreaCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.area = build_area()
+        self.other = build_area(vnum=2000, rooms=2, name='Other Area')
+
+    def build(self, value):
+        self.built.append(value)
+        return value
+
+    def test_saves_and_deletes_bump_their_area(self):
+        self.built = []
+        for value in ('one', 'two'):
+            self.assertEqual(cached(self.area.pk, 'page', lambda: self.build(value)), 'one')
+        self.assertEqual(self.built, ['one'])
+
+        mob = Mobile.objects.get(area=self.other)
+        mob.level = 20
+        mob.save()
+        self.assertEqual(cached(self.area.pk, 'page', lambda: self.build('two')), 'one')
+        mob = Mobile.objects.get(area=self.area)
+        mob.level = 20
+        mob.save()
+        self.assertEqual(cached(self.area.pk, 'page', lambda: self.build('two')), 'two')
+
+        # Doors deleted along with their room still find their area.
+        number = revision(self.area.pk)[0]
+        self.assertEqual(Door.objects.filter(room__area=self.area).count(), 4)
+        Room.objects.filter(area=self.area).delete()
+        self.assertTrue(revision(self.area.pk)[0] > number)
+
+    def test_file_backend(self):
+        location = tempfile.mkdtemp()
+        area_cache_module.cache = get_cache('django.core.cache.backends.filebased.FileBasedCache', LOCATION=location)
+        try:
+            self.assertEqual(cached(self.area.pk, 'page', lambda: 'one'), 'one')
+            self.assertEqual(cached(self.area.pk, 'page', lambda: 'two'), 'one')
+            room = Room.objects.get(area=self.area, vnum=1001)
+            room.notes = 'Dusty.'
+            room.save()
+            self.assertEqual(cached(self.area.pk, 'page', lambda: 'two'), 'two')
+        finally:
+            area_cache_module.cache = cache
+            shutil.rmtree(location)
+
+    def test_views(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        url = '/areas/%d/layout/' % (self.area.vnum)
+        rooms = json.loads(self.client.get(url).content)
+        with self.assertNumQueries(3):
+            self.assertEqual(json.loads(self.client.get(url).content), rooms)
+        Room.objects.filter(area=self.area, vnum=1002).delete()
+        self.assertEqual(sorted(json.loads(self.client.get(url).content)), ['1000', '1001'])
+
+        # Exports stream from core.export_cache's blocks.
+        url = '/areas/%d/export/' % (self.area.vnum)
+        response = self.client.get(url)
+        self.assertEqual(''.join(response), ''.join(AreaExporter(self.area)).encode('utf-8'))
+        mob = Mobile.objects.get(area=self.area)
+        mob.long_desc = 'A shopkeeper yawns.'
+        mob.save()
+        self.assertTrue('A shopkeeper yawns.~\n' in self.client.get(url).content)
+
+    def test_moves_drop_the_area_left(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        url = '/areas/%d/export/' % (self.area.vnum)
+        self.assertTrue('A shopkeeper waits.~\n' in self.client.get(url).content)
+        mob = Mobile.objects.get(area=self.area)
+        mob.area = self.other
+        mob.vnum = 2050
+        mob.save()
+        self.assertFalse('A shopkeeper waits.~\n' in self.client.get(url).content)
+
+
+class ChangeFeedTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.area = build_area()
+        # Left by rows saved in this and earlier tests' transactions.
+        drop_callbacks()
+        feed_module._backend = LocalBackend()
+        feed_module.FEED_TIMEOUT = 0
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+
+    def tearDown(self):
+        feed_module._backend = None
+        feed_module.FEED_TIMEOUT = FEED_TIMEOUT
+
+    def events(self, since, timeout=0):
+        # As if the test's transaction had committed.
+        run_callbacks()
+        number, floor = revision(self.area.pk)
+        text = ''.join(stream(self.area.pk, since, number, floor, timeout))
+        return [(block.split('\n')[-2][len('event: '):] if 'event: ' in block else None,
+                 json.loads(block.split('data: ', 1)[1]) if 'data: ' in block else None)
+                for block in text.split('\n\n')[1:-1]]
+
+    def test_events(self):
+        since = revision(self.area.pk)[0]
+        mob = Mobile.objects.get(area=self.area)
+        mob.level = 20
+        mob.long_desc = 'A shopkeeper yawns.'
+        mob.save()
+        mob.level = 21
+        mob.save()
+        room = Room.objects.get(area=self.area, vnum=1000)
+        room_pk = room.pk
+        room.delete()
+        events = self.events(since)
+        self.assertEqual(events[0], ('change', {'id': '%d-%d' % (self.area.pk, since + 1), 'kind': 'mobiles',
+                                                 'model': 'mobile', 'pk': mob.pk,
+                                                 'fields': ['long_desc', 'level'], 'row_version': 1}))
+        self.assertEqual(events[1][1]['fields'], ['level'])
+        self.assertEqual(events[-1][1], {'id': version_token(self.area.pk, revision(self.area.pk)[0]),
+                                         'kind': 'rooms', 'model': 'room', 'pk': room_pk, 'deleted': True})
+        self.assertEqual(self.events(None), [])
+
+    def test_resync(self):
+        since = revision(self.area.pk)[0]
+        copy_rooms(Room.objects.filter(area=self.area, vnum=1001), self.area, 49)
+        self.assertEqual(self.events(since)[0], ('resync', {'id': version_token(self.area.pk, since + 1)}))
+        # Changes from before this process's backend started.
+        Mobile.objects.get(area=self.area).save()
+        run_callbacks()
+        feed_module._backend = LocalBackend()
+        number = revision(self.area.pk)[0]
+        self.assertEqual(self.events(number - 1), [('resync', {'id': version_token(self.area.pk, number)})])
+
+    def test_waits_for_changes(self):
+        since = revision(self.area.pk)[0]
+        event = {'id': version_token(self.area.pk, since + 1), 'kind': 'rooms', 'model': 'room', 'pk': 1}
+        thread = threading.Timer(0.2, feed_module._backend.publish, [self.area.pk, since + 1, event])
+        thread.start()
+        try:
+            self.assertEqual(self.events(since, timeout=5), [('change', event)])
+        finally:
+            thread.join()
+
+    def test_unpublished_events_resync(self):
+        since = revision(self.area.pk)[0]
+        event = {'id': version_token(self.area.pk, since + 2), 'kind': 'rooms', 'model': 'room', 'pk': 1}
+        feed_module._backend.publish(self.area.pk, since + 2, event)
+        self.assertEqual(self.events(since), [('resync', {'id': version_token(self.area.pk, since + 2)})])
+
+    def test_cache_backend(self):
+        feed_module._backend = CacheBackend(interval=0.01)
+        since = revision(self.area.pk)[0]
+        Mobile.objects.get(area=self.area).save()
+        self.assertEqual([kind for kind, event in self.events(since)], ['change'])
+        self.assertEqual(feed_module._backend.events(self.area.pk, since + 1, 0.05), [])
+
+    def test_view(self):
+        response = self.client.get('/areas/%d/feed/' % (self.area.vnum), HTTP_LAST_EVENT_ID='0-0')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertTrue('event: resync\n' in ''.join(response))
+        self.assertEqual(self.client.get('/areas/%d/feed/' % (self.area.vnum), {'since': 'x'}).status_code, 400)
+
+
+class ConcurrentEditTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.area = build_area()
+
+    def test_conflicting_saves(self):
+        first = Room.objects.get(area=self.area, vnum=1001)
+        second = Room.objects.get(pk=first.pk)
+        first.notes = 'First.'
+        first.save()
+        second.notes = 'Second.'
+        self.assertRaises(ConflictError, second.save)
+        self.assertEqual(Room.objects.filter(pk=first.pk).values_list('notes', 'row_version')[0], ('First.', 1))
+        # Item types keep the version on the Item row.
+        light = Light.objects.get(area=self.area, vnum=1012)
+        stale = Light.objects.get(pk=light.pk)
+        light.save()
+        self.assertRaises(ConflictError, stale.save)
+
+    def test_form_refuses_stale_version(self):
+        form_class = modelform_factory(Room, form=VersionedModelForm, fields=('notes',))
+        room = Room.objects.get(area=self.area, vnum=1001)
+        Room.objects.get(pk=room.pk).save()
+        form = form_class({'notes': 'Mine.', 'row_version': '0'}, instance=Room.objects.get(pk=room.pk))
+        self.assertFalse(form.is_valid())
+        form = form_class({'notes': 'Mine.', 'row_version': '1'}, instance=Room.objects.get(pk=room.pk))
+        self.assertTrue(form.is_valid())
+
+    def test_batch_checks_row_version(self):
+        mob = Mobile.objects.get(area=self.area)
+        update = {'op': 'update', 'model': 'mobile', 'pk': mob.pk, 'fields': {'level': 5, 'notes': 'x', 'row_version': 0}}
+        self.assertEqual(apply_batch([update]), {})
+        try:
+            apply_batch([update])
+        except BatchError as e:
+            self.assertEqual(e.errors, {0: {'row_version': ['Changed by someone else since version 0.']}})
+        else:
+            self.fail('stale row_version was accepted')
+        self.assertEqual(Mobile.objects.get(pk=mob.pk).row_version, 1)
+
+    def test_rolled_back_changes_are_not_published(self):
+        drop_callbacks()
+        feed_module._backend = backend = LocalBackend()
+        try:
+            room = Room.objects.get(area=self.area, vnum=1001)
+            since = revision(self.area.pk)[0]
+            self.assertRaises(BatchError, apply_batch, [
+                {'op': 'update', 'model': 'room', 'pk': room.pk, 'fields': {'notes': 'Gone.'}},
+                {'op': 'create', 'model': 'room', 'fields': {'area': self.area.pk, 'vnum': 1002, 'notes': 'x'}},
+                ])
+            self.assertEqual(revision(self.area.pk)[0], since)
+            self.assertEqual(backend.events(self.area.pk, since, 0), [])
+            apply_batch([{'op': 'update', 'model': 'room', 'pk': room.pk, 'fields': {'notes': 'Kept.'}}])
+            events = backend.events(self.area.pk, since, 0)
+            self.assertEqual([(event['id'], event['row_version']) for event in events],
+                             [(version_token(self.area.pk, since + 1), 1)])
+        finally:
+            feed_module._backend = None
+
+
+class ManagementCommandTest(TestCase):
+    def test_commands_load_on_their_own(self):
+        # Each command imports its own part of core first, as it would from
+        # the shell, rather than after this test run has loaded everything.
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        for name in find_commands(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'management')):
+            process = subprocess.Popen([sys.executable, os.path.join(root, 'manage.py'), name, '--help'],
+                                       cwd=root, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            output, errors = process.communicate()
+            self.assertEqual(process.returncode, 0, '%s failed:\n%s' % (name, errors))
@@ -0,0 +1,13 @@
+from django.conf.urls.defaults import patterns, url
+
+
+urlpatterns = patterns('core.views',
+    url(r'^areas/(?P<vnum>\d+)/export/$', 'export_area', name='export_area'),
+    url(r'^areas/(?P<vnum>\d+)/feed/$', 'area_feed', name='area_feed'),
+    url(r'^areas/(?P<vnum>\d+)/layout/$', 'room_layout', name='room_layout'),
+    url(r'^api/areas/$', 'area_list_json', name='area_list_json'),
+    url(r'^api/areas/(?P<vnum>\d+)/$', 'area_json', name='area_json'),
+    url(r'^batch/$', 'batch_edit', name='batch_edit'),
+    url(r'^search/$', 'search_text', name='search'),
+    url(r'^autocomplete/(?P<model_name>\w+)/$', 'autocomplete_rows', name='autocomplete'),
+)
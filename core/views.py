@@ -0,0 +1,169 @@
+import json
+
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.exceptions import NON_FIELD_ERRORS
+from django.db.models import get_model
+from django.http import (
+    Http404,
+    HttpResponse,
+    HttpResponseBadRequest,
+    HttpResponseNotAllowed,
+    HttpResponseNotModified,
+    )
+from django.shortcuts import get_object_or_404
+from django.template.defaultfilters import slugify
+
+from core.api import TokenError, area_data, area_delta, parse_token, revision, version_token
+from core.area_cache import cache_area_view, cached
+from core.batch import BatchError, apply_batch
+from core.export_cache import CachedAreaExporter
+from core.feed import stream
+from core.forms import area_path, autocomplete
+from core.layout import area_layout
+from core.models import Area, AreaRevision, Room
+from core.search import KINDS, search
+
+
+@staff_member_required
+def export_area(request, vnum):
+    """
+    Streams the .are file for an area as a download.
+    """
+    area = get_object_or_404(Area, vnum=vnum)
+    response = HttpResponse(CachedAreaExporter(area), content_type='text/plain; charset=utf-8')
+    response['Content-Disposition'] = 'attachment; filename=%s.are' % (slugify(area.name))
+    return response
+
+
+@staff_member_required
+@cache_area_view
+def room_layout(request, vnum):
+    """
+    Grid positions of an area's rooms for the map editor, as JSON mapping
+    each room vnum to [x, y, z].
+    """
+    area = get_object_or_404(Area, vnum=vnum)
+    layout = area_layout(area)
+    vnums = dict(Room.objects.filter(area=area).values_list('pk', 'vnum'))
+    rooms = dict((vnums[pk], cell) for pk, cell in layout.iteritems() if pk in vnums)
+    return HttpResponse(json.dumps(rooms), content_type='application/json')
+
+
+@staff_member_required
+def autocomplete_rows(request, model_name):
+    """
+    Rows of an area-owned model whose vnum or name matches ``q``, as JSON
+    for AutocompleteSelect. ``area`` limits them to one area's.
+    """
+    model = get_model('core', model_name)
+    if model is None or area_path(model) is None:
+        raise Http404
+    area = request.GET.get('area')
+    rows = autocomplete(model, request.GET.get('q', ''), int(area) if area and area.isdigit() else None)
+    return HttpResponse(json.dumps([{'id': obj.pk, 'label': unicode(obj)} for obj in rows]),
+                        content_type='application/json')
+
+
+@staff_member_required
+def batch_edit(request):
+    """
+    Applies a JSON list of create, update and delete operations (see
+    core.batch) in one transaction, if the user has the admin permissions
+    they need. Responds with {"refs": {ref: pk}} for the rows created, or
+    with status 400 and {"errors": {index: {field: [messages]}}} if nothing
+    was written.
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    try:
+        operations = json.loads(request.raw_post_data)
+        response = {'refs': apply_batch(operations, request.user)}
+        status = 200
+    except ValueError:
+        response = {'errors': {NON_FIELD_ERRORS: {NON_FIELD_ERRORS: ['Invalid JSON.']}}}
+        status = 400
+    except BatchError as e:
+        response = {'errors': e.errors}
+        status = 400
+    return HttpResponse(json.dumps(response), content_type='application/json', status=status)
+
+
+@staff_member_required
+def search_text(request):
+    """
+    Objects whose text matches ``q``, best first, as JSON. ``area`` (a pk)
+    and ``kind`` (any of core.search.KINDS, repeatable) narrow the search.
+    """
+    area = request.GET.get('area')
+    kinds = [kind for kind in request.GET.getlist('kind') if kind in KINDS]
+    hits = search(request.GET.get('q', ''), int(area) if area and area.isdigit() else None, kinds)
+    return HttpResponse(json.dumps([{
+        'kind': hit.kind,
+        'id': hit.object.pk,
+        'area': hit.area_pk,
+        'label': unicode(hit.object),
+        'snippet': hit.snippet,
+        } for hit in hits]), content_type='application/json')
+
+
+@staff_member_required
+def area_list_json(request):
+    """
+    Every area's pk, vnum, name and current version token, as JSON.
+    """
+    numbers = dict(AreaRevision.objects.values_list('area', 'number'))
+    return HttpResponse(json.dumps([{
+        'id': pk,
+        'vnum': vnum,
+        'name': name,
+        'version': version_token(pk, numbers.get(pk, 0)),
+        } for pk, vnum, name in Area.objects.order_by('vnum').values_list('pk', 'vnum', 'name')]),
+        content_type='application/json')
+
+
+@staff_member_required
+def area_json(request, vnum):
+    """
+    An area's rows as JSON (see core.api), with its version token as the
+    ETag. Answers 304 if If-None-Match holds the current version, and with
+    only the rows changed since a version given as ``since``.
+    """
+    area = get_object_or_404(Area, vnum=vnum)
+    etag = '"%s"' % (version_token(area.pk, revision(area.pk)[0]))
+    if etag in [tag.strip() for tag in request.META.get('HTTP_IF_NONE_MATCH', '').split(',')]:
+        response = HttpResponseNotModified()
+    else:
+        since = request.GET.get('since')
+        try:
+            if since:
+                content = json.dumps(area_delta(area, since))
+            else:
+                content = cached(area.pk, 'api', lambda: json.dumps(area_data(area)))
+        except TokenError as e:
+            return HttpResponseBadRequest(json.dumps({'error': unicode(e)}), content_type='application/json')
+        response = HttpResponse(content, content_type='application/json')
+    response['ETag'] = etag
+    return response
+
+
+@staff_member_required
+def area_feed(request, vnum):
+    """
+    Changes to an area as server-sent events (see core.feed), from the
+    version in the Last-Event-ID header or ``since``, or from now on.
+    """
+    area = get_object_or_404(Area, vnum=vnum)
+    number, floor = revision(area.pk)
+    token = request.META.get('HTTP_LAST_EVENT_ID') or request.GET.get('since')
+    after = None
+    if token:
+        try:
+            area_pk, after = parse_token(token)
+        except TokenError as e:
+            return HttpResponseBadRequest(json.dumps({'error': unicode(e)}), content_type='application/json')
+        if area_pk != area.pk:
+            # Older than any version of this area, so the client resyncs.
+            after = -1
+    response = HttpResponse(stream(area.pk, after, number, floor), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    return response
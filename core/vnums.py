@@ -0,0 +1,227 @@
+"""
+Free vnum allocation.
+
+Mob, item and room vnums are unique within an area, and each area owns the
+vnums in Area.vnum_range(). IntervalIndex keeps the used vnums as sorted,
+merged ranges, so the next free vnum is a bisect away and a free block of n
+vnums is found by walking the gaps from there. Each process keeps an index
+per area and model (and one for the areas' own ranges), loaded from the
+(area, vnum) unique index the first time it's needed and kept up to date by
+the signal handlers at the bottom.
+
+Another process may have used a vnum this process's index still thinks is
+free, so allocate() locks the area row, checks its answer against the
+database and reloads the index if it was wrong.
+"""
+from bisect import bisect_right
+
+from django.db import transaction
+from django.db.models import F
+
+from core.commits import commit_on_success
+from core.models import VNUMS_PER_AREA, Area, Item, Mobile, Room
+
+
+# Models whose vnums are allocated per area. Every item type shares Item's.
+VNUM_MODELS = (Item, Mobile, Room)
+
+_indexes = {}
+
+
+class VnumError(Exception):
+    pass
+
+
+class IntervalIndex(object):
+    """
+    A set of integers stored as sorted, disjoint, non-adjacent ranges.
+    """
+    def __init__(self, numbers=()):
+        self.starts = []
+        self.ends = []
+        for number in sorted(numbers):
+            if self.ends and number <= self.ends[-1] + 1:
+                self.ends[-1] = max(self.ends[-1], number)
+            else:
+                self.starts.append(number)
+                self.ends.append(number)
+
+    def __contains__(self, number):
+        i = bisect_right(self.starts, number) - 1
+        return i >= 0 and self.ends[i] >= number
+
+    def __iter__(self):
+        return iter(zip(self.starts, self.ends))
+
+    def add(self, start, end=None):
+        """
+        Adds the range start-end (inclusive), merging it with its neighbours.
+        """
+        if end is None:
+            end = start
+        first = bisect_right(self.starts, start - 1) - 1
+        if first < 0 or self.ends[first] < start - 1:
+            first += 1
+        last = bisect_right(self.starts, end + 1) - 1
+        if first <= last:
+            start = min(start, self.starts[first])
+            end = max(end, self.ends[last])
+        self.starts[first:last + 1] = [start]
+        self.ends[first:last + 1] = [end]
+
+    def remove(self, number):
+        i = bisect_right(self.starts, number) - 1
+        if i < 0 or self.ends[i] < number:
+            return
+        start, end = self.starts[i], self.ends[i]
+        pieces = [(low, high) for low, high in ((start, number - 1), (number + 1, end)) if low <= high]
+        self.starts[i:i + 1] = [low for low, high in pieces]
+        self.ends[i:i + 1] = [high for low, high in pieces]
+
+    def find_free(self, low, high, count=1):
+        """
+        Returns the first number of the lowest run of ``count`` free numbers
+        between ``low`` and ``high``, or None if there isn't one. A single
+        number is a bisect away; a longer run walks the gaps from ``low``,
+        so takes time linear in the ranges it passes.
+        """
+        i = bisect_right(self.starts, low) - 1
+        candidate = low
+        if i >= 0 and self.ends[i] >= low:
+            candidate = self.ends[i] + 1
+        i += 1
+        while candidate + count - 1 <= high:
+            if i == len(self.starts) or self.starts[i] > candidate + count - 1:
+                return candidate
+            candidate = self.ends[i] + 1
+            i += 1
+        return None
+
+
+### Indexes ###
+def vnum_model(model):
+    """
+    Returns the model whose vnums ``model``'s share (Item for item types).
+    """
+    for base in VNUM_MODELS:
+        if issubclass(model, base):
+            return base
+    raise VnumError('%s has no per-area vnums' % (model.__name__))
+
+
+def load_index(model, area_pk):
+    if model is Area:
+        index = IntervalIndex()
+        for vnum in Area.objects.values_list('vnum', flat=True):
+            index.add(vnum, vnum + VNUMS_PER_AREA - 1)
+    else:
+        index = IntervalIndex(model._base_manager.filter(area=area_pk).values_list('vnum', flat=True))
+    _indexes[model, area_pk] = index
+    return index
+
+
+def vnum_index(model, area_pk=None):
+    """
+    Returns this process's IntervalIndex of the used vnums of ``model`` in
+    an area, or of the areas' ranges if ``model`` is Area.
+    """
+    if model is not Area:
+        model = vnum_model(model)
+    index = _indexes.get((model, area_pk))
+    if index is None:
+        index = load_index(model, area_pk)
+    return index
+
+
+def forget_indexes():
+    """
+    Drops every loaded index, e.g. after a rollback.
+    """
+    _indexes.clear()
+
+
+### Allocation ###
+def lock_area(area):
+    """
+    Takes the area's row lock until the current transaction ends, by
+    writing the row without changing it. On SQLite this takes the database
+    write lock.
+    """
+    Area.objects.filter(pk=area.pk).update(vnum=F('vnum'))
+
+
+def allocate(area, model, count=1):
+    """
+    Returns the first vnum of the lowest block of ``count`` free vnums for
+    ``model`` in ``area``, and marks them used. Raises VnumError if the
+    area has no such block.
+
+    Must run inside a managed transaction that also creates the rows, so
+    that nobody else takes the same vnums before they exist.
+    """
+    if not transaction.is_managed():
+        raise transaction.TransactionManagementError('allocate() needs a managed transaction')
+    model = vnum_model(model)
+    low, high = area.vnum_range()
+    lock_area(area)
+    index = vnum_index(model, area.pk)
+    for attempt in range(2):
+        start = index.find_free(low, high, count)
+        if start is None:
+            raise VnumError('area %d has no %d free %s vnums' % (area.vnum, count, model._meta.verbose_name))
+        if not model._base_manager.filter(area=area, vnum__range=(start, start + count - 1)).exists():
+            break
+        # Another process has used vnums this index doesn't know about.
+        index = load_index(model, area.pk)
+    else:
+        raise VnumError('vnum index for area %d is out of date' % (area.vnum))
+    index.add(start, start + count - 1)
+    return start
+
+
+@commit_on_success
+def create(model, area, **fields):
+    """
+    Creates a ``model`` in ``area`` with the next free vnum.
+    """
+    return model.objects.create(area=area, vnum=allocate(area, model), **fields)
+
+
+def next_area_vnum(start=VNUMS_PER_AREA):
+    """
+    Returns the lowest vnum from ``start`` up whose range doesn't overlap
+    an existing area's. Area.vnum is unique, so creating two areas with the
+    same answer fails rather than overlapping.
+    """
+    index = vnum_index(Area)
+    high = 2 ** 31 - 1
+    vnum = index.find_free(start, high, VNUMS_PER_AREA)
+    # Keep areas on multiples of VNUMS_PER_AREA.
+    while vnum is not None and vnum % VNUMS_PER_AREA:
+        vnum = index.find_free(vnum + VNUMS_PER_AREA - vnum % VNUMS_PER_AREA, high, VNUMS_PER_AREA)
+    if vnum is None:
+        raise VnumError('no free area vnums')
+    return vnum
+
+
+### Signals ###
+def vnum_saved(sender, instance, **kwargs):
+    if isinstance(instance, Area):
+        index = _indexes.get((Area, None))
+        if index is not None:
+            index.add(instance.vnum, instance.vnum + VNUMS_PER_AREA - 1)
+    elif isinstance(instance, VNUM_MODELS):
+        index = _indexes.get((vnum_model(type(instance)), instance.area_id))
+        if index is not None:
+            index.add(instance.vnum)
+
+
+def vnum_deleted(sender, instance, **kwargs):
+    if isinstance(instance, Area):
+        for model in VNUM_MODELS:
+            _indexes.pop((model, instance.pk), None)
+        _indexes.pop((Area, None), None)
+    elif isinstance(instance, VNUM_MODELS):
+        index = _indexes.get((vnum_model(type(instance)), instance.area_id))
+        if index is not None:
+            index.remove(instance.vnum)
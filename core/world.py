@@ -0,0 +1,139 @@
+"""
+The whole world as one installable bundle.
+
+check_world() looks for conflicts between areas that no single area's lint
+can see: overlapping vnum ranges, rows numbered outside their area's range,
+and exits into rooms that won't be in the bundle. write_bundle() exports
+the areas in a process pool, one area per task, and streams the files into
+a gzipped tar archive as they arrive, in vnum order, followed by the
+area.lst that lists them for the game.
+"""
+import tarfile
+import time
+from cStringIO import StringIO
+from multiprocessing import Pool
+
+from django.db import connection
+from django.db.models import F, Q
+from django.template.defaultfilters import slugify
+
+from core.export_cache import CachedAreaExporter
+from core.lint import ERROR, Diagnostic
+from core.lists import DIRECTION_CHOICES
+from core.models import VNUMS_PER_AREA, Area, Door, Item, Mobile, Room
+
+
+DIRECTIONS = dict(DIRECTION_CHOICES)
+
+# Directory the area files are unpacked into, next to the game's src.
+BUNDLE_DIR = 'area'
+
+
+### Checks ###
+def area_overlaps(areas):
+    previous = None
+    for area in areas:
+        if previous is not None and area.vnum <= previous.vnum + VNUMS_PER_AREA - 1:
+            yield Diagnostic(ERROR, area.vnum, 'area', area.pk, 'area_overlap',
+                             'vnums %d-%d overlap area %d' % (area.vnum, area.vnum + VNUMS_PER_AREA - 1, previous.vnum))
+        previous = area
+
+
+def vnums_out_of_range(pks):
+    # One query per table.
+    for model in (Room, Mobile, Item):
+        outside = (model.objects.filter(area__in=pks)
+                   .filter(Q(vnum__lt=F('area__vnum')) | Q(vnum__gt=F('area__vnum') + VNUMS_PER_AREA - 1))
+                   .order_by('area__vnum', 'vnum')
+                   .values_list('pk', 'vnum', 'area__vnum'))
+        name = model._meta.verbose_name
+        for pk, vnum, area_vnum in outside:
+            yield Diagnostic(ERROR, area_vnum, name, pk, 'vnum_range',
+                             '%s %d is outside the area\'s vnums' % (name, vnum))
+
+
+def exits_out_of_bundle(pks):
+    """
+    Exits into rooms that are missing, or in areas that aren't bundled.
+    """
+    bundled = set(pks)
+    exits = (Door.objects.filter(room__area__in=pks, room_to__isnull=False)
+             .order_by('room__area__vnum', 'room__vnum', 'direction')
+             .values_list('pk', 'room__area__vnum', 'room__vnum', 'direction', 'room_to', 'room_to__vnum',
+                          'room_to__area', 'room_to__area__vnum'))
+    for pk, area_vnum, vnum, direction, room_to, to_vnum, to_area, to_area_vnum in exits.iterator():
+        if to_vnum is None:
+            message = '%s exit from room %d leads to missing room %d' % (DIRECTIONS[int(direction)], vnum, room_to)
+        elif to_area not in bundled:
+            message = '%s exit from room %d leads into area %d, which isn\'t bundled' % (
+                DIRECTIONS[int(direction)], vnum, to_area_vnum)
+        else:
+            continue
+        yield Diagnostic(ERROR, area_vnum, 'door', pk, 'world_exit', message)
+
+
+def check_world(areas=None):
+    """
+    Returns a list of Diagnostics for conflicts between ``areas`` (every
+    area by default).
+    """
+    if areas is None:
+        areas = Area.objects.all()
+    areas = list(areas.order_by('vnum'))
+    pks = [area.pk for area in areas]
+    found = list(area_overlaps(areas))
+    found.extend(vnums_out_of_range(pks))
+    found.extend(exits_out_of_bundle(pks))
+    return found
+
+
+### Bundling ###
+def export_area_pk(pk):
+    area = Area.objects.select_related('author').get(pk=pk)
+    return area.vnum, area.name, u''.join(CachedAreaExporter(area)).encode('utf-8')
+
+
+def add_file(archive, name, data, mtime):
+    info = tarfile.TarInfo('%s/%s' % (BUNDLE_DIR, name))
+    info.size = len(data)
+    info.mtime = mtime
+    info.mode = 0644
+    archive.addfile(info, StringIO(data))
+
+
+def write_bundle(output, areas=None, processes=None):
+    """
+    Writes ``areas`` (every area by default) and their area.lst as a
+    gzipped tar archive to the file-like ``output``, which needn't be
+    seekable. Areas are exported by a pool of ``processes`` workers (one
+    per CPU by default), or in this process if ``processes`` is 1. Returns
+    the file names in area.lst order.
+    """
+    if areas is None:
+        areas = Area.objects.all()
+    pks = list(areas.order_by('vnum').values_list('pk', flat=True))
+    mtime = time.time()
+    names = []
+    archive = tarfile.open(fileobj=output, mode='w|gz')
+    pool = None
+    try:
+        if processes == 1:
+            results = (export_area_pk(pk) for pk in pks)
+        else:
+            # Workers are forked, and mustn't share this process's connection.
+            connection.close()
+            pool = Pool(processes)
+            results = pool.imap(export_area_pk, pks, chunksize=1)
+        for vnum, name, data in results:
+            filename = '%s.are' % (slugify(name) or vnum)
+            if filename in names:
+                filename = '%s-%d.are' % (filename[:-4], vnum)
+            names.append(filename)
+            add_file(archive, filename, data, mtime)
+        add_file(archive, 'area.lst', ''.join('%s\n' % (filename) for filename in names) + '$\n', mtime)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        archive.close()
+    return names
@@ -9,6 +9,7 @@ urlpatterns = patterns('',
     # url(r'^$', 'dragondrop.views.home', name='home'),
     # url(r'^dragondrop/', include('dragondrop.foo.urls')),
 
+    url(r'^', include('core.urls')),
     url(r'^admin/doc/', include('django.contrib.admindocs.urls')),
     url(r'^admin/', include(admin.site.urls)),
 )